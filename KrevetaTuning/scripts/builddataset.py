@@ -0,0 +1,118 @@
+import argparse
+import os
+import time
+
+from uciasync import AsyncEnginePool
+
+# ---------------- Settings ----------------
+
+# The reference dataset of the C# tuner (Program.GenerateStockfishOutputs):
+# every position of positions.txt searched to depth 20 by Stockfish, written
+# as "fen;eval;bestmove" with the eval clamped to +-1000. The engines are
+# started once and kept warm, and the search state is reset with ucinewgame
+# before every position instead of starting a new process
+STOCKFISH_PATH = "C:\\Users\\michn\\Downloads\\stockfish-windows-x86-64-avx2\\stockfish\\stockfish-windows-x86-64-avx2.exe"
+
+DEPTH      = 20
+EVAL_CLAMP = 1000
+TIMEOUT    = 600.0
+
+
+def load_positions(path):
+    with open(path, "r") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+# positions already in the output, so that an interrupted run only searches
+# the rest (and a failed position is retried)
+def done_positions(path):
+    if not os.path.exists(path):
+        return set()
+
+    with open(path, "r") as f:
+        lines = f.readlines()
+
+    # a line cut off mid-write is dropped and searched again
+    if lines and not lines[-1].endswith("\n"):
+        lines = lines[:-1]
+        with open(path, "w") as f:
+            f.writelines(lines)
+    return {line.split(";", 1)[0] for line in lines}
+
+
+def build(pool, fens, out_path, depth):
+    limit = f"depth {depth}"
+
+    async def evaluate(engine, fen):
+        engine.send("ucinewgame")
+        return await engine.analyse(fen, limit, mate_score=EVAL_CLAMP)
+
+    works   = [lambda engine, fen=fen: evaluate(engine, fen) for fen in fens]
+    pending = {}
+    written = 0
+    failed  = 0
+    start   = time.perf_counter()
+
+    # results come back in any order, the file is kept in input order
+    with open(out_path, "a") as out:
+        for job, result in pool.stream(works):
+            pending[job] = result
+            if written not in pending:
+                continue
+
+            while written in pending:
+                result = pending.pop(written)
+                fen    = fens[written]
+
+                if result is None:
+                    failed += 1
+                else:
+                    score, move = result
+                    out.write(f"{fen};{max(-EVAL_CLAMP, min(EVAL_CLAMP, score))};{move}\n")
+                    out.flush()
+
+                written += 1
+
+            elapsed = time.perf_counter() - start
+            print(f"Finished: {written}/{len(fens)} ({written / elapsed:.2f}/s)\r", end="")
+
+    print()
+    return written - failed, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="generate the Stockfish reference dataset of the tuner")
+    parser.add_argument("--engine",    default=STOCKFISH_PATH)
+    parser.add_argument("--positions", default="positions.txt")
+    parser.add_argument("--out",       default="dataset.txt")
+    parser.add_argument("--depth",     type=int,   default=DEPTH)
+    parser.add_argument("--engines",   type=int,   default=os.cpu_count(), help="engine processes, one thread each")
+    parser.add_argument("--hash",      type=int,   default=16, help="hash size per engine in MB")
+    parser.add_argument("--timeout",   type=float, default=TIMEOUT, help="seconds per position before an engine counts as hung")
+    args = parser.parse_args()
+
+    fens = load_positions(args.positions)
+    done = done_positions(args.out)
+    todo = [fen for fen in fens if fen not in done]
+
+    if not todo:
+        print(f"{args.out} already holds all {len(fens)} positions")
+        return
+    if done:
+        print(f"{args.out} holds {len(fens) - len(todo)} of the positions, continuing")
+
+    pool = AsyncEnginePool([args.engine], workers=min(args.engines, len(todo)),
+                           search_timeout=args.timeout, options={"Threads": 1, "Hash": args.hash})
+
+    start = time.perf_counter()
+    try:
+        searched, failed = build(pool, todo, args.out, args.depth)
+    finally:
+        pool.close()
+
+    print(f"Done generating Stockfish outputs: {searched} positions in {time.perf_counter() - start:.1f}s"
+          + (f", {failed} failed" if failed else ""))
+
+
+if __name__ == "__main__":
+    main()
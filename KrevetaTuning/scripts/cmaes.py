@@ -0,0 +1,197 @@
+import argparse
+import math
+import os
+import random
+import time
+
+import numpy as np
+
+import moveordertune as mot
+from tunehistory import History
+
+# ---------------- sep-CMA-ES ----------------
+
+# Separable CMA-ES (Ros & Hansen, 2008): an evolution strategy that samples a
+# whole generation of candidates from a Gaussian, keeps the best half and
+# moves the mean, the per-parameter variances and the global step size
+# towards them. Only the diagonal of the covariance is adapted, which is
+# linear in the number of parameters and needs few generations to learn.
+#
+# A generation is evaluated at once on the engine pool (every candidate on
+# the same positions, so their ranking is fair), and with a deterministic
+# search mode the fitness cache catches every repeated candidate. Like in
+# spsa.py the parameters are normalized by their initial magnitude.
+
+class SepCMAES:
+    def __init__(self, params, sigma=0.02, popsize=None, seed=None):
+        n = len(params)
+
+        self.scale = np.array([max(abs(p), 1) for p in params], dtype=float)
+        self.mean  = np.array(params, dtype=float) / self.scale
+        self.sigma = sigma
+        self.n     = n
+        self.g     = 0
+        self.rng   = np.random.default_rng(seed)
+
+        self.popsize = popsize or 4 + int(3 * math.log(n))
+        self.mu      = self.popsize // 2
+
+        w = np.log(self.mu + 0.5) - np.log(np.arange(1, self.mu + 1))
+        self.weights = w / w.sum()
+        self.mu_eff  = 1 / np.sum(self.weights ** 2)
+
+        self.c_sigma = (self.mu_eff + 2) / (n + self.mu_eff + 5)
+        self.d_sigma = 1 + 2 * max(0.0, math.sqrt((self.mu_eff - 1) / (n + 1)) - 1) + self.c_sigma
+        self.c_c     = (4 + self.mu_eff / n) / (n + 4 + 2 * self.mu_eff / n)
+
+        # the separable variant can learn (n + 2) / 3 times faster
+        c_1  = 2 / ((n + 1.3) ** 2 + self.mu_eff)
+        c_mu = 2 * (self.mu_eff - 2 + 1 / self.mu_eff) / ((n + 2) ** 2 + self.mu_eff)
+        self.c_1  = c_1 * (n + 2) / 3
+        self.c_mu = min(1 - self.c_1, c_mu * (n + 2) / 3)
+
+        self.chi_n   = math.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n * n))
+        self.C       = np.ones(n)
+        self.p_sigma = np.zeros(n)
+        self.p_c     = np.zeros(n)
+        self.ys      = None
+
+    def to_params(self, x):
+        return [int(v) for v in np.rint(x * self.scale)]
+
+    def params(self):
+        return self.to_params(self.mean)
+
+    def ask(self):
+        self.ys = self.rng.standard_normal((self.popsize, self.n)) * np.sqrt(self.C)
+        return [self.to_params(self.mean + self.sigma * y) for y in self.ys]
+
+    # fitness is maximized
+    def tell(self, fitness):
+        order = np.argsort(-np.asarray(fitness))[:self.mu]
+        y_sel = self.ys[order]
+        y_w   = self.weights @ y_sel
+
+        self.mean = self.mean + self.sigma * y_w
+
+        self.p_sigma = ((1 - self.c_sigma) * self.p_sigma
+            + math.sqrt(self.c_sigma * (2 - self.c_sigma) * self.mu_eff) * y_w / np.sqrt(self.C))
+
+        norm  = np.linalg.norm(self.p_sigma)
+        h_sig = norm / math.sqrt(1 - (1 - self.c_sigma) ** (2 * (self.g + 1))) < (1.4 + 2 / (self.n + 1)) * self.chi_n
+
+        self.p_c = (1 - self.c_c) * self.p_c + h_sig * math.sqrt(self.c_c * (2 - self.c_c) * self.mu_eff) * y_w
+
+        self.C = ((1 - self.c_1 - self.c_mu) * self.C
+            + self.c_1 * (self.p_c ** 2 + (1 - h_sig) * self.c_c * (2 - self.c_c) * self.C)
+            + self.c_mu * self.weights @ (y_sel ** 2))
+
+        self.sigma *= math.exp(self.c_sigma / self.d_sigma * (norm / self.chi_n - 1))
+        self.g     += 1
+
+    def state(self):
+        return {
+            "g":       self.g,
+            "mean":    self.mean.tolist(),
+            "sigma":   self.sigma,
+            "C":       self.C.tolist(),
+            "p_sigma": self.p_sigma.tolist(),
+            "p_c":     self.p_c.tolist(),
+            "rng":     self.rng.bit_generator.state
+        }
+
+    def restore(self, state):
+        self.g       = state["g"]
+        self.mean    = np.array(state["mean"])
+        self.sigma   = state["sigma"]
+        self.C       = np.array(state["C"])
+        self.p_sigma = np.array(state["p_sigma"])
+        self.p_c     = np.array(state["p_c"])
+
+        # the sampler too, so that a resumed --seed run asks for the same
+        # candidates as an uninterrupted one would have
+        if "rng" in state:
+            self.rng.bit_generator.state = state["rng"]
+
+# ---------------- Main loop ----------------
+
+def main():
+    parser = argparse.ArgumentParser(description="sep-CMA-ES tuning of the move ordering parameters")
+    parser.add_argument("--engine",      default=mot.ENGINE_CMD)
+    parser.add_argument("--positions",   default="positions.txt")
+    parser.add_argument("--workers",     type=int,   default=os.cpu_count(), help="engine processes")
+    parser.add_argument("--popsize",     type=int,   default=None, help="candidates per generation, 4 + 3 ln(n) by default")
+    parser.add_argument("--generations", type=int,   default=100)
+    parser.add_argument("--sigma",       type=float, default=0.02, help="initial relative step size")
+    parser.add_argument("--eval-every",  type=int,   default=5,    help="measure the mean every this many generations")
+    parser.add_argument("--history",     default="cmaes_history.jsonl")
+    parser.add_argument("--resume",      action="store_true", help="continue the run recorded in --history")
+    parser.add_argument("--seed",        type=int,   default=None)
+    args = parser.parse_args()
+
+    history = History(args.history)
+    last    = history.last_step()
+
+    if last is not None and not args.resume:
+        print(f"{args.history} already holds a run, continue it with --resume or pick another --history")
+        return
+
+    fens = mot.load_fens(args.positions)
+    if mot.deterministic():
+        random.Random(mot.POSITION_SEED).shuffle(fens)
+    else:
+        random.shuffle(fens)
+
+    pool  = mot.make_pool([args.engine], workers=args.workers)
+    cache = mot.FitnessCache(mot.CACHE_PATH, fens, pool.workers) if mot.deterministic() else None
+
+    es = SepCMAES(mot.INITIAL_PARAMS, sigma=args.sigma, popsize=args.popsize, seed=args.seed)
+
+    # the best candidate ever evaluated, kept next to the distribution - the
+    # mean is not always better than the candidates it came from
+    if last is not None:
+        es.restore(last["es"])
+        best, best_score = last["params"], last["score"]
+        print(f"Resumed at generation {es.g} with best score {best_score:.4f}")
+    else:
+        best       = es.params()
+        best_score = mot.evaluate_parallel(pool, best, fens, cache, history)
+        history.step(0, best, best_score, es=es.state())
+        print("Initial score:", best_score)
+
+    print(f"Population {es.popsize}, {es.mu} parents, {pool.workers} engines")
+    start = time.perf_counter()
+
+    while es.g < args.generations:
+        candidates = es.ask()
+
+        # rounding can make candidates equal, each is searched only once
+        unique  = list({tuple(c): c for c in candidates}.values())
+        scores  = dict(zip(map(tuple, unique), mot.evaluate_many(pool, unique, fens, cache, history)))
+        fitness = [scores[tuple(c)] for c in candidates]
+
+        es.tell(fitness)
+
+        top = int(np.argmax(fitness))
+        if fitness[top] > best_score:
+            best, best_score = candidates[top], fitness[top]
+            print(f"[{es.g}] NEW BEST {best_score:.4f} params: {best}")
+
+        print(f"[{es.g}] best {max(fitness):.4f} mean {sum(fitness) / len(fitness):.4f} "
+              f"sigma {es.sigma:.4f} ({len(unique)} unique) mean params: {es.params()}")
+
+        if args.eval_every and es.g % args.eval_every == 0:
+            score = mot.evaluate_parallel(pool, es.params(), fens, cache, history)
+            print(f"[{es.g}] MEAN SCORE {score:.4f} after {(time.perf_counter() - start) / 3600:.2f} h")
+
+            if score > best_score:
+                best, best_score = es.params(), score
+
+        history.step(es.g, best, best_score, es=es.state())
+
+    pool.close()
+    print("Final params:", best)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,67 @@
+import argparse
 import subprocess
 import random
-from multiprocessing import Process, Queue
-import multiprocessing as mp
+import math
+import time
+import threading
+import hashlib
+import json
+import os
+import queue as queue_mod
+
+from tunehistory import History
+
+# ---------------- Search settings ----------------
+
+# "movetime" searches 200-500 ms per position, which depends on the machine load
+# and needs periodic re-evaluation. "nodes" and "depth" are deterministic - the
+# same parameters on the same positions always give the same fitness, so the
+# results are cached (persistently, in CACHE_PATH) and never searched twice
+SEARCH_MODE  = "nodes"
+SEARCH_NODES = 20000
+SEARCH_DEPTH = 8
+
+CACHE_PATH    = "fitness_cache.jsonl"
+HISTORY_PATH  = "tune_history.jsonl"
+POSITION_SEED = 1
+
+# Racing (deterministic modes only): candidates are searched position by
+# position against the incumbent's per-position fitness and dropped as soon
+# as a Hoeffding bound says they can't match it (with probability RACE_DELTA
+# of dropping one that would have - the bound is checked after every position,
+# so each check gets RACE_DELTA / positions). The fitness then becomes the mean
+# of the per-position score/count, every position searched from a fresh
+# engine state
+RACING             = True
+RACE_DELTA         = 0.05
+RACE_MIN_POSITIONS = 32
+
+# Drive the engines from one asyncio event loop (uciasync.py), with timeouts
+# that replace a hung engine, instead of a blocking thread per engine
+ASYNC_ENGINES = True
+
+# A restarted engine that fails to start is tried again after RESTART_BACKOFF
+# seconds, doubling, up to RESTART_ATTEMPTS times
+RESTART_ATTEMPTS = 5
+RESTART_BACKOFF  = 0.5
+
+ENGINE_CMD = "C:\\Users\\michn\\Desktop\\Kreveta\\Kreveta\\Kreveta\\bin\\Release\\net10.0\\Kreveta.exe"
+
+INITIAL_PARAMS = [1435, 1032, 1079, 58, 664, -238, 94, -695, 130, 110, -31, 49, -43, 33, 222, 216, 108, 180]
+
+
+def deterministic():
+    return SEARCH_MODE != "movetime"
+
+
+def go_args():
+    if SEARCH_MODE == "nodes":
+        return f"nodes {SEARCH_NODES}"
+    if SEARCH_MODE == "depth":
+        return f"depth {SEARCH_DEPTH}"
+
+    # Small random jitter avoids pathological synchronization
+    return f"movetime {random.randint(200, 500)}"
 
 # ---------------- Engine wrapper ----------------
 
@@ -15,31 +75,70 @@ class Engine:
             text=True,
             bufsize=1
         )
-        self.send("uci")
-        self.wait("uciok")
 
-        if tune:
-            self.send(f"tune {' '.join(map(str, tune))}")
+        # a process that fails the handshake isn't left behind
+        try:
+            self.send("uci")
+            self.wait("uciok")
 
-        self.send("isready")
-        self.wait("readyok")
+            self.params = None
+            if tune:
+                self.send(f"tune {' '.join(map(str, tune))}")
+                self.params = list(tune)
+
+            self.send("isready")
+            self.wait("readyok")
+        except Exception:
+            self.p.kill()
+            raise
 
     def send(self, cmd):
         self.p.stdin.write(cmd + "\n")
         self.p.stdin.flush()
 
+    def readline(self):
+        line = self.p.stdout.readline()
+        if not line:
+            raise EOFError("engine process died")
+        return line
+
     def wait(self, token):
         while True:
-            line = self.p.stdout.readline()
+            line = self.readline()
             if token in line:
                 break
 
-    def search_fen(self, fen, movetime):
+    # new parameters for the next candidate. the search state of the previous
+    # one is cleared and the tuning counters are read once, which resets them
+    def set_params(self, tune):
+        self.send(f"tune {' '.join(map(str, tune))}")
+        self.send("ucinewgame")
+        self.get_tuning()
+        self.params = list(tune)
+
+    # score and count of a single position, searched from a cleared state so
+    # that the result doesn't depend on what the engine searched before
+    def search_position(self, tune, fen):
+        if self.params != list(tune):
+            self.send(f"tune {' '.join(map(str, tune))}")
+            self.params = list(tune)
+
+        self.send("ucinewgame")
+        self.get_tuning()
+
+        t0 = time.perf_counter()
+        self.search_fen(fen, go_args())
+        t1 = time.perf_counter()
+
+        score, count = self.get_tuning()
+        return score, count, t1 - t0
+
+    def search_fen(self, fen, limit):
         self.send(f"position fen {fen}")
-        self.send(f"go movetime {movetime}")
+        self.send(f"go {limit}")
 
         while True:
-            line = self.p.stdout.readline()
+            line = self.readline()
             if line.startswith("bestmove"):
                 break
 
@@ -49,7 +148,7 @@ class Engine:
 
         score = count = 0
         while True:
-            line = self.p.stdout.readline()
+            line = self.readline()
             if "TUNE score" in line:
                 score = int(line.split()[-1])
             elif "TUNE count" in line:
@@ -59,50 +158,378 @@ class Engine:
         return score, count
 
     def quit(self):
-        self.send("quit")
-        self.p.wait()
-
-# ---------------- Evaluation ----------------
-
-def evaluate_worker_queue(cmd, params, fens, queue):
-    engine = Engine(cmd, params)
-
-    for fen in fens:
-        # Small random jitter avoids pathological synchronization
-        movetime = random.randint(200, 500)
-        engine.search_fen(fen, movetime)
-
-    score, count = engine.get_tuning()
-    engine.quit()
-    queue.put((score, count))
-
-
-def evaluate_parallel(cmd, params, fens, workers=8):
-    queue = Queue()
-    processes = []
-
-    # Split positions evenly
-    chunks = [fens[i::workers] for i in range(workers)]
-
-    for i in range(workers):
-        p = Process(
-            target=evaluate_worker_queue,
-            args=(cmd, params, chunks[i], queue)
-        )
-        p.start()
-        processes.append(p)
-
-    results = [queue.get() for _ in processes]
+        try:
+            self.send("quit")
+            self.p.wait(timeout=5)
+        except Exception:
+            self.p.kill()
+
+# ---------------- Engine pool ----------------
+
+# Long-lived engines, one thread each (the threads only wait on pipes).
+# The engines are started once and reused for every candidate, only the
+# tune parameters change. A dead engine is restarted and its task re-run.
+# A task is any function of the engine - a chunk of positions or, when
+# racing, a single position. Every task posts a result (None when it
+# failed), so run() and stream() return even when no engine can be started.
+class EnginePool:
+    def __init__(self, cmd, workers=8):
+        self.cmd     = cmd
+        self.workers = workers
+        self.tasks   = queue_mod.Queue()
+        self.results = queue_mod.Queue()
+        self.failed  = 0
+
+        start = time.perf_counter()
+        self.engines = [Engine(cmd) for _ in range(workers)]
+        self.startup = time.perf_counter() - start
+
+        self.threads = [
+            threading.Thread(target=self._serve, args=(i,), daemon=True)
+            for i in range(workers)
+        ]
+        for t in self.threads:
+            t.start()
+
+        print(f"Started {workers} engines in {self.startup:.2f}s (paid once instead of per candidate)")
+
+    def _run(self, engine, params, fens):
+        t0 = time.perf_counter()
+        engine.set_params(params)
+        t1 = time.perf_counter()
+
+        for fen in fens:
+            engine.search_fen(fen, go_args())
+        t2 = time.perf_counter()
+
+        score, count = engine.get_tuning()
+        t3 = time.perf_counter()
+
+        return score, count, (t1 - t0) + (t3 - t2), t2 - t1
+
+    # replaces engine i, retrying a failed start with a growing delay. when
+    # every attempt fails the slot is left empty and tried again with the
+    # thread's next task
+    def _restart(self, i):
+        if self.engines[i] is not None:
+            self.engines[i].quit()
+            self.engines[i] = None
+
+        delay = RESTART_BACKOFF
+        for attempt in range(RESTART_ATTEMPTS):
+            try:
+                self.engines[i] = Engine(self.cmd)
+                return True
+            except (EOFError, OSError) as e:
+                print(f"    engine {i}: restart failed ({e}), attempt {attempt + 1}/{RESTART_ATTEMPTS}")
+
+            if attempt + 1 < RESTART_ATTEMPTS:
+                time.sleep(delay)
+                delay *= 2
+        return False
+
+    def _serve(self, i):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
 
-    for p in processes:
-        p.join()
+            job, work = task
+            result = None
+            try:
+                for attempt in range(2):
+                    if self.engines[i] is None and not self._restart(i):
+                        break
+                    try:
+                        result = work(self.engines[i])
+                        break
+                    except (EOFError, OSError) as e:
+                        print(f"    engine {i}: {e}, restarting it")
+                        result = None
+                        if not self._restart(i):
+                            break
+            except Exception as e:
+                # the pipe may be left mid-answer, so the engine is restarted too
+                print(f"    engine {i}: task {job} failed ({e!r}), restarting the engine")
+                result = None
+                self._restart(i)
+            finally:
+                if result is None:
+                    self.failed += 1
+                self.results.put((job, result))
+
+    # queues all the works and yields (job, result) in completion order,
+    # the result is None when the task failed on a restarted engine too
+    def stream(self, works):
+        for job, work in enumerate(works):
+            self.tasks.put((job, work))
+
+        for _ in works:
+            yield self.results.get()
+
+    # runs every (params, fens) job on the pool, results in job order. a
+    # failed job is None, never a made-up score - the caller decides whether
+    # to retry it or to do without it
+    def run(self, jobs):
+        works = [
+            lambda engine, params=params, fens=fens: self._run(engine, params, fens)
+            for params, fens in jobs
+        ]
+
+        results = [None] * len(jobs)
+        for job, result in self.stream(works):
+            results[job] = result
+        return results
+
+    def close(self):
+        for _ in self.threads:
+            self.tasks.put(None)
+        for t in self.threads:
+            t.join()
+        for e in self.engines:
+            if e is not None:
+                e.quit()
+
+
+def make_pool(cmd, workers=8):
+    if ASYNC_ENGINES:
+        from uciasync import AsyncEnginePool
+        return AsyncEnginePool(cmd, workers=workers, go_args=go_args)
+    return EnginePool(cmd, workers=workers)
+
+# ---------------- Fitness cache ----------------
+
+# Append-only JSONL of (key, fitness). The key covers everything the fitness
+# depends on: parameters, the ordered position set, the search limit and the
+# number of engines (it decides how positions are split into chunks). Per-position
+# fitness (racing) doesn't depend on the engines, and its entries also keep
+# the per-position values a later race compares against
+class FitnessCache:
+    def __init__(self, path, fens, workers, per_position=False):
+        self.path    = path
+        self.entries = {}
+        self.hits    = 0
+        self.lookups = 0
+
+        context = {
+            "positions": hashlib.sha1("\n".join(fens).encode()).hexdigest(),
+            "mode":      SEARCH_MODE,
+            "limit":     go_args(),
+            "workers":   workers
+        }
+        if per_position:
+            context["workers"]      = None
+            context["per_position"] = True
+        self.context = json.dumps(context, sort_keys=True)
+
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry
+                    except (ValueError, KeyError):
+                        continue
+
+    def key(self, params):
+        return hashlib.sha1((self.context + json.dumps(list(params))).encode()).hexdigest()
+
+    def get(self, params):
+        self.lookups += 1
+        entry = self.entries.get(self.key(params))
+        if entry is None:
+            return None
+
+        self.hits += 1
+        return entry["fitness"]
+
+    def values(self, params):
+        entry = self.entries.get(self.key(params))
+        return entry.get("values") if entry is not None else None
+
+    def put(self, params, fitness, values=None):
+        entry = {"key": self.key(params), "fitness": fitness, "params": list(params)}
+        if values is not None:
+            entry["values"] = values
+        self.entries[entry["key"]] = entry
+
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def hit_rate(self):
+        return f"cache hits {self.hits}/{self.lookups} ({100 * self.hits / max(1, self.lookups):.1f}%)"
 
-    fitness_values = [
-        s / c if c > 0 else 0
-        for s, c in results
-    ]
+# ---------------- Evaluation ----------------
 
-    return sum(fitness_values) / len(fitness_values)
+def evaluate_many(pool, candidates, fens, cache=None, history=None):
+    fitness = [cache.get(params) if cache is not None else None for params in candidates]
+    pending = [i for i, f in enumerate(fitness) if f is None]
+
+    if cache is not None and len(pending) < len(candidates):
+        print(f"    {len(candidates) - len(pending)} cached, {cache.hit_rate()}")
+
+    if not pending:
+        return fitness
+
+    start = time.perf_counter()
+
+    # Split positions evenly, every candidate into the same chunks. all the
+    # chunks of all candidates are queued at once, so no engine sits idle
+    chunks  = [fens[i::pool.workers] for i in range(pool.workers)]
+    jobs    = [(candidates[i], chunk) for i in pending for chunk in chunks]
+    results = pool.run(jobs)
+
+    # a chunk that failed (None, its engine died twice) is queued once more
+    failed = [j for j, r in enumerate(results) if r is None]
+    if failed:
+        print(f"    {len(failed)} chunks failed, retrying them")
+        for j, r in zip(failed, pool.run([jobs[j] for j in failed])):
+            results[j] = r
+
+    done   = [r for r in results if r is not None]
+    wall   = time.perf_counter() - start
+    busy   = sum(r[3] for r in done) / pool.workers
+    setup  = sum(r[2] for r in done) / max(1, len(done))
+
+    # whatever the engines didn't spend searching is overhead
+    print(f"    {len(pending)} candidates, time {wall:.2f}s: search {busy:.2f}s, overhead {wall - busy:.3f}s "
+          f"({100 * (wall - busy) / wall:.1f}%, setup per chunk {1000 * setup:.0f}ms)")
+
+    for n, i in enumerate(pending):
+        chunk_results = [r for r in results[n * len(chunks):(n + 1) * len(chunks)] if r is not None]
+        if not chunk_results:
+            raise RuntimeError(f"every chunk of {candidates[i]} failed, the engines can't search")
+
+        fitness_values = [s / c if c > 0 else 0 for s, c, _, _ in chunk_results]
+        fitness[i]     = sum(fitness_values) / len(fitness_values)
+
+        if history is not None:
+            history.evaluated(candidates[i], fitness[i], [(s, c) for s, c, _, _ in chunk_results],
+                              sum(r[2] + r[3] for r in chunk_results))
+
+        # a fitness over only some of the chunks is good enough for this run,
+        # but it isn't what the cache key stands for and is never stored
+        if len(chunk_results) < len(chunks):
+            print(f"    {len(chunks) - len(chunk_results)}/{len(chunks)} chunks of {candidates[i]} failed, "
+                  f"fitness {fitness[i]:.4f} from the rest (not cached)")
+        elif cache is not None:
+            cache.put(candidates[i], fitness[i])
+
+    if cache is not None:
+        print(f"    {cache.hit_rate()}")
+
+    return fitness
+
+
+def evaluate_parallel(pool, params, fens, cache=None, history=None):
+    return evaluate_many(pool, [params], fens, cache, history)[0]
+
+# ---------------- Racing ----------------
+
+SKIPPED = object()
+
+
+# Half-width of the one-sided Hoeffding bound on the mean of n paired
+# differences, each within [-spread, spread]
+def hoeffding(n, spread, delta):
+    return 2 * spread * math.sqrt(math.log(1 / delta) / (2 * n))
+
+
+# Searches params position by position. With the incumbent's per-position
+# fitness given, every result is paired with the incumbent's on the same
+# position, and once even the upper confidence bound of the mean difference
+# is below zero the remaining positions are skipped. The incumbent's own range
+# of values stands in for the (unknown) bound on a single difference.
+#
+# Returns (fitness, values, aborted, saved seconds of engine time). An aborted
+# candidate's fitness is the mean over the positions it got to search. A
+# position whose search failed is left out of the race and stays None in the
+# values, and a race with failed positions is never cached
+def race(pool, params, fens, incumbent=None, cache=None, history=None):
+    if cache is not None:
+        fitness = cache.get(params)
+        values  = cache.values(params)
+        if fitness is not None and values is not None:
+            return fitness, values, False, 0.0
+
+    start  = time.perf_counter()
+    cancel = threading.Event()
+
+    def work(fen):
+        def run(engine):
+            if cancel.is_set():
+                return SKIPPED
+            return engine.search_position(params, fen)
+        return run
+
+    # the bound is looked at after every position - a union bound over all
+    # the looks keeps the chance of ever dropping a good candidate at RACE_DELTA
+    look_delta = RACE_DELTA / len(fens)
+
+    # the incumbent itself may have failed positions, only both known pair up
+    known    = [v for v in incumbent if v is not None] if incumbent else []
+    spread   = max(known) - min(known) if known else 0.0
+    values   = [None] * len(fens)
+    chunks   = [[0, 0] for _ in range(pool.workers)]
+    diff     = 0.0
+    searched = 0
+    paired   = 0
+    failed   = 0
+    busy     = 0.0
+    aborted  = False
+
+    # results come in completion order, which roughly follows the (shuffled)
+    # position order. the ones already running when the race is lost still
+    # come back and are simply counted as searched
+    for job, result in pool.stream([work(fen) for fen in fens]):
+        if result is SKIPPED:
+            continue
+        if result is None:
+            failed += 1
+            continue
+
+        score, count, seconds = result
+        values[job] = score / count if count > 0 else 0
+        searched   += 1
+
+        chunks[job % pool.workers][0] += score
+        chunks[job % pool.workers][1] += count
+        busy       += seconds
+
+        if incumbent is None or aborted or incumbent[job] is None:
+            continue
+
+        diff   += values[job] - incumbent[job]
+        paired += 1
+        if paired >= RACE_MIN_POSITIONS and diff / paired + hoeffding(paired, spread, look_delta) < 0:
+            aborted = True
+            cancel.set()
+
+    done = [v for v in values if v is not None]
+    if not done:
+        raise RuntimeError(f"no position of {params} could be searched, the engines can't search")
+
+    fitness = sum(done) / len(done)
+    wall    = time.perf_counter() - start
+
+    # the skipped positions would have cost about as much as the searched ones
+    saved = (len(fens) - searched - failed) * busy / searched
+
+    if failed:
+        print(f"    {failed} positions failed and were left out (not cached)")
+
+    if history is not None:
+        history.evaluated(params, fitness, chunks, busy, aborted)
+
+    if aborted:
+        print(f"    raced out after {searched}/{len(fens)} positions in {wall:.2f}s, "
+              f"saved ~{saved:.1f}s of engine time ({100 * saved / (saved + busy):.0f}%)")
+    else:
+        print(f"    searched {searched}/{len(fens)} positions in {wall:.2f}s, search {busy / pool.workers:.2f}s per engine")
+        if cache is not None and not failed:
+            cache.put(params, fitness, values)
+
+    return fitness, (values if not aborted else None), aborted, saved
 
 # ---------------- Mutation logic (unchanged) ----------------
 
@@ -141,39 +568,94 @@ def load_fens(path):
         return [line.strip() for line in f if line.strip()]
 
 
-def tune():
-    cmd = [
-        "C:\\Users\\michn\\Desktop\\Kreveta\\Kreveta\\Kreveta\\bin\\Release\\net10.0\\Kreveta.exe"
-    ]
+def tune(resume=False, history_path=HISTORY_PATH):
+    cmd = [ENGINE_CMD]
+
+    history = History(history_path)
+    last    = history.last_step()
+
+    if last is not None and not resume:
+        print(f"{history_path} already holds a run, continue it with --resume or pick another --history")
+        return
 
     fens = load_fens("positions.txt")
-    random.shuffle(fens)
 
-    params = [1435, 1032, 1079, 58, 664, -238, 94, -695, 130, 110, -31, 49, -43, 33, 222, 216, 108, 180]
+    # a fixed order keeps the chunks, and thus the cache keys, stable across runs
+    if deterministic():
+        random.Random(POSITION_SEED).shuffle(fens)
+    else:
+        random.shuffle(fens)
 
-    best_score = evaluate_parallel(cmd, params, fens)
-    print("Initial score:", best_score)
+    params = INITIAL_PARAMS.copy()
 
-    max_iter = 800
+    # a race needs comparable per-position results, i.e. a deterministic search
+    racing = RACING and deterministic()
+
+    pool  = make_pool(cmd, workers=8)
+    cache = FitnessCache(CACHE_PATH, fens, pool.workers, per_position=racing) if deterministic() else None
 
-    for it in range(max_iter):
-        if it % 8 == 0 and it != 0:
-            best_score = evaluate_parallel(cmd, params, fens)
+    max_iter = 800
+    saved    = 0.0
+    start_it = 0
+
+    # the incumbent's per-position values come from the cache, or are searched
+    # again - the history only keeps the per-chunk totals
+    if last is not None:
+        params     = last["params"]
+        best_score = last["score"]
+        saved      = last.get("saved", 0.0)
+        start_it   = last["it"] + 1
+
+        if racing:
+            _, best_values, _, _ = race(pool, params, fens, cache=cache)
+        print(f"Resumed at iteration {start_it} with score {best_score:.4f}")
+
+    elif racing:
+        best_score, best_values, _, _ = race(pool, params, fens, cache=cache, history=history)
+        history.step(-1, params, best_score)
+    else:
+        best_score = evaluate_parallel(pool, params, fens, cache, history)
+        history.step(-1, params, best_score)
+
+    if last is None:
+        print("Initial score:", best_score)
+
+    for it in range(start_it, max_iter):
+        # only a noisy fitness needs to be re-measured
+        if not deterministic() and it % 8 == 0 and it != 0:
+            best_score = evaluate_parallel(pool, params, fens, history=history)
             print(f"REEVALUATED score: {best_score:.4f}")
 
         candidate = mutate(params, it, max_iter)
-        score = evaluate_parallel(cmd, candidate, fens)
 
-        if accept(score, best_score):
+        aborted = False
+        if racing:
+            score, values, aborted, iter_saved = race(pool, candidate, fens, best_values, cache, history)
+            saved += iter_saved
+        else:
+            score = evaluate_parallel(pool, candidate, fens, cache, history)
+
+        if not aborted and accept(score, best_score):
             params = candidate
             best_score = score
+            if racing:
+                best_values = values
             print(f"[{it}] ACCEPT {best_score:.4f} params: {params}")
+        elif aborted:
+            print(f"[{it}] REJECT {score:.4f} (raced out, {saved:.0f}s of engine time saved so far)")
         else:
             print(f"[{it}] REJECT {score:.4f}")
 
+        history.step(it, params, best_score, saved=round(saved, 1))
+
+    pool.close()
     print("Final params:", params)
 
 
 if __name__ == "__main__":
-    mp.set_start_method("spawn")
-    tune()
+    parser = argparse.ArgumentParser(description="hill climbing of the move ordering parameters")
+    parser.add_argument("--history", default=HISTORY_PATH, help="append-only log of the run")
+    parser.add_argument("--resume",  action="store_true", help="continue the run recorded in --history")
+    args = parser.parse_args()
+
+    tune(resume=args.resume, history_path=args.history)
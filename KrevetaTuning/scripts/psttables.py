@@ -0,0 +1,255 @@
+import argparse
+import glob
+import json
+import os
+import re
+import struct
+
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+EVAL_DIR   = os.path.join(SCRIPT_DIR, "..", "..", "Kreveta", "evaluation")
+
+BLOB_MAGIC   = b"KRPT"
+BLOB_VERSION = 1
+
+SHORT_MIN = -32768
+SHORT_MAX = 32767
+
+# ---------------- Parsing ----------------
+
+# A "short[] Name = [ ... ];" literal. The values are only ever replaced in
+# place, so the comments, row layout and alignment of the source survive
+TABLE_RE = re.compile(r"short\[\]\s+(\w+)\s*=\s*\[(.*?)\];", re.S)
+TOKEN_RE = re.compile(r"//[^\n]*|(\s*)(-?\d+)")
+
+
+class Table:
+    def __init__(self, name, path, body, start, end):
+        self.name   = name
+        self.path   = path
+        self.body   = body
+        self.start  = start
+        self.end    = end
+        self.values = np.array([int(m.group(2)) for m in TOKEN_RE.finditer(body) if m.group(2)], dtype=np.int64)
+
+    # the literal's body with the new values, every number keeps the width
+    # of its field (leading whitespace included) wherever it fits
+    def render(self, values):
+        values = iter(values)
+
+        def replace(m):
+            if not m.group(2):
+                return m.group(0)
+
+            # line breaks stay, only the spaces after the last one are the field
+            head, _, pad = m.group(1).rpartition("\n")
+            head += _
+
+            text  = str(next(values))
+            width = len(pad) + len(m.group(2))
+            space = 1 if pad else 0
+            return head + (text.rjust(width) if len(text) + space <= width else pad[:space] + text)
+
+        return TOKEN_RE.sub(replace, self.body)
+
+
+def read_source(path):
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        return f.read()
+
+
+def parse_file(path):
+    return [Table(m.group(1), path, m.group(2), m.start(2), m.end(2)) for m in TABLE_RE.finditer(read_source(path))]
+
+
+# every table literal of the given sources (the evaluation directory by default), by name
+def load(paths=None):
+    if not paths:
+        paths = sorted(glob.glob(os.path.join(EVAL_DIR, "*.cs")))
+
+    tables = {}
+    for path in paths:
+        for table in parse_file(path):
+            if table.name in tables:
+                raise ValueError(f"table {table.name} is defined in both {tables[table.name].path} and {path}")
+            tables[table.name] = table
+    return tables
+
+
+def load_tables(paths=None):
+    return {name: t.values.tolist() for name, t in load(paths).items()}
+
+# ---------------- Updates ----------------
+
+# output.txt of the C# tuner, "sum count mean_shift: x" per table entry
+def read_shifts(path):
+    shifts = []
+    with open(path, "r") as f:
+        for line in f:
+            parts = line.strip().split("mean_shift:")
+            if len(parts) != 2:
+                raise ValueError(f"Malformed line: {line}")
+            shifts.append(float(parts[1]))
+    return np.rint(shifts).astype(np.int64)
+
+
+# texeltune.py output, {"Name": [values], ...} (non-list entries are ignored)
+def read_texel(path):
+    with open(path, "r") as f:
+        data = json.load(f)
+    return {name: np.array(v, dtype=np.int64) for name, v in data.items() if isinstance(v, list)}
+
+
+# the new values of every table, whole-table replacements applied before shifts
+def apply(tables, replace=None, shift=None):
+    new = {name: t.values.copy() for name, t in tables.items()}
+
+    for updates, add in ((replace or {}, False), (shift or {}, True)):
+        for name, values in updates.items():
+            if name not in new:
+                raise KeyError(f"no table named {name}, known: {', '.join(tables)}")
+            if len(values) != len(new[name]):
+                raise ValueError(f"{name} has {len(new[name])} entries, the update {len(values)}")
+            new[name] = new[name] + values if add else values.copy()
+
+    for name, values in new.items():
+        if values.min() < SHORT_MIN or values.max() > SHORT_MAX:
+            raise ValueError(f"{name} doesn't fit into short[] after the update")
+    return new
+
+# ---------------- Output ----------------
+
+# patches all changed tables of every source, into out_dir or in place
+def write_sources(tables, new, out_dir=None):
+    written = []
+
+    for path in sorted({t.path for t in tables.values()}):
+        changed = [t for t in tables.values() if t.path == path and not np.array_equal(t.values, new[t.name])]
+        if not changed:
+            continue
+
+        source = read_source(path)
+        for t in sorted(changed, key=lambda t: t.start, reverse=True):
+            source = source[:t.start] + t.render(new[t.name]) + source[t.end:]
+
+        target = os.path.join(out_dir, os.path.basename(path)) if out_dir else path
+        with open(target, "w", encoding="utf-8-sig", newline="") as f:
+            f.write(source)
+        written.append(target)
+
+    return written
+
+
+# KRPT, version (u8), table count (u16), then per table: name length (u8),
+# name, value count (u32) and the values as little-endian int16
+def write_blob(path, new):
+    with open(path, "wb") as f:
+        f.write(BLOB_MAGIC + struct.pack("<BH", BLOB_VERSION, len(new)))
+        for name, values in new.items():
+            encoded = name.encode()
+            f.write(struct.pack("<B", len(encoded)) + encoded + struct.pack("<I", len(values)))
+            f.write(values.astype("<i2").tobytes())
+
+
+def read_blob(path):
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if data[:4] != BLOB_MAGIC:
+        raise ValueError(f"{path} is not a table blob")
+    version, count = struct.unpack_from("<BH", data, 4)
+    if version != BLOB_VERSION:
+        raise ValueError(f"{path} has version {version}, expected {BLOB_VERSION}")
+
+    tables = {}
+    offset = 7
+    for _ in range(count):
+        (length,) = struct.unpack_from("<B", data, offset)
+        name      = data[offset + 1:offset + 1 + length].decode()
+        (n,)      = struct.unpack_from("<I", data, offset + 1 + length)
+        offset   += 5 + length
+
+        tables[name] = np.frombuffer(data, dtype="<i2", count=n, offset=offset).astype(np.int64)
+        offset      += 2 * n
+    return tables
+
+
+# a C# literal of a 6 x 64 piece-square table, or rows of 8 for anything else
+def format_table(name, values):
+    values = list(values)
+    lines  = [f"private static readonly short[] {name} = ["]
+
+    if len(values) == 6 * 64:
+        for piece, label in enumerate(("pawns", "knights", "bishops", "rooks", "queens", "kings")):
+            lines.append(f"    // {label}")
+            for rank in range(8):
+                row = values[piece * 64 + rank * 8:piece * 64 + rank * 8 + 8]
+                lines.append("    " + ", ".join(f"{v:4d}" for v in row) + ("," if piece < 5 or rank < 7 else ""))
+            if piece < 5:
+                lines.append("")
+    else:
+        for i in range(0, len(values), 8):
+            end = "," if i + 8 < len(values) else ""
+            lines.append("    " + ", ".join(f"{v:4d}" for v in values[i:i + 8]) + end)
+
+    lines.append("];\n")
+    return "\n".join(lines)
+
+
+def summary(tables, new):
+    for name, t in tables.items():
+        delta = new[name] - t.values
+        if delta.any():
+            print(f"{name}: {np.count_nonzero(delta)}/{len(delta)} entries changed, "
+                  f"mean |delta| {np.abs(delta).mean():.2f}, max {np.abs(delta).max()}")
+
+# ---------------- Main ----------------
+
+def main():
+    parser = argparse.ArgumentParser(description="read and patch the short[] tables of the evaluation sources")
+    parser.add_argument("--sources",     nargs="+", default=None, help="C# files, all of Kreveta/evaluation by default")
+    parser.add_argument("--shifts",      default=None, help="mean shifts (output.txt) to add to --shift-table")
+    parser.add_argument("--shift-table", default="Middlegame")
+    parser.add_argument("--texel",       default=None, help="texeltune.py output replacing whole tables")
+    parser.add_argument("--blob-in",     default=None, help="table blob replacing whole tables")
+    parser.add_argument("--write",       action="store_true", help="patch the sources in place")
+    parser.add_argument("--out-dir",     default=None, help="write patched copies of the sources here instead")
+    parser.add_argument("--blob",        default=None, help="write all tables into a binary blob")
+    parser.add_argument("--print",       nargs="*", default=None, help="print these tables (all changed ones if empty) as C#")
+    args = parser.parse_args()
+
+    tables = load(args.sources)
+
+    replace = {}
+    if args.blob_in:
+        replace.update(read_blob(args.blob_in))
+    if args.texel:
+        replace.update(read_texel(args.texel))
+
+    shift = {args.shift_table: read_shifts(args.shifts)} if args.shifts else None
+    new   = apply(tables, replace, shift)
+
+    if not replace and not shift:
+        for name, t in tables.items():
+            print(f"{name}: {len(t.values)} values in {os.path.relpath(t.path)}")
+    summary(tables, new)
+
+    if args.write or args.out_dir:
+        if args.out_dir:
+            os.makedirs(args.out_dir, exist_ok=True)
+        for path in write_sources(tables, new, args.out_dir):
+            print(f"wrote {path}")
+
+    if args.blob:
+        write_blob(args.blob, new)
+        print(f"wrote {args.blob}")
+
+    if args.print is not None:
+        names = args.print or [n for n, t in tables.items() if not np.array_equal(t.values, new[n])]
+        for name in names:
+            print(format_table(name, new[name]))
+
+
+if __name__ == "__main__":
+    main()
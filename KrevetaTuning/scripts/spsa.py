@@ -0,0 +1,160 @@
+import argparse
+import os
+import random
+import time
+
+import moveordertune as mot
+
+# ---------------- SPSA ----------------
+
+# Simultaneous perturbation stochastic approximation. Every iteration perturbs
+# all parameters at once by +-c_k (random signs) and estimates the gradient from
+# the fitness difference of the two sides - two evaluations per iteration no
+# matter how many parameters there are. Several pairs can be evaluated at once
+# (their gradients are averaged), all candidates run concurrently on the pool.
+#
+# The parameters live in normalized units (value / initial magnitude), so one
+# c and one a fit all 18 of them. Gains follow the usual schedules
+#   a_k = a / (A + k + 1)^alpha,  c_k = c / (k + 1)^gamma
+
+class SPSA:
+    def __init__(self, params, c=0.05, a=None, A=None, alpha=0.602, gamma=0.101,
+                 iterations=200, step=0.02, seed=None):
+        self.scale = [max(abs(p), 1) for p in params]
+        self.theta = [p / s for p, s in zip(params, self.scale)]
+
+        self.c          = c
+        self.a          = a
+        self.A          = A if A is not None else 0.1 * iterations
+        self.alpha      = alpha
+        self.gamma      = gamma
+        self.iterations = iterations
+        self.step       = step
+        self.k          = 0
+        self.rng        = random.Random(seed)
+
+    def a_k(self):
+        if self.a is None:
+            return 0.0
+        return self.a / (self.A + self.k + 1) ** self.alpha
+
+    def c_k(self):
+        return self.c / (self.k + 1) ** self.gamma
+
+    def to_params(self, theta):
+        return [round(t * s) for t, s in zip(theta, self.scale)]
+
+    def params(self):
+        return self.to_params(self.theta)
+
+    # the +- candidate pairs of this iteration, as engine parameter vectors
+    def perturb(self, pairs):
+        c_k    = self.c_k()
+        deltas = [[self.rng.choice((-1, 1)) for _ in self.theta] for _ in range(pairs)]
+
+        candidates = []
+        for delta in deltas:
+            candidates.append(self.to_params([t + c_k * d for t, d in zip(self.theta, delta)]))
+            candidates.append(self.to_params([t - c_k * d for t, d in zip(self.theta, delta)]))
+        return deltas, candidates
+
+    def gradient(self, deltas, fitness):
+        c_k  = self.c_k()
+        grad = [0.0] * len(self.theta)
+
+        for n, delta in enumerate(deltas):
+            diff = fitness[2 * n] - fitness[2 * n + 1]
+            for i, d in enumerate(delta):
+                grad[i] += diff / (2 * c_k * d) / len(deltas)
+        return grad
+
+    # sets a so that the first step moves a parameter by about 'step' of its
+    # magnitude on average. the gradient magnitude is averaged over several
+    # +- pairs - a single pair is as noisy as its fitness difference, and one
+    # tiny or huge sample would fix the step size of the whole run
+    def calibrate(self, deltas, fitness):
+        mags = [
+            sum(abs(g) for g in self.gradient([delta], fitness[2 * n:2 * n + 2])) / len(self.theta)
+            for n, delta in enumerate(deltas)
+        ]
+        mean = sum(mags) / len(mags)
+        if mean == 0:
+            return
+
+        self.a = self.step * (self.A + self.k + 1) ** self.alpha / mean
+        print(f"    calibrated a = {self.a:.6g} from {len(deltas)} pairs")
+
+    # ascent step (the fitness is maximized). when calibrate() couldn't set
+    # a, the first non-zero gradient does
+    def update(self, grad):
+        if self.a is None:
+            mean = sum(abs(g) for g in grad) / len(grad)
+            if mean == 0:
+                self.k += 1
+                return
+
+            self.a = self.step * (self.A + self.k + 1) ** self.alpha / mean
+            print(f"    calibrated a = {self.a:.6g}")
+
+        a_k = self.a_k()
+        self.theta = [t + a_k * g for t, g in zip(self.theta, grad)]
+        self.k += 1
+
+# ---------------- Main loop ----------------
+
+def main():
+    parser = argparse.ArgumentParser(description="SPSA tuning of the move ordering parameters")
+    parser.add_argument("--engine",     default=mot.ENGINE_CMD)
+    parser.add_argument("--positions",  default="positions.txt")
+    parser.add_argument("--workers",    type=int,   default=os.cpu_count(), help="engine processes")
+    parser.add_argument("--pairs",      type=int,   default=1,    help="+- pairs per iteration, evaluated concurrently")
+    parser.add_argument("--iterations", type=int,   default=200)
+    parser.add_argument("--c",          type=float, default=0.05, help="relative perturbation size")
+    parser.add_argument("--a",          type=float, default=None, help="step gain, calibrated from --calibrate pairs if omitted")
+    parser.add_argument("--A",          type=float, default=None, help="stability constant, 10%% of the iterations by default")
+    parser.add_argument("--alpha",      type=float, default=0.602)
+    parser.add_argument("--gamma",      type=float, default=0.101)
+    parser.add_argument("--step",       type=float, default=0.02, help="relative size of the first step when calibrating a")
+    parser.add_argument("--calibrate",  type=int,   default=8,    help="+- pairs averaged when calibrating a")
+    parser.add_argument("--eval-every", type=int,   default=10,   help="measure the current parameters every this many iterations")
+    parser.add_argument("--seed",       type=int,   default=None)
+    args = parser.parse_args()
+
+    fens = mot.load_fens(args.positions)
+    if mot.deterministic():
+        random.Random(mot.POSITION_SEED).shuffle(fens)
+    else:
+        random.shuffle(fens)
+
+    pool  = mot.make_pool([args.engine], workers=args.workers)
+    cache = mot.FitnessCache(mot.CACHE_PATH, fens, pool.workers) if mot.deterministic() else None
+
+    spsa = SPSA(mot.INITIAL_PARAMS, c=args.c, a=args.a, A=args.A, alpha=args.alpha, gamma=args.gamma,
+                iterations=args.iterations, step=args.step, seed=args.seed)
+
+    start = time.perf_counter()
+    print("Initial score:", mot.evaluate_parallel(pool, spsa.params(), fens, cache))
+
+    if spsa.a is None:
+        deltas, candidates = spsa.perturb(args.calibrate)
+        spsa.calibrate(deltas, mot.evaluate_many(pool, candidates, fens, cache))
+
+    for it in range(args.iterations):
+        deltas, candidates = spsa.perturb(args.pairs)
+        fitness = mot.evaluate_many(pool, candidates, fens, cache)
+
+        spsa.update(spsa.gradient(deltas, fitness))
+
+        sides = " ".join(f"{fitness[2 * n]:.4f}/{fitness[2 * n + 1]:.4f}" for n in range(args.pairs))
+        print(f"[{it}] a_k {spsa.a_k():.4g} c_k {spsa.c_k():.4f} +/- {sides} params: {spsa.params()}")
+
+        if args.eval_every and (it + 1) % args.eval_every == 0:
+            score = mot.evaluate_parallel(pool, spsa.params(), fens, cache)
+            print(f"[{it}] SCORE {score:.4f} after {(time.perf_counter() - start) / 3600:.2f} h")
+
+    pool.close()
+    print("Final params:", spsa.params())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+import argparse
+import json
+import math
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+import chess
+
+import psttables
+
+# ---------------- Evaluation model ----------------
+
+# The part of Eval.Classical that is linear in the tables: every piece adds
+#   Middlegame[i] * phase / 70 + Endgame[i] * (70 - phase) / 70
+# with i = type * 64 + square for white, and the square mirrored for black.
+# Kreveta's squares start at a8, python-chess' at a1, so a white piece's
+# square is flipped and a black piece's is not. Tempo and the bishop pair
+# are added as fixed terms, pawn structure and king safety are left out
+# (their average effect ends up in the tables).
+PHASE_MAX  = 70
+TEMPO      = 6
+BISHOPPAIR = 7
+TABLE_SIZE = 6 * 64
+
+# maps centipawn labels to expected scores, like the usual 400-cp logistic
+LABEL_K = math.log(10) / 400
+
+RESULTS = {"1-0": 1.0, "0-1": 0.0, "1/2-1/2": 0.5, "[1.0]": 1.0, "[0.0]": 0.0, "[0.5]": 0.5}
+
+
+def game_phase(board):
+    phase = (chess.popcount(board.pawns)
+        + 3 * chess.popcount(board.knights | board.bishops)
+        + 5 * chess.popcount(board.rooks)
+        + 9 * chess.popcount(board.queens))
+    return max(0, phase - 8)
+
+
+# table columns (with a +1/-1 sign for white/black) and the fixed terms
+def features(board):
+    cols, signs = [], []
+
+    for color, sign, flip in ((chess.WHITE, 1, 56), (chess.BLACK, -1, 0)):
+        for piece in range(6):
+            for sq in chess.scan_forward(board.pieces_mask(piece + 1, color)):
+                cols.append(piece * 64 + (sq ^ flip))
+                signs.append(sign)
+
+    phase = game_phase(board)
+    fixed = TEMPO if board.turn == chess.WHITE else -TEMPO
+
+    if chess.popcount(board.bishops & board.occupied_co[chess.WHITE]) >= 2:
+        fixed += BISHOPPAIR * phase / PHASE_MAX
+    if chess.popcount(board.bishops & board.occupied_co[chess.BLACK]) >= 2:
+        fixed -= BISHOPPAIR * phase / PHASE_MAX
+
+    return cols, signs, phase / PHASE_MAX, fixed
+
+# ---------------- Dataset ----------------
+
+# "fen;label[;...]" lines, the label is either a game result or side to move
+# relative centipawns (dataset.txt, the NNUE training text files). returns
+# the white-relative target, None for an unusable line
+def parse_line(line):
+    parts = line.strip().split(";")
+    if len(parts) < 2 or not parts[1].strip():
+        return None
+
+    try:
+        board = chess.Board(parts[0].strip())
+    except ValueError:
+        return None
+
+    label = parts[1].strip()
+    if label in RESULTS:
+        return board, RESULTS[label]
+
+    try:
+        cp = float(label)
+    except ValueError:
+        return None
+
+    if board.turn == chess.BLACK:
+        cp = -cp
+    return board, 1 / (1 + math.exp(-LABEL_K * cp))
+
+
+def featurize_lines(lines):
+    cols, signs, counts, phases, fixed, targets = [], [], [], [], [], []
+
+    for line in lines:
+        parsed = parse_line(line)
+        if parsed is None:
+            continue
+
+        board, target = parsed
+        c, s, p, f    = features(board)
+
+        cols.extend(c)
+        signs.extend(s)
+        counts.append(len(c))
+        phases.append(p)
+        fixed.append(f)
+        targets.append(target)
+
+    return (np.array(cols, dtype=np.int16), np.array(signs, dtype=np.int8), np.array(counts, dtype=np.int32),
+            np.array(phases, dtype=np.float32), np.array(fixed, dtype=np.float32), np.array(targets, dtype=np.float32))
+
+
+# the input files a cache was built from - their sorted paths, sizes and
+# modification times. any change to the data rebuilds the cache
+def source_key(paths):
+    return json.dumps([
+        [os.path.abspath(p), os.path.getsize(p), os.path.getmtime(p)]
+        for p in sorted(paths)
+    ])
+
+
+# The positions as a sparse matrix in CSR form: row r owns the entries
+# indptr[r]:indptr[r + 1] of (cols, signs). Built once, in parallel, and
+# optionally kept in an .npz so that later runs skip the parsing
+class Dataset:
+    def __init__(self, cols, signs, counts, phases, fixed, targets):
+        self.cols    = cols
+        self.signs   = signs
+        self.indptr  = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+        self.phases  = phases
+        self.fixed   = fixed
+        self.targets = targets
+
+    def __len__(self):
+        return len(self.targets)
+
+    @staticmethod
+    def load(paths, workers, chunk=20000, cache=None):
+        sources = source_key(paths)
+
+        if cache and os.path.exists(cache):
+            with np.load(cache) as data:
+                if "sources" in data.files and str(data["sources"]) == sources:
+                    return Dataset(data["cols"], data["signs"], data["counts"], data["phases"], data["fixed"], data["targets"])
+            print(f"{cache} was built from other data, rebuilding it")
+
+        def chunks():
+            for path in paths:
+                with open(path, "r") as f:
+                    lines = []
+                    for line in f:
+                        lines.append(line)
+                        if len(lines) == chunk:
+                            yield lines
+                            lines = []
+                    if lines:
+                        yield lines
+
+        with Pool(workers) as pool:
+            parts = list(pool.imap(featurize_lines, chunks()))
+
+        arrays = [np.concatenate([p[i] for p in parts]) for i in range(6)]
+        if cache:
+            np.savez(cache, cols=arrays[0], signs=arrays[1], counts=arrays[2],
+                     phases=arrays[3], fixed=arrays[4], targets=arrays[5], sources=np.array(sources))
+        return Dataset(*arrays)
+
+    def take(self, rows):
+        counts = np.diff(self.indptr)[rows]
+        starts = self.indptr[rows]
+        idx    = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return Dataset(self.cols[idx], self.signs[idx], counts, self.phases[rows], self.fixed[rows], self.targets[rows])
+
+# ---------------- Loss and gradient ----------------
+
+# theta = Middlegame + Endgame (768 values). Per row
+#   eval = fixed + sum(sign * (mg[col] * phase + eg[col] * (1 - phase)))
+# is one matrix-vector product, the gradient the transposed one
+def evaluate(theta, data):
+    phase = np.repeat(data.phases, np.diff(data.indptr))
+    per   = data.signs * (theta[data.cols] * phase + theta[TABLE_SIZE + data.cols] * (1 - phase))
+    return data.fixed + np.add.reduceat(per, data.indptr[:-1]) if len(per) else data.fixed.copy()
+
+
+def loss_and_grad(theta, data, k, l2=0.0, anchor=None):
+    s    = 1 / (1 + np.exp(-k * evaluate(theta, data)))
+    diff = s - data.targets
+    loss = float(np.mean(diff * diff))
+
+    # d loss / d eval for every row, spread over the row's entries
+    g     = 2 * diff * s * (1 - s) * k / len(data)
+    phase = np.repeat(data.phases, np.diff(data.indptr))
+    g_ent = np.repeat(g, np.diff(data.indptr)) * data.signs
+
+    grad = np.concatenate([
+        np.bincount(data.cols, weights=g_ent * phase,       minlength=TABLE_SIZE),
+        np.bincount(data.cols, weights=g_ent * (1 - phase), minlength=TABLE_SIZE)
+    ])
+
+    if l2 > 0:
+        loss += l2 * float(np.mean((theta - anchor) ** 2))
+        grad += 2 * l2 * (theta - anchor) / len(theta)
+    return loss, grad
+
+
+# the sigmoid scale that makes the current tables fit best, golden section
+def fit_k(theta, data, lo=1e-4, hi=0.05, iterations=40):
+    ratio = (math.sqrt(5) - 1) / 2
+    e     = evaluate(theta, data)
+
+    def loss(k):
+        return float(np.mean((1 / (1 + np.exp(-k * e)) - data.targets) ** 2))
+
+    a, b = lo, hi
+    for _ in range(iterations):
+        c, d = b - ratio * (b - a), a + ratio * (b - a)
+        if loss(c) < loss(d):
+            b = d
+        else:
+            a = c
+    return (a + b) / 2
+
+# ---------------- Optimizers ----------------
+
+def adam(theta, train, k, epochs, batch, lr, l2, valid=None, seed=1):
+    rng    = np.random.default_rng(seed)
+    anchor = theta.copy()
+    m      = np.zeros_like(theta)
+    v      = np.zeros_like(theta)
+    step   = 0
+
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        order = rng.permutation(len(train))
+
+        for b in range(0, len(train), batch):
+            _, grad = loss_and_grad(theta, train.take(order[b:b + batch]), k, l2, anchor)
+
+            step += 1
+            m = 0.9 * m + 0.1 * grad
+            v = 0.999 * v + 0.001 * grad * grad
+            theta = theta - lr * (m / (1 - 0.9 ** step)) / (np.sqrt(v / (1 - 0.999 ** step)) + 1e-12)
+
+        report(f"epoch {epoch + 1}/{epochs}", theta, train, valid, k, time.perf_counter() - start)
+    return theta
+
+
+def lbfgs(theta, train, k, iterations, l2, valid=None):
+    from scipy.optimize import minimize
+
+    anchor = theta.copy()
+    result = minimize(loss_and_grad, theta, args=(train, k, l2, anchor), jac=True,
+                      method="L-BFGS-B", options={"maxiter": iterations})
+    report(f"L-BFGS, {result.nit} iterations ({result.message})", result.x, train, valid, k)
+    return result.x
+
+
+def report(label, theta, train, valid, k, seconds=None):
+    line = f"{label}: train {loss_and_grad(theta, train, k)[0]:.6f}"
+    if valid is not None:
+        line += f", validation {loss_and_grad(theta, valid, k)[0]:.6f}"
+    if seconds is not None:
+        line += f" ({seconds:.1f}s)"
+    print(line)
+
+# ---------------- Main ----------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Texel tuning of the middlegame and endgame tables")
+    parser.add_argument("data",         nargs="+", help="fen;label files (centipawns or game results)")
+    parser.add_argument("--tables",     nargs="+", default=None, help="C# sources with the tables, Kreveta/evaluation by default")
+    parser.add_argument("--out",        default="texel_tables.json")
+    parser.add_argument("--cache",      default=None, help="keep the featurized positions in this .npz")
+    parser.add_argument("--workers",    type=int,   default=os.cpu_count())
+    parser.add_argument("--validation", type=float, default=0.1, help="held-out fraction")
+    parser.add_argument("--epochs",     type=int,   default=20)
+    parser.add_argument("--batch",      type=int,   default=16384)
+    parser.add_argument("--lr",         type=float, default=1.0, help="Adam step, in centipawns")
+    parser.add_argument("--l2",         type=float, default=0.0, help="pull towards the current tables")
+    parser.add_argument("--lbfgs",      type=int,   default=0,   help="L-BFGS iterations (needs scipy) instead of Adam")
+    parser.add_argument("--k",          type=float, default=LABEL_K, help="sigmoid scale, the centipawn labels' own by default")
+    parser.add_argument("--fit-k",      action="store_true", help="fit the scale to the current tables (for game result labels)")
+    parser.add_argument("--print",      action="store_true", help="print the tuned tables as C#")
+    args = parser.parse_args()
+
+    tables = psttables.load_tables(args.tables)
+    theta  = np.array(tables["Middlegame"] + tables["Endgame"], dtype=np.float64)
+
+    start = time.perf_counter()
+    data  = Dataset.load(args.data, args.workers, cache=args.cache)
+    print(f"{len(data)} positions, {len(data.cols)} table entries in {time.perf_counter() - start:.1f}s")
+
+    order = np.random.default_rng(0).permutation(len(data))
+    split = int(len(data) * args.validation)
+    valid = data.take(np.sort(order[:split])) if split else None
+    train = data.take(np.sort(order[split:]))
+
+    # with centipawn labels both sides of the loss are in centipawns, a fitted
+    # scale would only rescale the tuned tables
+    k = fit_k(theta, train) if args.fit_k else args.k
+    print(f"K = {k:.6f}")
+    report("initial", theta, train, valid, k)
+
+    start = time.perf_counter()
+    if args.lbfgs:
+        theta = lbfgs(theta, train, k, args.lbfgs, args.l2, valid)
+    else:
+        theta = adam(theta, train, k, args.epochs, args.batch, args.lr, args.l2, valid)
+    print(f"tuned in {time.perf_counter() - start:.1f}s")
+
+    tuned = np.rint(theta).astype(int).tolist()
+    result = {"Middlegame": tuned[:TABLE_SIZE], "Endgame": tuned[TABLE_SIZE:], "k": k}
+
+    with open(args.out, "w") as f:
+        json.dump(result, f)
+    print(f"wrote {args.out}")
+
+    if args.print:
+        print(psttables.format_table("Middlegame", result["Middlegame"]))
+        print(psttables.format_table("Endgame", result["Endgame"]))
+
+
+if __name__ == "__main__":
+    main()
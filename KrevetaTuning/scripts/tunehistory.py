@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import time
+
+# ---------------- History file ----------------
+
+# Append-only JSONL log of a tuning run, one compact line per record:
+#
+#   {"type": "eval", "params": [...], "fitness": f, "chunks": [[score, count], ...],
+#    "seconds": engine seconds, "aborted": bool, "time": unix time}
+#   {"type": "step", "it": i, "params": [...], "score": f, "time": unix time, ...}
+#
+# An eval line is written for every evaluated candidate, "chunks" holds the
+# raw score/count of every engine's share of the positions (fens[i::workers]).
+# A step line closes every iteration with the optimizer's state after it,
+# which is all --resume needs. A line cut off by a crash is ignored.
+class History:
+    def __init__(self, path):
+        self.path = path
+
+    def _append(self, record):
+        record["time"] = round(time.time(), 2)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def evaluated(self, params, fitness, chunks, seconds, aborted=False):
+        self._append({
+            "type":    "eval",
+            "params":  list(params),
+            "fitness": fitness,
+            "chunks":  [list(c) for c in chunks],
+            "seconds": round(seconds, 3),
+            "aborted": aborted
+        })
+
+    def step(self, it, params, score, **state):
+        self._append({"type": "step", "it": it, "params": list(params), "score": score, **state})
+
+    # the state of the last finished iteration, None for a new run
+    def last_step(self):
+        last = None
+        for record in read(self.path):
+            if record["type"] == "step":
+                last = record
+        return last
+
+
+def read(path):
+    if not os.path.exists(path):
+        return
+
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+# ---------------- Offline analysis ----------------
+
+def summary(path):
+    records = list(read(path))
+    evals   = [r for r in records if r["type"] == "eval"]
+    steps   = [r for r in records if r["type"] == "step"]
+
+    if not steps:
+        print("No finished iterations")
+        return
+
+    aborted = sum(r["aborted"] for r in evals)
+    engine  = sum(r["seconds"] for r in evals)
+    span    = records[-1]["time"] - records[0]["time"]
+
+    print(f"{len(steps)} iterations, {len(evals)} evaluations ({aborted} raced out)")
+    print(f"engine time {engine / 3600:.2f} h over {span / 3600:.2f} h wall")
+
+    # a step that changed the parameters accepted its candidate
+    accepted = [b for a, b in zip(steps, steps[1:]) if a["params"] != b["params"]]
+    print(f"accepted {len(accepted)}/{len(steps) - 1} candidates")
+
+    print("\nScore progression:")
+    best = None
+    for s in steps:
+        if best is None or s["score"] != best:
+            best = s["score"]
+            print(f"  [{s['it']}] {best:.4f}")
+
+    first, final = steps[0]["params"], steps[-1]["params"]
+    changes      = [0] * len(first)
+    for a, b in zip(steps, steps[1:]):
+        for i, (x, y) in enumerate(zip(a["params"], b["params"])):
+            changes[i] += x != y
+
+    print("\nParameters (start -> final, accepted changes):")
+    for i, (x, y) in enumerate(zip(first, final)):
+        print(f"  {i:2d}: {x:6d} -> {y:6d} ({y - x:+d}), {changes[i]} changes")
+
+    # uneven chunks make the whole evaluation wait for the slowest engine
+    counts = [c[1] for r in evals if not r["aborted"] for c in r["chunks"]]
+    if counts:
+        mean = sum(counts) / len(counts)
+        print(f"\nTuning counts per chunk: mean {mean:.0f}, min {min(counts)}, max {max(counts)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="summarize a tuning history without running engines")
+    parser.add_argument("history", nargs="?", default="tune_history.jsonl")
+    args = parser.parse_args()
+
+    summary(args.history)
+
+
+if __name__ == "__main__":
+    main()
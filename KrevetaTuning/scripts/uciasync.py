@@ -0,0 +1,367 @@
+import argparse
+import asyncio
+import inspect
+import os
+import queue as queue_mod
+import random
+import threading
+import time
+
+# ---------------- Settings ----------------
+
+# Everything but a search must be answered within COMMAND_TIMEOUT. A search
+# gets SEARCH_TIMEOUT, then a "stop" and STOP_GRACE to send its bestmove -
+# an engine that misses that is considered hung, killed and replaced
+COMMAND_TIMEOUT = 10.0
+SEARCH_TIMEOUT  = 60.0
+STOP_GRACE      = 2.0
+QUIT_TIMEOUT    = 5.0
+
+# A replacement engine that fails to start is retried after REPLACE_BACKOFF
+# seconds, doubling up to REPLACE_ATTEMPTS times
+REPLACE_ATTEMPTS = 5
+REPLACE_BACKOFF  = 0.5
+
+
+class EngineHung(Exception):
+    pass
+
+# ---------------- Engine ----------------
+
+# One engine process driven through asyncio pipes. Reads never block the
+# event loop, so a single thread can drive any number of engines, and every
+# wait has a timeout. The interface mirrors moveordertune.Engine, except
+# that the methods are coroutines.
+class AsyncEngine:
+    def __init__(self, cmd, go_args, search_timeout=SEARCH_TIMEOUT, options=None):
+        self.cmd            = cmd
+        self.go_args        = go_args
+        self.search_timeout = search_timeout
+        self.options        = options or {}
+        self.params         = None
+        self.p              = None
+
+    async def start(self, tune=None):
+        self.p = await asyncio.create_subprocess_exec(
+            *self.cmd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        self.send("uci")
+        await self.wait("uciok")
+
+        for name, value in self.options.items():
+            self.send(f"setoption name {name} value {value}")
+
+        if tune:
+            self.send(f"tune {' '.join(map(str, tune))}")
+            self.params = list(tune)
+
+        self.send("isready")
+        await self.wait("readyok")
+        return self
+
+    def send(self, cmd):
+        self.p.stdin.write((cmd + "\n").encode())
+
+    async def readline(self, timeout=COMMAND_TIMEOUT):
+        try:
+            line = await asyncio.wait_for(self.p.stdout.readline(), timeout)
+        except asyncio.TimeoutError:
+            raise EngineHung(f"no answer in {timeout:.0f}s")
+
+        if not line:
+            raise EOFError("engine process died")
+        return line.decode()
+
+    async def wait(self, token, timeout=COMMAND_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while True:
+            line = await self.readline(max(0.0, deadline - time.monotonic()))
+            if token in line:
+                return line
+
+    async def set_params(self, tune):
+        self.send(f"tune {' '.join(map(str, tune))}")
+        self.send("ucinewgame")
+        await self.get_tuning()
+        self.params = list(tune)
+
+    # A search that runs out of time (or whose task is cancelled) is stopped,
+    # and its bestmove is still consumed so that the next command starts on a
+    # clean pipe
+    async def search_fen(self, fen, limit):
+        self.send(f"position fen {fen}")
+        self.send(f"go {limit}")
+
+        try:
+            await self.wait("bestmove", self.search_timeout)
+        except EngineHung:
+            self.send("stop")
+            try:
+                await self.wait("bestmove", STOP_GRACE)
+            except EngineHung:
+                raise EngineHung(f"search exceeded {self.search_timeout:.0f}s and ignored stop")
+            raise EngineHung(f"search exceeded {self.search_timeout:.0f}s")
+        except asyncio.CancelledError:
+            self.send("stop")
+            await asyncio.shield(self.wait("bestmove", STOP_GRACE))
+            raise
+
+    async def search_position(self, tune, fen):
+        if self.params != list(tune):
+            self.send(f"tune {' '.join(map(str, tune))}")
+            self.params = list(tune)
+
+        self.send("ucinewgame")
+        await self.get_tuning()
+
+        t0 = time.perf_counter()
+        await self.search_fen(fen, self.go_args())
+        t1 = time.perf_counter()
+
+        score, count = await self.get_tuning()
+        return score, count, t1 - t0
+
+    # (centipawns, bestmove) of a search, both from the engine's last info
+    # line with a score. a mate score is returned as +-mate_score
+    async def analyse(self, fen, limit, mate_score=1000):
+        self.send(f"position fen {fen}")
+        self.send(f"go {limit}")
+
+        score = 0
+        deadline = time.monotonic() + self.search_timeout
+        while True:
+            try:
+                line = await self.readline(max(0.0, deadline - time.monotonic()))
+            except EngineHung:
+                self.send("stop")
+                await self.wait("bestmove", STOP_GRACE)
+                raise EngineHung(f"search exceeded {self.search_timeout:.0f}s")
+
+            tokens = line.split()
+            if tokens and tokens[0] == "info" and "score" in tokens:
+                kind, value = tokens[tokens.index("score") + 1:tokens.index("score") + 3]
+                if kind == "cp":
+                    score = int(value)
+                elif kind == "mate":
+                    score = mate_score if int(value) > 0 else -mate_score
+            elif tokens and tokens[0] == "bestmove":
+                return score, tokens[1] if len(tokens) > 1 else ""
+
+    async def get_tuning(self):
+        self.send("gettuning")
+        self.send("isready")
+
+        score = count = 0
+        deadline = time.monotonic() + COMMAND_TIMEOUT
+        while True:
+            line = await self.readline(max(0.0, deadline - time.monotonic()))
+            if "TUNE score" in line:
+                score = int(line.split()[-1])
+            elif "TUNE count" in line:
+                count = int(line.split()[-1])
+            elif "readyok" in line:
+                break
+        return score, count
+
+    async def quit(self):
+        if self.p is None or self.p.returncode is not None:
+            return
+        try:
+            self.send("quit")
+            await asyncio.wait_for(self.p.wait(), QUIT_TIMEOUT)
+        except Exception:
+            self.kill()
+
+    def kill(self):
+        if self.p is None:
+            return
+        try:
+            self.p.kill()
+        except ProcessLookupError:
+            pass
+
+# ---------------- Engine pool ----------------
+
+# A drop-in for moveordertune.EnginePool: the same run(), stream() and close(),
+# but all the engines are driven by one event loop on one background thread.
+# A task may return a coroutine (e.g. engine.search_position(...)), which is
+# awaited. A dead or hung engine is killed, replaced and its task re-run once.
+# Every task posts a result (None when it failed), so run() and stream()
+# always return, even when no replacement engine can be started.
+class AsyncEnginePool:
+    def __init__(self, cmd, workers=8, go_args=None, search_timeout=SEARCH_TIMEOUT, options=None):
+        self.cmd            = cmd
+        self.workers        = workers
+        self.go_args        = go_args
+        self.search_timeout = search_timeout
+        self.options        = options
+        self.results        = queue_mod.Queue()
+        self.replaced       = 0
+        self.failed         = 0
+
+        self.loop   = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+        start = time.perf_counter()
+        self.engines = self._call(self._start_all())
+        self.startup = time.perf_counter() - start
+
+        self.tasks   = self._call(self._make_queue())
+        self.servers = [asyncio.run_coroutine_threadsafe(self._serve(i), self.loop) for i in range(workers)]
+
+        print(f"Started {workers} engines in {self.startup:.2f}s (one event loop)")
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def _make_queue(self):
+        return asyncio.Queue()
+
+    def _engine(self):
+        return AsyncEngine(self.cmd, self.go_args, self.search_timeout, self.options)
+
+    async def _start_all(self):
+        return list(await asyncio.gather(*(self._engine().start() for _ in range(self.workers))))
+
+    async def _quit_all(self):
+        await asyncio.gather(*(e.quit() for e in self.engines if e is not None))
+
+    # kills engine i and starts a new one. a failed start is retried with a
+    # growing delay, and when all attempts fail the slot is left empty and
+    # tried again with the server's next task
+    async def _replace(self, i):
+        if self.engines[i] is not None:
+            self.engines[i].kill()
+            self.engines[i] = None
+            self.replaced  += 1
+
+        delay = REPLACE_BACKOFF
+        for attempt in range(REPLACE_ATTEMPTS):
+            engine = self._engine()
+            try:
+                self.engines[i] = await engine.start()
+                return True
+            except Exception as e:
+                engine.kill()
+                print(f"    engine {i}: replacement failed to start ({e!r}), attempt {attempt + 1}/{REPLACE_ATTEMPTS}")
+
+            if attempt + 1 < REPLACE_ATTEMPTS:
+                await asyncio.sleep(delay)
+                delay *= 2
+        return False
+
+    async def _run(self, engine, params, fens):
+        t0 = time.perf_counter()
+        await engine.set_params(params)
+        t1 = time.perf_counter()
+
+        for fen in fens:
+            await engine.search_fen(fen, self.go_args())
+        t2 = time.perf_counter()
+
+        score, count = await engine.get_tuning()
+        t3 = time.perf_counter()
+
+        return score, count, (t1 - t0) + (t3 - t2), t2 - t1
+
+    async def _serve(self, i):
+        while True:
+            task = await self.tasks.get()
+            if task is None:
+                break
+
+            job, work = task
+            result = None
+            try:
+                for attempt in range(2):
+                    if self.engines[i] is None and not await self._replace(i):
+                        break
+                    try:
+                        result = work(self.engines[i])
+                        if inspect.isawaitable(result):
+                            result = await result
+                        break
+                    except (EOFError, OSError, EngineHung) as e:
+                        print(f"    engine {i}: {e}, replacing it")
+                        result = None
+                        if not await self._replace(i):
+                            break
+            except Exception as e:
+                # not an engine failure (e.g. an unparsable answer), but the
+                # pipe may be left mid-answer, so the engine is replaced too
+                print(f"    engine {i}: task {job} failed ({e!r}), replacing the engine")
+                result = None
+                await self._replace(i)
+            finally:
+                if result is None:
+                    self.failed += 1
+                self.results.put((job, result))
+
+    def stream(self, works):
+        for job, work in enumerate(works):
+            self.loop.call_soon_threadsafe(self.tasks.put_nowait, (job, work))
+
+        for _ in works:
+            yield self.results.get()
+
+    # like moveordertune.EnginePool.run, a failed job is None (and counted in
+    # self.failed), never a made-up score
+    def run(self, jobs):
+        works = [
+            lambda engine, params=params, fens=fens: self._run(engine, params, fens)
+            for params, fens in jobs
+        ]
+
+        results = [None] * len(jobs)
+        for job, result in self.stream(works):
+            results[job] = result
+        return results
+
+    def close(self):
+        for _ in self.servers:
+            self.loop.call_soon_threadsafe(self.tasks.put_nowait, None)
+        for s in self.servers:
+            s.result()
+
+        self._call(self._quit_all())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+# ---------------- Benchmark ----------------
+
+# Searches the position set once with the current parameters, to compare
+# the throughput with moveordertune.EnginePool on the same machine
+def main():
+    import moveordertune as mot
+
+    parser = argparse.ArgumentParser(description="drive many engines from one event loop")
+    parser.add_argument("--engine",    default=mot.ENGINE_CMD)
+    parser.add_argument("--positions", default="positions.txt")
+    parser.add_argument("--engines",   type=int,   default=os.cpu_count())
+    parser.add_argument("--timeout",   type=float, default=SEARCH_TIMEOUT, help="seconds per search before an engine counts as hung")
+    args = parser.parse_args()
+
+    fens = mot.load_fens(args.positions)
+    random.Random(mot.POSITION_SEED).shuffle(fens)
+
+    pool  = AsyncEnginePool([args.engine], workers=args.engines, go_args=mot.go_args, search_timeout=args.timeout)
+    start = time.perf_counter()
+
+    works   = [lambda engine, fen=fen: engine.search_position(mot.INITIAL_PARAMS, fen) for fen in fens]
+    results = [r for _, r in pool.stream(works) if r is not None]
+
+    wall = time.perf_counter() - start
+    busy = sum(r[2] for r in results)
+    pool.close()
+
+    print(f"{len(results)}/{len(fens)} positions in {wall:.2f}s ({len(results) / wall:.1f}/s), "
+          f"engines busy {100 * busy / (wall * args.engines):.0f}%, {pool.replaced} engines replaced, {pool.failed} tasks failed")
+
+
+if __name__ == "__main__":
+    main()
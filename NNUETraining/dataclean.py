@@ -0,0 +1,214 @@
+#
+# Kreveta chess engine by ZlomenyMesic
+# started 4-3-2025
+#
+
+# offline cleaning of fen;cp corpora for txttrain.py. the input files are cut
+# into byte ranges processed in parallel (nothing is ever loaded as a whole):
+#   1. every worker parses its range, drops unparsable lines, mate and extreme
+#      scores and non-quiet positions, and routes each kept line to a shard by
+#      its zobrist hash - a duplicate always lands in the same shard
+#   2. every shard is deduplicated by the hash, shuffled and written out. the
+#      surviving lines are streamed into random buckets on disk and only one
+#      bucket at a time is shuffled in memory, so a worker holds the hashes
+#      of its shard and at most about SHUFFLE_BYTES of lines
+# hash routing also keeps the shards balanced, up to the duplicate rate
+
+import os
+import glob
+import time
+import random
+import shutil
+import argparse
+import multiprocessing as mp
+
+import chess
+import chess.polyglot
+
+import filters
+
+CHUNK_BYTES   = 64 * 2**20
+SHUFFLE_BYTES = 64 * 2**20
+SHARDS        = 16
+MAX_SCORE     = 1500
+
+def byte_ranges(paths, chunk_bytes: int):
+    ranges = []
+    for path in paths:
+        size = os.path.getsize(path)
+        for start in range(0, size, chunk_bytes):
+            ranges.append((len(ranges), path, start, min(size, start + chunk_bytes)))
+    return ranges
+
+# a line belongs to the range it starts in. a range that doesn't start at
+# the beginning of the file skips the line it cuts through
+def read_range(path: str, start: int, end: int):
+    with open(path, "rb") as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line
+
+def clean_range(job):
+    range_id, path, start, end, opts = job
+
+    stats = {"lines": 0, "kept": 0, "bad": 0, "score": 0, "check": 0, "capture": 0}
+    parts = [open(os.path.join(opts["tmp"], f"{k:03d}.{range_id:05d}"), "w") for k in range(opts["shards"])]
+
+    try:
+        for raw in read_range(path, start, end):
+            stats["lines"] += 1
+
+            try:
+                fen, cp = raw.decode().strip().split(";")
+                cp      = float(cp)
+                board   = chess.Board(fen)
+            except ValueError:
+                stats["bad"] += 1
+                continue
+
+            # mate scores are written as large values, so they go here as well
+            if abs(cp) > opts["max_score"]:
+                stats["score"] += 1
+                continue
+
+            reason = filters.classify(board, opts["in_check"], opts["captures"], opts["see_threshold"])
+            if reason is not None:
+                stats[reason] += 1
+                continue
+
+            key = chess.polyglot.zobrist_hash(board)
+            parts[key % opts["shards"]].write(f"{key:016x};{fen};{cp:g}\n")
+            stats["kept"] += 1
+    finally:
+        for f in parts:
+            f.close()
+
+    return stats
+
+# every line goes into a uniformly random bucket, and the buckets are shuffled
+# and concatenated - which is a uniform shuffle of the whole shard
+def write_shard(job):
+    shard, opts = job
+
+    parts     = sorted(glob.glob(os.path.join(opts["tmp"], f"{shard:03d}.*")))
+    size      = sum(os.path.getsize(p) for p in parts)
+    rng       = random.Random(opts["seed"] + shard)
+    n_buckets = max(1, -(-size // opts["shuffle_bytes"]))
+    paths     = [os.path.join(opts["tmp"], f"bucket_{shard:03d}.{b:05d}") for b in range(n_buckets)]
+    buckets   = [open(p, "w") for p in paths]
+
+    seen  = set()
+    kept  = 0
+    dupes = 0
+
+    try:
+        for part in parts:
+            with open(part, "r") as f:
+                for line in f:
+                    key, rest = line.split(";", 1)
+                    key       = int(key, 16)
+                    if key in seen:
+                        dupes += 1
+                        continue
+                    seen.add(key)
+
+                    buckets[rng.randrange(n_buckets)].write(rest)
+                    kept += 1
+    finally:
+        for f in buckets:
+            f.close()
+
+    del seen
+    with open(os.path.join(opts["out"], f"shard_{shard:03d}.txt"), "w") as out:
+        for path in paths:
+            with open(path, "r") as f:
+                lines = f.readlines()
+
+            rng.shuffle(lines)
+            out.writelines(lines)
+            os.remove(path)
+
+    return shard, kept, dupes
+
+def main():
+    parser = argparse.ArgumentParser(description = "filter, deduplicate and shard fen;cp datasets")
+    parser.add_argument("inputs", nargs = "+", help = "input files or glob patterns")
+    parser.add_argument("--out",           required = True,          help = "output directory")
+    parser.add_argument("--shards",        type = int,   default = SHARDS)
+    parser.add_argument("--workers",       type = int,   default = os.cpu_count())
+    parser.add_argument("--chunk-mb",      type = float, default = CHUNK_BYTES / 2**20)
+    parser.add_argument("--shuffle-mb",    type = float, default = SHUFFLE_BYTES / 2**20, help = "lines shuffled in memory at once, per worker")
+    parser.add_argument("--max-score",     type = float, default = MAX_SCORE, help = "drop |cp| above this")
+    parser.add_argument("--see-threshold", type = int,   default = 1,         help = "drop positions with a capture of at least this SEE")
+    parser.add_argument("--keep-checks",   action = "store_true")
+    parser.add_argument("--keep-captures", action = "store_true")
+    parser.add_argument("--seed",          type = int,   default = 1)
+    args = parser.parse_args()
+
+    paths = sorted({p for pattern in args.inputs for p in glob.glob(pattern)})
+    if not paths:
+        parser.error("no input files")
+
+    os.makedirs(args.out, exist_ok = True)
+
+    # parts left behind by an interrupted run would be merged into this one
+    tmp = os.path.join(args.out, "_parts")
+    shutil.rmtree(tmp, ignore_errors = True)
+    os.makedirs(tmp)
+
+    opts = {
+        "tmp":           tmp,
+        "out":           args.out,
+        "shards":        args.shards,
+        "max_score":     args.max_score,
+        "in_check":      not args.keep_checks,
+        "captures":      not args.keep_captures,
+        "see_threshold": args.see_threshold,
+        "shuffle_bytes": max(1, int(args.shuffle_mb * 2**20)),
+        "seed":          args.seed
+    }
+
+    ranges = byte_ranges(paths, max(1, int(args.chunk_mb * 2**20)))
+    total  = sum(os.path.getsize(p) for p in paths)
+    print(f"{len(paths)} files, {total / 2**20:.1f} MiB, {len(ranges)} ranges, {args.workers} workers")
+
+    stats = {}
+    start = time.perf_counter()
+
+    with mp.get_context("spawn").Pool(args.workers) as pool:
+        jobs = [(*r, opts) for r in ranges]
+        for i, s in enumerate(pool.imap_unordered(clean_range, jobs), 1):
+            for k, v in s.items():
+                stats[k] = stats.get(k, 0) + v
+
+            elapsed = time.perf_counter() - start
+            print(f"ranges {i}/{len(ranges)}, lines: {stats['lines']}, kept: {stats['kept']}, "
+                + f"lines/s: {stats['lines'] / elapsed:.0f}")
+
+        filter_time = time.perf_counter() - start
+
+        sizes = []
+        dupes = 0
+        for shard, count, d in pool.imap_unordered(write_shard, [(k, opts) for k in range(args.shards)]):
+            sizes.append(count)
+            dupes += d
+
+    shutil.rmtree(tmp)
+    elapsed = time.perf_counter() - start
+    lines   = max(1, stats["lines"])
+
+    print(f"\nfiltered {stats['lines']} lines in {filter_time:.1f}s ({stats['lines'] / filter_time:.0f} lines/s), "
+        + f"total {elapsed:.1f}s ({stats['lines'] / elapsed:.0f} lines/s)")
+    for reason in ("bad", "score", "check", "capture"):
+        print(f"  {reason:>8}: {stats[reason]:>10} ({100 * stats[reason] / lines:.2f}%)")
+    print(f"  {'dupes':>8}: {dupes:>10} ({100 * dupes / lines:.2f}%)")
+    print(f"  {'written':>8}: {sum(sizes):>10} in {args.shards} shards, {min(sizes)}..{max(sizes)} lines each")
+
+if __name__ == "__main__":
+    main()
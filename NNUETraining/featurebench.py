@@ -0,0 +1,100 @@
+#
+# Kreveta chess engine by ZlomenyMesic
+# started 4-3-2025
+#
+
+# compares the full and the compacted feature layout: embedding + optimizer
+# memory, and the average train_on_batch step time on self-play-like batches
+
+import os
+import time
+import random
+
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
+
+import numpy as np
+import tensorflow as tf
+import chess
+
+import features
+import train
+
+BATCHES   = 40
+WARMUP    = 3
+POSITIONS = 20000
+
+def random_positions(count: int, seed: int = 1):
+    rng   = random.Random(seed)
+    board = chess.Board()
+
+    while count > 0:
+        moves = list(board.legal_moves)
+        if not moves or board.ply() > 120:
+            board = chess.Board()
+            continue
+
+        board.push(rng.choice(moves))
+        count -= 1
+        yield board
+
+# canonical (full) indices of all positions, converted per layout later
+def full_samples(count: int):
+    samples = []
+
+    for board in random_positions(count):
+        w, b = [], []
+        for sq, piece in board.piece_map().items():
+            if piece.piece_type == chess.KING:
+                continue
+            is_black = piece.color == chess.BLACK
+            w.append(features.full_feature_index(board.king(chess.WHITE), piece.piece_type, is_black, sq))
+            b.append(features.full_feature_index(board.king(chess.BLACK) ^ 56, piece.piece_type, not is_black, sq ^ 56))
+        samples.append((w, b) if board.turn == chess.WHITE else (b, w))
+
+    return samples
+
+def measure(feature_count: int, table, samples):
+    model = train.build_model(feature_count, factorize = False)
+    rng   = np.random.default_rng(1)
+
+    times = []
+    for i in range(BATCHES + WARMUP):
+        batch   = [samples[j] for j in rng.integers(0, len(samples), train.BATCH_SIZE)]
+        active  = [[table[f] for f in a] for a, _ in batch]
+        passive = [[table[f] for f in p] for _, p in batch]
+
+        x = [
+            tf.ragged.constant(active,  dtype = tf.int32),
+            tf.ragged.constant(passive, dtype = tf.int32),
+            np.array([len(a) + 2 for a in active], dtype = np.int32)
+        ]
+        y = rng.random((train.BATCH_SIZE, 1)).astype(np.float32)
+
+        start = time.perf_counter()
+        model.train_on_batch(x, y)
+        if i >= WARMUP:
+            times.append(time.perf_counter() - start)
+
+    # embedding + AdamW moments (m and v), all float32
+    emb_bytes = feature_count * train.EMBED_DIM * 4
+    return emb_bytes, emb_bytes * 3, float(np.mean(times))
+
+def main():
+    samples = full_samples(POSITIONS)
+
+    full_table    = list(range(features.FULL_FEATURE_COUNT))
+    compact_table = features.INDEX_TABLE.tolist() if features.COMPACT_FEATURES else full_table
+
+    results = {
+        "full":    measure(features.FULL_FEATURE_COUNT, full_table, samples),
+        "compact": measure(features.FEATURE_COUNT, compact_table, samples)
+    }
+
+    for name, (emb, total, step) in results.items():
+        print(f"{name:>8}: embedding {emb / 2**20:7.2f} MiB, with optimizer state {total / 2**20:7.2f} MiB, step {step * 1000:7.1f} ms")
+
+    (e0, t0, s0), (e1, t1, s1) = results["full"], results["compact"]
+    print(f"   saved: {(t0 - t1) / 2**20:.2f} MiB ({100 * (t0 - t1) / t0:.1f}%), step time {100 * (s0 - s1) / s0:+.1f}%")
+
+if __name__ == "__main__":
+    main()
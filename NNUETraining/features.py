@@ -0,0 +1,475 @@
+#
+# Kreveta chess engine by ZlomenyMesic
+# started 4-3-2025
+#
+
+import json
+
+import numpy as np
+import chess
+
+# the canonical layout, which is also what the engine expects (see
+# NNUEEvaluator.FeatureIndex): 64 king squares x 10 piece planes x 64 squares
+KING_SQUARES       = 64
+PLANE_FEATURES     = 640
+FULL_FEATURE_COUNT = KING_SQUARES * PLANE_FEATURES
+
+# drop the features that can never be active - pawns on the first and last
+# rank, and any piece standing on the square of the reference king
+COMPACT_FEATURES = True
+
+# a king on files e-h gets the whole board mirrored horizontally, so
+# only the a-d half of the king squares needs its own weights
+KING_MIRROR = False
+
+# king bucketing. None keeps one 640-feature slice per king square. otherwise
+# a list of bucket ids indexed by the reference king's square (a1 = 0, from
+# the perspective's own side): 32 entries (files a-d) with KING_MIRROR,
+# 64 entries without it. kings in the same bucket share their weights
+KING_BUCKETS = None
+
+# an example scheme for KING_MIRROR = True - separate buckets for the
+# usual castled and home squares, coarser ones further up the board
+KING_BUCKETS_8 = [
+    0, 1, 2, 3,
+    4, 4, 5, 5,
+    6, 6, 6, 6,
+    6, 6, 6, 6,
+    7, 7, 7, 7,
+    7, 7, 7, 7,
+    7, 7, 7, 7,
+    7, 7, 7, 7
+]
+
+# factorized training - a shared piece-square table (one row per plane and
+# square, no king) is summed into every slice. it gives the rarely visited
+# king buckets a useful starting point, and is folded into them on export
+FACTORIZE     = False
+FACTOR_COUNT  = PLANE_FEATURES
+FACTOR_LAYER  = "Embedding_Factor"
+
+def full_feature_index(king_square: int, piece_type: int, is_black: bool, piece_square: int) -> int:
+
+    # map piece_type 1..5 into 0..4
+    piece_type_idx = piece_type - 1
+    color_bit      = 1 if is_black else 0
+
+    king_offset  = king_square * PLANE_FEATURES
+    piece_offset = (piece_type_idx * 2 + color_bit) * 64 + piece_square
+
+    return king_offset + piece_offset
+
+def is_reachable(full_index: int) -> bool:
+    king_square = full_index // PLANE_FEATURES
+    plane       = (full_index % PLANE_FEATURES) >> 6
+    square      = full_index & 63
+
+    # planes 0 and 1 are the white and black pawns
+    if plane < 2 and (square >> 3) in (0, 7):
+        return False
+
+    return square != king_square
+
+# the layout every weight file was saved with before this existed
+LEGACY_LAYOUT = {
+    "compact":      False,
+    "king_mirror":  False,
+    "king_buckets": None,
+    "factorize":    False
+}
+
+_REACHABLE = np.array([is_reachable(f) for f in range(FULL_FEATURE_COUNT)])
+
+def build_tables(lay: dict):
+    buckets = lay.get("king_buckets")
+    mirror  = lay.get("king_mirror", False)
+
+    # raw (uncompacted) index of every canonical feature in this layout
+    raw = np.empty(FULL_FEATURE_COUNT, dtype = np.int64)
+    squares = np.arange(64)
+
+    for king in range(64):
+        mirrored = mirror and (king & 7) >= 4
+        k        = king ^ 7 if mirrored else king
+
+        # position of the king within the bucket table (or its own slice)
+        k_pos = (k >> 3) * 4 + (k & 7) if mirror else k
+        slot  = k_pos if buckets is None else buckets[k_pos]
+
+        for plane in range(10):
+            base = king * PLANE_FEATURES + plane * 64
+            raw[base:base + 64] = slot * PLANE_FEATURES + plane * 64 + (squares ^ 7 if mirrored else squares)
+
+    slices = (32 if mirror else 64) if buckets is None else max(buckets) + 1
+
+    if lay.get("compact", False):
+        # keep only the rows at least one reachable canonical feature maps to
+        used  = np.unique(raw[_REACHABLE])
+        renum = np.full(slices * PLANE_FEATURES, -1, dtype = np.int64)
+        renum[used] = np.arange(len(used))
+
+        table = np.where(_REACHABLE, renum[raw], -1)
+        count = len(used)
+    else:
+        table = raw
+        count = slices * PLANE_FEATURES
+
+    # trained row -> row of the shared factor table (plane and square)
+    factor_of = np.zeros(count, dtype = np.int32)
+    valid     = table >= 0
+    factor_of[table[valid]] = raw[valid] % PLANE_FEATURES
+
+    return table.astype(np.int32), int(count), factor_of
+
+# description of the current layout, stored next to the weights
+def layout(slot: int = None) -> dict:
+    return {
+        "compact":      COMPACT_FEATURES,
+        "king_mirror":  KING_MIRROR,
+        "king_buckets": KING_BUCKETS,
+        "factorize":    FACTORIZE,
+        "factor_slot":  slot
+    }
+
+# canonical index -> trained index (-1 for dropped features),
+# and trained index -> row of the shared factor table
+INDEX_TABLE, FEATURE_COUNT, FACTOR_OF = build_tables(layout())
+_INDEX_LIST = INDEX_TABLE.tolist()
+
+def feature_index(king_square: int, piece_type: int, is_black: bool, piece_square: int) -> int:
+    return _INDEX_LIST[full_feature_index(king_square, piece_type, is_black, piece_square)]
+
+def board_features(board: chess.Board):
+    w_indices = []
+    b_indices = []
+    m_w_indices = []
+    m_b_indices = []
+
+    w_king_sq = board.king(chess.WHITE)
+    b_king_sq = board.king(chess.BLACK)
+
+    # if a king is missing (shouldn't happen in legal positions), we still produce empty lists.
+    if w_king_sq is None or b_king_sq is None:
+        return []
+
+    m_w_king_sq = w_king_sq ^ 7
+    m_b_king_sq = b_king_sq ^ 7
+
+    for sq, piece in board.piece_map().items():
+
+        # kings are excluded
+        if piece.piece_type == chess.KING:
+            continue
+
+        # piece_color True if black, False if white
+        is_black = piece.color == chess.BLACK
+
+        m_sq = sq ^ 7
+
+        # index into white accumulator (white king as reference)
+        idx_w = feature_index(
+            king_square  = w_king_sq,
+            piece_type   = piece.piece_type,
+            is_black     = is_black,
+            piece_square = sq
+        )
+        # index into black accumulator (black king as reference)
+        idx_b = feature_index(
+            king_square  = b_king_sq ^ 56,
+            piece_type   = piece.piece_type,
+            is_black     = not is_black,
+            piece_square = sq ^ 56
+        )
+
+        m_idx_w = feature_index(
+            king_square  = m_w_king_sq,
+            piece_type   = piece.piece_type,
+            is_black     = is_black,
+            piece_square = m_sq
+        )
+        m_idx_b = feature_index(
+            king_square  = m_b_king_sq ^ 56,
+            piece_type   = piece.piece_type,
+            is_black     = not is_black,
+            piece_square = m_sq ^ 56
+        )
+
+        w_indices.append(idx_w)
+        b_indices.append(idx_b)
+        m_w_indices.append(m_idx_w)
+        m_b_indices.append(m_idx_b)
+
+    return w_indices, b_indices, m_w_indices, m_b_indices
+
+# the factor table's contribution to the two accumulators: every active
+# feature is mapped to its plane and square, whose shared rows are summed.
+# shared by the build_model of train.py and txttrain.py. tensorflow is only
+# imported here, the rest of this module doesn't need it
+def factor_accumulators(inp_active, inp_passive, embed_dim: int):
+    import tensorflow as tf
+    from keras import layers
+
+    factor_of  = tf.constant(FACTOR_OF)
+    emb_factor = layers.Embedding(
+        input_dim              = FACTOR_COUNT,
+        output_dim             = embed_dim,
+        embeddings_initializer = 'zeros',
+        name                   = FACTOR_LAYER
+    )
+
+    idx_active = layers.Lambda(
+        lambda x: tf.gather(factor_of, x),
+        output_shape = (None,),
+        name         = 'Factor_Index_Active'
+    )(inp_active)
+
+    idx_passive = layers.Lambda(
+        lambda x: tf.gather(factor_of, x),
+        output_shape = (None,),
+        name         = 'Factor_Index_Passive'
+    )(inp_passive)
+
+    factor_active = layers.Lambda(
+        lambda x: tf.reduce_sum(x, axis = 1),
+        output_shape = (embed_dim,),
+        name         = 'Factor_Active'
+    )(emb_factor(idx_active))
+
+    factor_passive = layers.Lambda(
+        lambda x: tf.reduce_sum(x, axis = 1),
+        output_shape = (embed_dim,),
+        name         = 'Factor_Passive'
+    )(emb_factor(idx_passive))
+
+    return factor_active, factor_passive
+
+# index of the factor table among the model's weights (None if not factorized)
+def factor_slot(model):
+    if not FACTORIZE:
+        return None
+
+    var = model.get_layer(FACTOR_LAYER).embeddings
+    return next(i for i, w in enumerate(model.weights) if w is var)
+
+def save_layout(path: str, slot: int = None):
+    with open(path, "w") as f:
+        json.dump({**layout(slot), "feature_count": FEATURE_COUNT}, f)
+
+def load_layout(path: str) -> dict:
+    try:
+        with open(path, "r") as f:
+            return {**LEGACY_LAYOUT, **json.load(f)}
+    except (OSError, ValueError):
+        # weights saved before the layout file existed
+        return dict(LEGACY_LAYOUT)
+
+def _same_layout(a: dict, b: dict) -> bool:
+    return all(a.get(k) == b.get(k) for k in LEGACY_LAYOUT)
+
+# expand a trained embedding table into the canonical engine layout. rows
+# of features that were never trained (unreachable ones) are left zero.
+# a factor table, if given, is folded into every row
+def export_embedding(emb: np.ndarray, saved: dict = None, factor: np.ndarray = None) -> np.ndarray:
+    table, _, factor_of = build_tables(saved) if saved is not None else (INDEX_TABLE, FEATURE_COUNT, FACTOR_OF)
+
+    if factor is not None:
+        emb = emb + factor[factor_of]
+
+    full  = np.zeros((FULL_FEATURE_COUNT, emb.shape[1]), dtype = emb.dtype)
+    valid = table >= 0
+    full[valid] = emb[table[valid]]
+    return full
+
+# convert an embedding saved with some (possibly different) layout into the
+# current one, so older weight files can still be used to resume training.
+# rows shared by several king squares get the average of their weights
+def import_embedding(emb: np.ndarray, saved: dict) -> np.ndarray:
+    if emb.shape[0] == FEATURE_COUNT and _same_layout(saved, layout()):
+        return emb
+
+    full = export_embedding(emb, saved)
+    mask = (INDEX_TABLE >= 0) & _REACHABLE
+
+    out    = np.zeros((FEATURE_COUNT, emb.shape[1]), dtype = np.float64)
+    counts = np.zeros(FEATURE_COUNT, dtype = np.int64)
+    np.add.at(out, INDEX_TABLE[mask], full[mask])
+    np.add.at(counts, INDEX_TABLE[mask], 1)
+
+    out /= np.maximum(counts, 1)[:, None]
+    return out.astype(emb.dtype)
+
+# remove the factor table from a saved weight list and fold it into the
+# embedding, which stays in the saved layout
+def fold_factor(weights: list, saved: dict) -> list:
+    slot = saved.get("factor_slot")
+    if slot is None:
+        return list(weights)
+
+    weights = list(weights)
+    factor  = weights.pop(slot)
+
+    _, _, factor_of = build_tables(saved)
+    weights[0] = weights[0] + factor[factor_of]
+    return weights
+
+# saved weight list -> weight list of a model built with the current layout
+def import_weights(weights: list, saved: dict, slot: int = None) -> list:
+
+    # same layout, including the factor table - nothing to convert
+    if _same_layout(saved, layout()) and saved.get("factor_slot") == slot and weights[0].shape[0] == FEATURE_COUNT:
+        return list(weights)
+
+    weights    = fold_factor(weights, saved)
+    weights[0] = import_embedding(weights[0], saved)
+
+    # the factor table starts at zero, the folded rows already hold everything
+    if slot is not None:
+        weights.insert(slot, np.zeros((FACTOR_COUNT, weights[0].shape[1]), dtype = weights[0].dtype))
+
+    return weights
+
+# saved weight list -> the weights in the order and layout the engine reads
+def export_weights(weights: list, saved: dict) -> list:
+    weights    = fold_factor(weights, saved)
+    weights[0] = export_embedding(weights[0], saved)
+    return weights
+
+class FeatureTracker:
+
+    # keeps the four feature sets of board_features() up to date while a game
+    # is played, the same way NNUEEvaluator.Update does in the engine. moves
+    # only touch the few affected features, and only the perspective whose
+    # king has moved is rebuilt (its reference square, and thus bucket, changed)
+    def __init__(self, board: chess.Board = None):
+        self.board = board if board is not None else chess.Board()
+        self.sets  = {chess.WHITE: (set(), set()), chess.BLACK: (set(), set())}
+
+        self._rebuild(chess.WHITE)
+        self._rebuild(chess.BLACK)
+
+    # normal and horizontally mirrored index of a piece from one king's perspective
+    def _indices(self, persp: bool, king: int, piece_type: int, is_black: bool, sq: int):
+        if persp == chess.WHITE:
+            return (feature_index(king,      piece_type, is_black, sq),
+                    feature_index(king ^ 7,  piece_type, is_black, sq ^ 7))
+
+        return (feature_index(king ^ 56, piece_type, not is_black, sq ^ 56),
+                feature_index(king ^ 63, piece_type, not is_black, sq ^ 63))
+
+    def _rebuild(self, persp: bool):
+        normal, mirrored = self.sets[persp]
+        normal.clear()
+        mirrored.clear()
+
+        king = self.board.king(persp)
+        if king is None:
+            return
+
+        for sq, piece in self.board.piece_map().items():
+            if piece.piece_type == chess.KING:
+                continue
+
+            f, m = self._indices(persp, king, piece.piece_type, piece.color == chess.BLACK, sq)
+            normal.add(f)
+            mirrored.add(m)
+
+    def push(self, move: chess.Move):
+        board = self.board
+        piece = board.piece_at(move.from_square)
+
+        # null moves and other oddities - just start over
+        if piece is None:
+            board.push(move)
+            self._rebuild(chess.WHITE)
+            self._rebuild(chess.BLACK)
+            return
+
+        mover   = piece.color
+        is_king = piece.piece_type == chess.KING
+
+        removed = []
+        added   = []
+
+        # the moving piece (kings are not part of the feature set)
+        if not is_king:
+            removed.append((piece.piece_type, mover, move.from_square))
+            added.append((move.promotion or piece.piece_type, mover, move.to_square))
+
+        if board.is_castling(move):
+            # the rook jumps over the king - to the f file or the d file
+            back_rank = move.from_square & 56
+            rook_from, rook_to = (back_rank + 7, back_rank + 5) if board.is_kingside_castling(move) \
+                            else (back_rank,     back_rank + 3)
+
+            removed.append((chess.ROOK, mover, rook_from))
+            added.append((chess.ROOK, mover, rook_to))
+
+        elif board.is_en_passant(move):
+            # the captured pawn stands behind the destination square
+            removed.append((chess.PAWN, not mover, move.to_square ^ 8))
+
+        else:
+            captured = board.piece_at(move.to_square)
+            if captured is not None:
+                removed.append((captured.piece_type, not mover, move.to_square))
+
+        # a king move rebuilds its own perspective after the move instead
+        for persp in ((not mover,) if is_king else (chess.WHITE, chess.BLACK)):
+            normal, mirrored = self.sets[persp]
+            king = board.king(persp)
+
+            for piece_type, color, sq in removed:
+                f, m = self._indices(persp, king, piece_type, color == chess.BLACK, sq)
+                normal.discard(f)
+                mirrored.discard(m)
+
+            for piece_type, color, sq in added:
+                f, m = self._indices(persp, king, piece_type, color == chess.BLACK, sq)
+                normal.add(f)
+                mirrored.add(m)
+
+        board.push(move)
+
+        if is_king:
+            self._rebuild(mover)
+
+    # same order of lists as board_features(): white, black, mirrored white, mirrored black
+    def features(self):
+        (w, m_w), (b, m_b) = self.sets[chess.WHITE], self.sets[chess.BLACK]
+        return list(w), list(b), list(m_w), list(m_b)
+
+# plays random games and compares the incrementally updated features with
+# a full rebuild after every move. run this file directly to check
+def verify_incremental(games: int = 500, seed: int = 1) -> dict:
+    import random
+
+    rng    = random.Random(seed)
+    events = {"moves": 0, "captures": 0, "en_passant": 0, "castling": 0, "promotions": 0, "king_moves": 0}
+
+    for _ in range(games):
+        tracker = FeatureTracker()
+        board   = tracker.board
+
+        while not board.is_game_over() and board.ply() < 300:
+            move = rng.choice(list(board.legal_moves))
+
+            events["moves"]      += 1
+            events["captures"]   += board.is_capture(move)
+            events["en_passant"] += board.is_en_passant(move)
+            events["castling"]   += board.is_castling(move)
+            events["promotions"] += move.promotion is not None
+            events["king_moves"] += board.piece_type_at(move.from_square) == chess.KING
+
+            tracker.push(move)
+
+            expected = board_features(board)
+            actual   = tracker.features()
+
+            for name, e, a in zip(("white", "black", "mirrored white", "mirrored black"), expected, actual):
+                if sorted(e) != sorted(a):
+                    raise AssertionError(f"{name} features differ after {move.uci()} in {board.fen()}")
+
+    return events
+
+if __name__ == "__main__":
+    print(verify_incremental())
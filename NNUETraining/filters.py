@@ -0,0 +1,107 @@
+#
+# Kreveta chess engine by ZlomenyMesic
+# started 4-3-2025
+#
+
+# cheap pre-labelling checks. a position where the side to move is in check or
+# can win material right away is a poor target for a static evaluation - the
+# score depends on the tactic, not on the placement of the pieces
+
+import chess
+
+PIECE_VALUES = {
+    chess.PAWN:   100,
+    chess.KNIGHT: 300,
+    chess.BISHOP: 310,
+    chess.ROOK:   500,
+    chess.QUEEN:  900,
+    chess.KING:   20000
+}
+
+# plies per bucket in the filter statistics
+BUCKET_PLIES = 20
+
+# static exchange evaluation of a capture on the target square. both sides keep
+# recapturing with their least valuable attacker and may stop at any point.
+# x-rays are handled by recomputing the attackers on the shrinking occupancy,
+# pins are ignored
+def see(board: chess.Board, move: chess.Move) -> int:
+    to       = move.to_square
+    occupied = board.occupied & ~chess.BB_SQUARES[move.from_square]
+
+    if board.is_en_passant(move):
+        captured = PIECE_VALUES[chess.PAWN]
+        occupied &= ~chess.BB_SQUARES[chess.square(chess.square_file(to), chess.square_rank(move.from_square))]
+    else:
+        victim   = board.piece_type_at(to)
+        captured = PIECE_VALUES[victim] if victim else 0
+
+    on_square = PIECE_VALUES[board.piece_type_at(move.from_square)]
+    if move.promotion:
+        captured += PIECE_VALUES[move.promotion] - PIECE_VALUES[chess.PAWN]
+        on_square = PIECE_VALUES[move.promotion]
+
+    gain = [captured]
+    side = not board.turn
+
+    while True:
+        attackers = board.attackers_mask(side, to, occupied) & occupied
+        if not attackers:
+            break
+
+        # least valuable attacker
+        for ptype in (chess.PAWN, chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN, chess.KING):
+            bb = attackers & board.pieces_mask(ptype, side)
+            if bb:
+                break
+
+        sq = chess.lsb(bb)
+
+        # the king may only recapture when the square is no longer defended
+        if ptype == chess.KING and board.attackers_mask(not side, to, occupied & ~chess.BB_SQUARES[sq]) & occupied:
+            break
+
+        gain.append(on_square - gain[-1])
+        on_square = PIECE_VALUES[ptype]
+        occupied &= ~chess.BB_SQUARES[sq]
+        side      = not side
+
+    # each side picks the better of stopping and continuing the exchange
+    for i in range(len(gain) - 1, 0, -1):
+        gain[i - 1] = -max(-gain[i - 1], gain[i])
+
+    return gain[0]
+
+# returns the reason the position should not be labelled ("check" or "capture"),
+# or None for a quiet position. a capture counts when its SEE reaches the threshold,
+# a threshold of None makes any legal capture count
+def classify(board: chess.Board, in_check: bool = True, captures: bool = True, see_threshold = 1):
+    if in_check and board.is_check():
+        return "check"
+
+    if captures:
+        for move in board.generate_legal_captures():
+            if see_threshold is None or see(board, move) >= see_threshold:
+                return "capture"
+
+    return None
+
+def ply_bucket(ply: int, width: int = BUCKET_PLIES) -> str:
+    lo = ply // width * width
+    return f"ply_{lo:03d}_{lo + width - 1:03d}"
+
+# adds filtered_fraction_<bucket> fields computed from the summed worker
+# counters filter_seen_<bucket> and filter_skipped_<bucket> of a report
+def filtered_fractions(report: dict, group: str = "workers") -> dict:
+    prefix    = f"{group}_filter_seen_"
+    fractions = {}
+
+    for name, seen in report.items():
+        if not name.startswith(prefix) or name.endswith("_per_sec") or not seen:
+            continue
+
+        bucket  = name[len(prefix):]
+        skipped = report.get(f"{group}_filter_skipped_{bucket}", 0)
+        fractions[f"filtered_fraction_{bucket}"] = round(skipped / seen, 4)
+
+    return fractions
@@ -0,0 +1,208 @@
+#
+# Kreveta chess engine by ZlomenyMesic
+# started 4-3-2025
+#
+
+# compact binary storage of whole games instead of one fen;cp line per position.
+# consecutive positions of a game share almost everything, so only the moves
+# are stored and the positions are replayed while reading:
+#
+#   header:  b"KRVG", version (u8), flags (u8, bit 0 = zstd compressed body)
+#   game:    start fen length (u8, 0 = standard start position), start fen,
+#            result (u8), ply count (u16), then per ply a packed move (u16)
+#            and the score of the position after it (i16)
+#
+# moves are from | to << 6 | promotion << 12 (0 = none, 1..4 = N, B, R, Q).
+# scores are in centipawns relative to the side to move, like in fen;cp files.
+# unlabelled positions store UNLABELLED. all values are little-endian
+
+import os
+import sys
+import time
+import struct
+
+import numpy as np
+import chess
+
+import features
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC       = b"KRVG"
+VERSION     = 1
+FLAG_ZSTD   = 1
+UNLABELLED  = -32768
+EXTENSION   = ".krg"
+
+# compressed games are flushed as a block every this many games, so
+# a file that is still being written can be read up to the last block
+FLUSH_GAMES = 64
+
+RESULTS = {None: 0, "1-0": 1, "1/2-1/2": 2, "0-1": 3}
+RESULT_NAMES = {v: k for k, v in RESULTS.items()}
+
+PLY_DTYPE = np.dtype([("move", "<u2"), ("score", "<i2")])
+
+def pack_move(move: chess.Move) -> int:
+    promo = move.promotion - 1 if move.promotion else 0
+    return move.from_square | move.to_square << 6 | promo << 12
+
+def unpack_move(packed: int) -> chess.Move:
+    promo = packed >> 12
+    return chess.Move(packed & 63, packed >> 6 & 63, promo + 1 if promo else None)
+
+class GameWriter:
+
+    # games are built up ply by ply with begin() / add() / end(). zstd
+    # compression needs the zstandard package, without it the body is raw
+    def __init__(self, path: str, compress: bool = False, level: int = 10):
+        if compress and zstandard is None:
+            raise RuntimeError("zstd compression requires the zstandard package")
+
+        self.file  = open(path, "wb")
+        self.file.write(MAGIC + struct.pack("<BB", VERSION, FLAG_ZSTD if compress else 0))
+
+        self.zstd  = zstandard.ZstdCompressor(level = level).compressobj() if compress else None
+        self.games = 0
+
+        self.start  = None
+        self.plies  = []
+
+    def begin(self, board: chess.Board = None):
+        fen = board.fen() if board is not None else chess.STARTING_FEN
+        self.start = b"" if fen == chess.STARTING_FEN else fen.encode()
+        self.plies = []
+
+    # score belongs to the position after the move, None if it isn't labelled
+    def add(self, move: chess.Move, score = None):
+        score = UNLABELLED if score is None else int(np.clip(round(score), -32767, 32767))
+        self.plies.append((pack_move(move), score))
+
+    def end(self, result: str = None):
+        plies = np.array(self.plies, dtype = PLY_DTYPE)
+        data  = struct.pack("<B", len(self.start)) + self.start \
+              + struct.pack("<BH", RESULTS.get(result, 0), len(plies)) + plies.tobytes()
+
+        if self.zstd is None:
+            self.file.write(data)
+        else:
+            self.file.write(self.zstd.compress(data))
+
+        self.games += 1
+        if self.zstd is not None and self.games % FLUSH_GAMES == 0:
+            self.file.write(self.zstd.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK))
+            self.file.flush()
+
+        self.plies = []
+
+    def close(self):
+        if self.zstd is not None:
+            self.file.write(self.zstd.flush())
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _read_exact(stream, n: int) -> bytes:
+    data = stream.read(n)
+    while 0 < len(data) < n:
+        more = stream.read(n - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+# yields (start fen, packed plies as a PLY_DTYPE array, result) for every game.
+# a truncated last game (file still being written) is silently dropped
+def read_games(path: str):
+    with open(path, "rb") as f:
+        header = f.read(6)
+        if header[:4] != MAGIC:
+            raise ValueError(f"{path} is not a game file")
+
+        version, flags = struct.unpack("<BB", header[4:])
+        if version != VERSION:
+            raise ValueError(f"{path} has unsupported version {version}")
+
+        stream = f
+        if flags & FLAG_ZSTD:
+            if zstandard is None:
+                raise RuntimeError("reading a compressed game file requires the zstandard package")
+            stream = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames = True)
+
+        try:
+            while True:
+                head = _read_exact(stream, 1)
+                if not head:
+                    return
+
+                fen  = _read_exact(stream, head[0])
+                meta = _read_exact(stream, 3)
+                if len(fen) < head[0] or len(meta) < 3:
+                    return
+
+                result, count = struct.unpack("<BH", meta)
+                data = _read_exact(stream, count * PLY_DTYPE.itemsize)
+                if len(data) < count * PLY_DTYPE.itemsize:
+                    return
+
+                yield fen.decode() or chess.STARTING_FEN, np.frombuffer(data, dtype = PLY_DTYPE), RESULT_NAMES.get(result)
+
+        except Exception as e:
+            if zstandard is not None and isinstance(e, zstandard.ZstdError):
+                return
+            raise
+
+# replays the games and yields (board, score, features) for every labelled
+# position. features are the four lists of board_features(), but updated
+# incrementally. the board is reused - copy it if it has to be kept
+def iter_positions(path: str, with_features: bool = True):
+    for fen, plies, _ in read_games(path):
+        tracker = features.FeatureTracker(chess.Board(fen))
+
+        for packed, score in plies.tolist():
+            tracker.push(unpack_move(packed))
+
+            if score != UNLABELLED:
+                yield tracker.board, score, tracker.features() if with_features else None
+
+# compares a game file with the equivalent fen;cp text and measures decoding
+def stats(path: str):
+    games = positions = labelled = fen_bytes = 0
+    start = time.perf_counter()
+
+    for fen, plies, _ in read_games(path):
+        board = chess.Board(fen)
+        games += 1
+
+        for packed, score in plies.tolist():
+            board.push(unpack_move(packed))
+            positions += 1
+
+            if score != UNLABELLED:
+                labelled  += 1
+                fen_bytes += len(board.fen()) + len(str(score)) + 2
+
+    text_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in iter_positions(path):
+        pass
+    feat_time = time.perf_counter() - start
+
+    size = os.path.getsize(path)
+    print(f"{path}: {games} games, {positions} positions, {labelled} labelled")
+    print(f"  file:      {size} bytes, {size / max(1, labelled):.2f} bytes/position")
+    print(f"  fen;cp:    {fen_bytes} bytes, {fen_bytes / max(1, labelled):.2f} bytes/position ({fen_bytes / max(1, size):.1f}x larger)")
+    print(f"  replay:    {positions / max(1e-9, text_time):.0f} positions/s (including fen output)")
+    print(f"  features:  {labelled / max(1e-9, feat_time):.0f} positions/s")
+
+if __name__ == "__main__":
+    for p in sys.argv[1:]:
+        stats(p)
@@ -0,0 +1,442 @@
+#
+# Kreveta chess engine by ZlomenyMesic
+# started 4-3-2025
+#
+
+# sample ingestion over tcp, so self-play can run on other machines than the
+# trainer. the protocol is deliberately tiny:
+#
+#   handshake:  b"KRVS", version (u8), layout id (u64), token length (u16),
+#               token. answered by a single byte, 1 = accepted, 0 = rejected
+#               token, 2 = other protocol version or feature layout. the token
+#               is checked first, so only an authenticated client ever gets
+#               a 2 - every version must keep this part of the handshake
+#   batch:      payload length (u32), payload, answered by a single ack byte
+#               (or 0 for a batch the server couldn't use, which is dropped)
+#   payload:    sample count n (u32), active lengths (n x u8), passive lengths
+#               (n x u8), targets (n x f32), then the feature indices of all
+#               samples (u16, active before passive)
+#
+# the server only acks a batch once all of its samples are in the trainer's
+# queue, and a client never has more than one unacked batch - a full queue
+# on the trainer thus stalls the remote generators (backpressure). all values
+# are little-endian
+#
+# the layout id pins the feature layout (compaction, mirroring, buckets) the
+# indices are in - a generator on another layout would feed the trainer
+# indices its embeddings don't have, or silently mean other features
+
+import os
+import sys
+import hmac
+import json
+import hashlib
+import time
+import queue
+import signal
+import socket
+import struct
+import argparse
+import threading
+import socketserver
+import multiprocessing as mp
+
+import numpy as np
+
+import features
+
+MAGIC       = b"KRVS"
+VERSION     = 2
+ACCEPTED    = b"\x01"
+REJECTED    = b"\x00"
+MISMATCH    = b"\x02"
+ACK         = b"\x06"
+
+TOKEN_ENV = "KREVETA_INGEST_TOKEN"
+
+DEFAULT_PORT = 5577
+BATCH_SIZE   = 256
+MAX_PAYLOAD  = 64 * 2**20
+
+RECONNECT_SEC     = 1.0
+RECONNECT_MAX_SEC = 30.0
+
+# everything the sample indices depend on, hashed into a u64
+def layout_id() -> int:
+    lay = features.layout()
+    key = {
+        "compact":       lay["compact"],
+        "king_mirror":   lay["king_mirror"],
+        "king_buckets":  lay["king_buckets"],
+        "feature_count": features.FEATURE_COUNT
+    }
+    digest = hashlib.sha256(json.dumps(key, sort_keys = True).encode()).digest()
+    return int.from_bytes(digest[:8], "little")
+
+def encode_batch(samples) -> bytes:
+    n       = len(samples)
+    a_len   = np.fromiter((len(a) for (a, _), _ in samples), dtype = np.uint8, count = n)
+    p_len   = np.fromiter((len(p) for (_, p), _ in samples), dtype = np.uint8, count = n)
+    targets = np.fromiter((t for _, t in samples), dtype = "<f4", count = n)
+    indices = np.concatenate([np.concatenate([a, p]) for (a, p), _ in samples]).astype("<u2")
+
+    return struct.pack("<I", n) + a_len.tobytes() + p_len.tobytes() + targets.tobytes() + indices.tobytes()
+
+# the inverse of encode_batch, in the sample format of engine_worker. every
+# index must be below feature_count, so that a bad batch is refused here and
+# not by the trainer's embedding lookup
+def decode_batch(payload: bytes, feature_count: int = None):
+    (n,)    = struct.unpack_from("<I", payload)
+    a_len   = np.frombuffer(payload, dtype = np.uint8, count = n, offset = 4).astype(np.int64)
+    p_len   = np.frombuffer(payload, dtype = np.uint8, count = n, offset = 4 + n).astype(np.int64)
+    targets = np.frombuffer(payload, dtype = "<f4",    count = n, offset = 4 + 2 * n)
+    indices = np.frombuffer(payload, dtype = "<u2",    offset = 4 + 6 * n).astype(np.int32)
+
+    if len(indices) != int(a_len.sum() + p_len.sum()):
+        raise ValueError("malformed batch")
+    if feature_count is not None and len(indices) and int(indices.max()) >= feature_count:
+        raise ValueError(f"feature index {int(indices.max())} out of range ({feature_count} features)")
+
+    ends    = np.cumsum(a_len + p_len)
+    samples = []
+    for i in range(n):
+        start = ends[i] - a_len[i] - p_len[i]
+        mid   = start + a_len[i]
+        samples.append(((indices[start:mid], indices[mid:ends[i]]), float(targets[i])))
+    return samples
+
+def _recv_exact(stream, n: int) -> bytes:
+    data = stream.read(n)
+    if len(data) < n:
+        raise ConnectionError("connection closed")
+    return data
+
+class IngestServer:
+
+    # accepts authenticated generator connections and feeds their samples into
+    # the trainer's samples queue. every connection is served by its own thread
+    def __init__(self, samples_queue, stop_event, token: str, metrics = None, host: str = "127.0.0.1", port: int = DEFAULT_PORT,
+                 layout: int = None, feature_count: int = None):
+        if not token:
+            raise ValueError("the ingestion server requires a token")
+
+        server_self = self
+        expected    = token.encode()
+        layout      = layout_id() if layout is None else layout
+
+        self.feature_count = features.FEATURE_COUNT if feature_count is None else feature_count
+
+        self.samples_queue = samples_queue
+        self.stop_event    = stop_event
+        self.metrics       = metrics
+        self.clients       = 0
+        self.lock          = threading.Lock()
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    head = _recv_exact(self.rfile, 5)
+                    if head[:4] != MAGIC:
+                        return
+
+                    # authenticate before answering anything else, so that
+                    # a peer without the token learns nothing about the
+                    # trainer, not even its version or feature layout
+                    client_layout, length = struct.unpack("<QH", _recv_exact(self.rfile, 10))
+                    if not hmac.compare_digest(_recv_exact(self.rfile, length), expected):
+                        server_self.count("remote_rejected")
+                        self.wfile.write(REJECTED)
+                        return
+                    if head[4] != VERSION or client_layout != layout:
+                        server_self.count("remote_mismatched")
+                        self.wfile.write(MISMATCH)
+                        return
+
+                    self.wfile.write(ACCEPTED)
+                    server_self.connected(+1)
+
+                    try:
+                        server_self.serve(self.rfile, self.wfile)
+                    finally:
+                        server_self.connected(-1)
+
+                except (ConnectionError, OSError, ValueError):
+                    return
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port   = self.server.server_address[1]
+        self.thread = threading.Thread(target = self.server.serve_forever, name = "ingest", daemon = True)
+
+    def count(self, name: str, n: int = 1):
+        if self.metrics is not None:
+            self.metrics.counter(name).inc(n)
+
+    def connected(self, delta: int):
+        with self.lock:
+            self.clients += delta
+            if self.metrics is not None:
+                self.metrics.gauge("remote_clients").set(self.clients)
+
+    def serve(self, rfile, wfile):
+        while not self.stop_event.is_set():
+            try:
+                (length,) = struct.unpack("<I", _recv_exact(rfile, 4))
+            except ConnectionError:
+                return
+
+            if length > MAX_PAYLOAD:
+                raise ValueError("batch too large")
+
+            try:
+                samples = decode_batch(_recv_exact(rfile, length), self.feature_count)
+            except ValueError as e:
+                print(f"[ingest] refused a batch: {e}")
+                self.count("remote_bad_batches")
+                wfile.write(REJECTED)
+                continue
+
+            # blocks while the trainer's queue is full - the ack is held back
+            for sample in samples:
+                while True:
+                    try:
+                        self.samples_queue.put(sample, timeout = 1.0)
+                        break
+                    except queue.Full:
+                        if self.stop_event.is_set():
+                            return
+
+            self.count("remote_batches")
+            self.count("remote_samples", len(samples))
+            wfile.write(ACK)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class RemoteQueue:
+
+    # stands in for the samples queue of engine_worker on a remote machine.
+    # put() only fills a small local buffer (raising queue.Full like the real
+    # queue when it is full), a background thread batches the samples and
+    # sends them, reconnecting with backoff whenever the connection is lost.
+    # a batch whose ack was lost on a broken connection is sent again, one
+    # the server refused is dropped
+    def __init__(self, host: str, port: int, token: str, batch_size: int = BATCH_SIZE, layout: int = None):
+        self.host       = host
+        self.port       = port
+        self.token      = token.encode()
+        self.layout     = layout_id() if layout is None else layout
+        self.batch_size = batch_size
+
+        self.buffer  = queue.Queue(maxsize = 4 * batch_size)
+        self.closed  = threading.Event()
+        self.sent    = 0
+        self.dropped = 0
+        self.thread  = threading.Thread(target = self._sender, name = "remote-queue", daemon = True)
+        self.thread.start()
+
+    def put(self, sample, timeout: float = None):
+        self.buffer.put(sample, timeout = timeout)
+
+    def qsize(self):
+        raise NotImplementedError
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        sock.sendall(MAGIC + struct.pack("<BQH", VERSION, self.layout, len(self.token)) + self.token)
+        answer = sock.recv(1)
+        if answer != ACCEPTED:
+            sock.close()
+            if answer == MISMATCH:
+                raise PermissionError("the ingestion server runs another protocol version or feature layout")
+            raise PermissionError("the ingestion server rejected the token")
+        return sock
+
+    def _next_batch(self):
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                # send a partial batch when generation is slow or we're closing
+                batch.append(self.buffer.get(timeout = 0.0 if self.closed.is_set() else 1.0))
+            except queue.Empty:
+                if batch or self.closed.is_set():
+                    break
+        return batch
+
+    def _sender(self):
+        sock    = None
+        backoff = RECONNECT_SEC
+        payload = None
+
+        while True:
+            if payload is None:
+                batch = self._next_batch()
+                if not batch:
+                    break
+                payload = encode_batch(batch)
+
+            try:
+                if sock is None:
+                    sock    = self._connect()
+                    backoff = RECONNECT_SEC
+
+                sock.sendall(struct.pack("<I", len(payload)) + payload)
+                answer = sock.recv(1)
+                if answer == REJECTED:
+                    print("[remote] the server refused a batch, dropping it")
+                    self.dropped += struct.unpack_from("<I", payload)[0]
+                    payload       = None
+                    continue
+                if answer != ACK:
+                    raise ConnectionError("connection closed")
+
+                self.sent += struct.unpack_from("<I", payload)[0]
+                payload    = None
+
+            except PermissionError as e:
+                print(f"[remote] {e}")
+                return
+
+            except OSError as e:
+                print(f"[remote] {e}, reconnecting in {backoff:.0f}s")
+                if sock is not None:
+                    sock.close()
+                sock = None
+
+                time.sleep(backoff)
+                backoff = min(RECONNECT_MAX_SEC, backoff * 2)
+
+        if sock is not None:
+            sock.close()
+
+    # sends whatever is buffered and stops the sender
+    def close(self, timeout: float = 10.0):
+        self.closed.set()
+        self.thread.join(timeout)
+
+def remote_worker(worker_id: int, host: str, port: int, token: str, stop_event):
+    # imported here, the server side doesn't need tensorflow
+    import train
+
+    # ctrl+c goes to the whole process group, the parent stops us through the event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    samples = RemoteQueue(host, port, token)
+    try:
+        train.engine_worker(worker_id, samples, stop_event)
+    finally:
+        samples.close()
+
+def run_client(args):
+    # from the environment like on the trainer, a command line argument would be visible in ps
+    token = os.environ.get(TOKEN_ENV, "")
+    if not token:
+        sys.exit(f"set {TOKEN_ENV} to the trainer's token")
+
+    ctx  = mp.get_context("spawn")
+    stop = ctx.Event()
+
+    workers = [ctx.Process(target = remote_worker, args = (i, args.host, args.port, token, stop))
+               for i in range(args.workers)]
+    for p in workers:
+        p.start()
+
+    try:
+        for p in workers:
+            p.join()
+    except KeyboardInterrupt:
+        print("stopping...")
+        stop.set()
+        for p in workers:
+            p.join(timeout = 15.0)
+
+# everything over localhost, no engine or tensorflow involved
+def self_test(samples: int = 20000, queue_size: int = 1000):
+    rng  = np.random.default_rng(1)
+    data = []
+    for _ in range(samples):
+        a = rng.integers(0, features.FEATURE_COUNT, rng.integers(1, 31)).astype(np.int32)
+        p = rng.integers(0, features.FEATURE_COUNT, rng.integers(1, 31)).astype(np.int32)
+        data.append(((a, p), float(rng.random())))
+
+    stop   = threading.Event()
+    target = queue.Queue(maxsize = queue_size)
+    server = IngestServer(target, stop, "secret", port = 0).start()
+
+    # a wrong token is refused
+    bad = RemoteQueue("127.0.0.1", server.port, "wrong")
+    bad.put(data[0])
+    bad.close()
+    assert bad.sent == 0 and target.empty(), "a client with a wrong token got through"
+
+    # so is another feature layout
+    other = RemoteQueue("127.0.0.1", server.port, "secret", layout = layout_id() ^ 1)
+    other.put(data[0])
+    other.close()
+    assert other.sent == 0 and target.empty(), "a client with another layout got through"
+
+    # and a batch with indices beyond the layout, without losing the connection
+    wide = RemoteQueue("127.0.0.1", server.port, "secret")
+    wide.put(((np.array([features.FEATURE_COUNT], dtype = np.int32), data[0][0][1]), 0.5))
+    time.sleep(1.5)
+    wide.put(data[0])
+    wide.close()
+    assert wide.dropped == 1 and wide.sent == 1, "an out-of-range batch got through"
+    target.get(timeout = 10.0)
+
+    client = RemoteQueue("127.0.0.1", server.port, "secret")
+    start  = time.perf_counter()
+
+    def produce():
+        for sample in data:
+            client.put(sample)
+        client.close(timeout = 60.0)
+
+    producer = threading.Thread(target = produce)
+    producer.start()
+
+    # slow start - the server can't ack while the queue is full, so the
+    # producer must stall instead of sending ahead
+    time.sleep(0.5)
+    stalled = client.sent
+    assert stalled <= queue_size + 2 * client.batch_size, "no backpressure"
+
+    received = [target.get(timeout = 10.0) for _ in range(samples)]
+    producer.join()
+    elapsed = time.perf_counter() - start
+
+    for ((a, p), t), ((ra, rp), rt) in zip(data, received):
+        assert np.array_equal(a, ra) and np.array_equal(p, rp) and abs(t - rt) < 1e-6, "sample mismatch"
+
+    stop.set()
+    server.stop()
+    print(f"self-test passed: {samples} samples in {elapsed:.2f}s ({samples / elapsed:.0f}/s), "
+        + f"{stalled} sent before the consumer started")
+
+def main():
+    parser = argparse.ArgumentParser(description = "remote self-play generators for the trainer")
+    sub    = parser.add_subparsers(dest = "command", required = True)
+
+    client = sub.add_parser("client", help = "run engine workers that push to a remote trainer")
+    client.add_argument("--host",    required = True)
+    client.add_argument("--port",    type = int, default = DEFAULT_PORT)
+    client.add_argument("--workers", type = int, default = mp.cpu_count())
+
+    sub.add_parser("selftest", help = "check the protocol over localhost")
+
+    args = parser.parse_args()
+    if args.command == "client":
+        run_client(args)
+    else:
+        self_test()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+#
+# Kreveta chess engine by ZlomenyMesic
+# started 4-3-2025
+#
+
+# offline labelling of fen shards (one fen per line, anything after a ';' is
+# ignored) for txttrain.py. a fixed pool of uci engines labels every shard in
+# batches; the results of a batch are appended to the output in input order
+# and only then is the shard's progress file updated, so an interrupted run
+# continues where it stopped - output written after the last checkpoint is cut
+# off and relabelled
+
+import os
+import glob
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import chess
+import chess.engine
+
+from metrics import Metrics
+
+ENGINE_CMD = "C:\\Users\\michn\\Downloads\\Stockfish.exe"
+
+BATCH_PER_ENGINE = 64
+REPORT_EVERY_SEC = 10
+MATE_SCORE       = 1800
+
+class EnginePool:
+
+    # every executor thread owns one engine, started on first use. a failing
+    # engine is replaced once per position before the position is given up
+    def __init__(self, cmd: str, size: int, limit: chess.engine.Limit, options: dict, metrics: Metrics):
+        self.cmd      = cmd
+        self.limit    = limit
+        self.options  = options
+        self.metrics  = metrics
+        self.local    = threading.local()
+        self.engines  = []
+        self.next_id  = 0
+        self.lock     = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers = size, thread_name_prefix = "engine")
+
+    def _engine(self):
+        engine = getattr(self.local, "engine", None)
+        if engine is None:
+            engine = chess.engine.SimpleEngine.popen_uci(self.cmd)
+
+            with self.lock:
+                if not hasattr(self.local, "id"):
+                    self.local.id = self.next_id
+                    self.next_id += 1
+                self.engines.append(engine)
+            self.local.engine = engine
+
+            # registered first, so that an engine failing here is restarted too
+            engine.configure({n: v for n, v in self.options.items() if n in engine.options})
+        return engine
+
+    # the thread may have no engine yet, when the start itself failed
+    def _restart(self):
+        engine = getattr(self.local, "engine", None)
+        self.local.engine = None
+        if engine is None:
+            return
+
+        with self.lock:
+            self.engines.remove(engine)
+        try:
+            engine.quit()
+        except Exception:
+            pass
+
+    # side-to-move relative centipawns, None if the position couldn't be labelled
+    # (a malformed fen included, so that one bad line doesn't stop the shard)
+    def label(self, fen: str):
+        try:
+            board = chess.Board(fen)
+        except ValueError:
+            self.metrics.counter("invalid_fens").inc()
+            return None
+
+        for _ in range(2):
+            try:
+                info = self._engine().analyse(board, self.limit)
+                break
+            except (chess.engine.EngineError, chess.engine.EngineTerminatedError, OSError):
+                self.metrics.counter("engine_restarts").inc()
+                self._restart()
+        else:
+            return None
+
+        self.metrics.counter(f"engine_{self.local.id}_positions").inc()
+
+        score = info.get("score")
+        if score is None:
+            return None
+        return int(np.clip(score.pov(board.turn).score(mate_score = MATE_SCORE), -MATE_SCORE, MATE_SCORE))
+
+    def map(self, fens):
+        return self.executor.map(self.label, fens)
+
+    def close(self):
+        self.executor.shutdown()
+        for engine in self.engines:
+            try:
+                engine.quit()
+            except Exception:
+                pass
+
+def load_progress(path: str) -> dict:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"offset": 0, "out_bytes": 0, "positions": 0, "done": False}
+
+def save_progress(path: str, progress: dict):
+    with open(path + ".tmp", "w") as f:
+        json.dump(progress, f)
+    os.replace(path + ".tmp", path)
+
+def read_batch(f, size: int):
+    fens = []
+    while len(fens) < size:
+        line = f.readline()
+        if not line:
+            break
+
+        fen = line.split(b";", 1)[0].strip().decode()
+        if fen:
+            fens.append(fen)
+    return fens
+
+def label_shard(pool: EnginePool, shard: str, out_dir: str, batch: int, metrics: Metrics):
+    name          = os.path.basename(shard)
+    out_path      = os.path.join(out_dir, name)
+    progress_path = out_path + ".progress"
+
+    progress = load_progress(progress_path)
+    if progress["done"]:
+        print(f"{name}: already labelled ({progress['positions']} positions)")
+        return
+
+    # drop anything written after the last checkpoint
+    if os.path.exists(out_path):
+        with open(out_path, "r+b") as f:
+            f.truncate(progress["out_bytes"])
+
+    with open(shard, "rb") as src, open(out_path, "ab") as out:
+        src.seek(progress["offset"])
+
+        while True:
+            fens = read_batch(src, batch)
+            if not fens:
+                break
+
+            lines = []
+            for fen, cp in zip(fens, pool.map(fens)):
+                if cp is None:
+                    metrics.counter("failed").inc()
+                    continue
+                lines.append(f"{fen};{cp}\n".encode())
+
+            out.writelines(lines)
+            out.flush()
+
+            progress["offset"]     = src.tell()
+            progress["out_bytes"]  = out.tell()
+            progress["positions"] += len(lines)
+            save_progress(progress_path, progress)
+
+    progress["done"] = True
+    save_progress(progress_path, progress)
+    print(f"{name}: done ({progress['positions']} positions)")
+
+def reporter(metrics: Metrics, stop: threading.Event, engines: int):
+    start = time.perf_counter()
+
+    while not stop.wait(REPORT_EVERY_SEC):
+        report = metrics.report()
+        rates  = [report.get(f"engine_{i}_positions_per_sec", 0) for i in range(engines)]
+        total  = sum(report.get(f"engine_{i}_positions", 0) for i in range(engines))
+
+        print(f"positions: {total}, {sum(rates):.1f}/s overall ({total / (time.perf_counter() - start):.1f}/s average), "
+            + "per engine: " + " ".join(f"{r:.1f}" for r in rates))
+
+def main():
+    parser = argparse.ArgumentParser(description = "label fen shards with a pool of uci engines")
+    parser.add_argument("shards", nargs = "+", help = "fen files or glob patterns")
+    parser.add_argument("--out",      required = True, help = "output directory (also holds the progress files)")
+    parser.add_argument("--engine",   default = ENGINE_CMD)
+    parser.add_argument("--engines",  type = int, default = os.cpu_count(), help = "number of engine processes")
+    parser.add_argument("--depth",    type = int)
+    parser.add_argument("--nodes",    type = int)
+    parser.add_argument("--movetime", type = float, help = "seconds per position")
+    parser.add_argument("--hash",     type = int, default = 16, help = "hash size per engine in MB")
+    parser.add_argument("--batch",    type = int, default = BATCH_PER_ENGINE, help = "positions per engine between checkpoints")
+    args = parser.parse_args()
+
+    if args.depth is None and args.nodes is None and args.movetime is None:
+        args.depth = 10
+
+    shards = sorted({p for pattern in args.shards for p in glob.glob(pattern)})
+    if not shards:
+        parser.error("no input files")
+
+    os.makedirs(args.out, exist_ok = True)
+
+    # an engine that can't start at all would otherwise fail every position
+    try:
+        chess.engine.SimpleEngine.popen_uci(args.engine).quit()
+    except (chess.engine.EngineError, chess.engine.EngineTerminatedError, OSError) as e:
+        parser.error(f"cannot start the engine {args.engine}: {e}")
+
+    metrics = Metrics()
+    limit   = chess.engine.Limit(depth = args.depth, nodes = args.nodes, time = args.movetime)
+    pool    = EnginePool(args.engine, args.engines, limit, {"Threads": 1, "Hash": args.hash}, metrics)
+
+    stop = threading.Event()
+    threading.Thread(target = reporter, args = (metrics, stop, args.engines), daemon = True).start()
+
+    start = time.perf_counter()
+    try:
+        for shard in shards:
+            label_shard(pool, shard, args.out, args.batch * args.engines, metrics)
+    finally:
+        stop.set()
+        pool.close()
+
+    counters = metrics.snapshot()["counters"]
+    total    = sum(v for n, v in counters.items() if n.startswith("engine_") and n.endswith("_positions"))
+    elapsed  = time.perf_counter() - start
+    print(f"\nlabelled {total} positions in {elapsed:.1f}s ({total / elapsed:.1f}/s), "
+        + f"{counters.get('failed', 0)} failed ({counters.get('invalid_fens', 0)} invalid fens), "
+        + f"{counters.get('engine_restarts', 0)} engine restarts")
+
+if __name__ == "__main__":
+    main()
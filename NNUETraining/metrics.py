@@ -0,0 +1,349 @@
+#
+# Kreveta chess engine by ZlomenyMesic
+# started 4-3-2025
+#
+
+import os
+import json
+import time
+import bisect
+import threading
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# default histogram bounds (in seconds), roughly logarithmic
+TIME_BUCKETS = (
+    0.0005, 0.001, 0.002, 0.005, 0.01, 0.02,
+    0.05,   0.1,   0.2,   0.5,   1.0,  2.0, 5.0
+)
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n = 1):
+        self.value += n
+
+class Gauge:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum")
+
+    # the last bucket collects everything above the highest bound
+    def __init__(self, bounds = TIME_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum    = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    # approximate quantile, interpolated linearly inside the bucket
+    @staticmethod
+    def quantile(bounds, counts, q: float) -> float:
+        total = sum(counts)
+        if total == 0:
+            return 0.0
+
+        rank = q * total
+        seen = 0
+
+        for i, c in enumerate(counts):
+            if seen + c >= rank and c > 0:
+                lo = bounds[i - 1] if i > 0 else 0.0
+                hi = bounds[i] if i < len(bounds) else bounds[-1]
+                return lo + (hi - lo) * (rank - seen) / c
+            seen += c
+
+        return bounds[-1]
+
+# adds a histogram into hists[name], the bounds are assumed to match
+def _merge_hist(hists: dict, name: str, bounds, counts, total):
+    if name in hists:
+        _, h_counts, h_total = hists[name]
+        counts = [a + b for a, b in zip(h_counts, counts)]
+        total += h_total
+    hists[name] = (bounds, list(counts), total)
+
+class Timer:
+    __slots__ = ("hist", "start")
+
+    def __init__(self, hist: Histogram):
+        self.hist = hist
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start)
+
+class Metrics:
+
+    # a registry of counters, gauges and histograms. updating a metric is just an
+    # attribute increment, everything else (rates, quantiles) is computed lazily
+    def __init__(self):
+        self.counters   = {}
+        self.gauges     = {}
+        self.histograms = {}
+
+        # cumulative snapshots received from other processes, and per group
+        # the summed final counters and histograms of the retired ones
+        self.remote  = {}
+        self.retired = {}
+
+        self._lock       = threading.Lock()
+        self._last_time  = time.perf_counter()
+        self._last_count = {}
+        self._last_hist  = {}
+
+    def counter(self, name: str) -> Counter:
+        c = self.counters.get(name)
+        if c is None:
+            with self._lock:
+                c = self.counters.setdefault(name, Counter())
+        return c
+
+    def gauge(self, name: str) -> Gauge:
+        g = self.gauges.get(name)
+        if g is None:
+            with self._lock:
+                g = self.gauges.setdefault(name, Gauge())
+        return g
+
+    def histogram(self, name: str, bounds = TIME_BUCKETS) -> Histogram:
+        h = self.histograms.get(name)
+        if h is None:
+            with self._lock:
+                h = self.histograms.setdefault(name, Histogram(bounds))
+        return h
+
+    def timer(self, name: str) -> Timer:
+        return Timer(self.histogram(name))
+
+    # plain picklable copy of all local metrics, sent by worker processes
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters":   {n: c.value for n, c in self.counters.items()},
+                "gauges":     {n: g.value for n, g in self.gauges.items()},
+                "histograms": {n: (h.bounds, list(h.counts), h.sum) for n, h in self.histograms.items()}
+            }
+
+    # store the latest snapshot of another process. its metrics are exposed both
+    # under the source's own prefix and summed up under the group prefix
+    def absorb(self, source: str, snapshot: dict, group: str = "workers"):
+        with self._lock:
+            self.remote[source] = (group, snapshot)
+
+    # a source that won't report again. its final counters and histograms are
+    # folded into the group's retired totals, so the group sums never go
+    # backwards, and its own entries are dropped - a long run that restarts
+    # its workers doesn't grow every record by a worker's worth of fields
+    def retire(self, source: str):
+        with self._lock:
+            entry = self.remote.pop(source, None)
+            if entry is None:
+                return
+
+            group, rs = entry
+            agg = self.retired.setdefault(group, {"counters": {}, "histograms": {}})
+
+            for n, v in rs["counters"].items():
+                agg["counters"][n] = agg["counters"].get(n, 0) + v
+
+            for n, (bounds, counts, total) in rs["histograms"].items():
+                _merge_hist(agg["histograms"], n, bounds, counts, total)
+
+    def _collect(self):
+        snap       = self.snapshot()
+        counters   = dict(snap["counters"])
+        gauges     = dict(snap["gauges"])
+        histograms = dict(snap["histograms"])
+
+        with self._lock:
+            remote  = list(self.remote.items())
+            retired = [(group, dict(agg["counters"]), dict(agg["histograms"])) for group, agg in self.retired.items()]
+
+        for source, (group, rs) in remote:
+            for n, v in rs["counters"].items():
+                counters[f"{source}_{n}"] = v
+                counters[f"{group}_{n}"]  = counters.get(f"{group}_{n}", 0) + v
+
+            for n, v in rs["gauges"].items():
+                gauges[f"{source}_{n}"] = v
+
+            for n, (bounds, counts, total) in rs["histograms"].items():
+                histograms[f"{source}_{n}"] = (bounds, counts, total)
+                _merge_hist(histograms, f"{group}_{n}", bounds, counts, total)
+
+        for group, r_counters, r_histograms in retired:
+            for n, v in r_counters.items():
+                counters[f"{group}_retired_{n}"] = v
+                counters[f"{group}_{n}"]         = counters.get(f"{group}_{n}", 0) + v
+
+            for n, (bounds, counts, total) in r_histograms.items():
+                _merge_hist(histograms, f"{group}_{n}", bounds, counts, total)
+
+        return counters, gauges, histograms
+
+    # the local metrics together with everything absorbed, in the format of snapshot()
+    def merged(self) -> dict:
+        counters, gauges, histograms = self._collect()
+        return {"counters": counters, "gauges": gauges, "histograms": histograms}
+
+    # summary of the interval since the previous report: counter totals and
+    # rates, current gauge values and per-interval histogram mean/p50/p90
+    def report(self) -> dict:
+        now = time.perf_counter()
+        dt  = max(1e-9, now - self._last_time)
+
+        counters, gauges, histograms = self._collect()
+        out = {}
+
+        for n, v in sorted(counters.items()):
+            out[n] = v
+            out[f"{n}_per_sec"] = round((v - self._last_count.get(n, 0)) / dt, 3)
+
+        for n, v in sorted(gauges.items()):
+            out[n] = v
+
+        for n, (bounds, counts, total) in sorted(histograms.items()):
+            prev_counts, prev_total = self._last_hist.get(n, ([0] * len(counts), 0.0))
+
+            d_counts = [a - b for a, b in zip(counts, prev_counts)]
+            d_num    = sum(d_counts)
+
+            if d_num > 0:
+                out[f"{n}_mean"] = round((total - prev_total) / d_num, 6)
+                out[f"{n}_p50"]  = round(Histogram.quantile(bounds, d_counts, 0.5), 6)
+                out[f"{n}_p90"]  = round(Histogram.quantile(bounds, d_counts, 0.9), 6)
+
+        self._last_time  = now
+        self._last_count = counters
+        self._last_hist  = {n: (counts, total) for n, (_, counts, total) in histograms.items()}
+        return out
+
+    # prometheus text exposition format
+    def prometheus(self, prefix: str = "kreveta") -> str:
+        counters, gauges, histograms = self._collect()
+        lines = []
+
+        for n, v in sorted(counters.items()):
+            lines.append(f"# TYPE {prefix}_{n} counter")
+            lines.append(f"{prefix}_{n} {v}")
+
+        for n, v in sorted(gauges.items()):
+            lines.append(f"# TYPE {prefix}_{n} gauge")
+            lines.append(f"{prefix}_{n} {v}")
+
+        for n, (bounds, counts, total) in sorted(histograms.items()):
+            lines.append(f"# TYPE {prefix}_{n} histogram")
+
+            cumulative = 0
+            for bound, c in zip(bounds, counts):
+                cumulative += c
+                lines.append(f'{prefix}_{n}_bucket{{le="{bound}"}} {cumulative}')
+
+            cumulative += counts[-1]
+            lines.append(f'{prefix}_{n}_bucket{{le="+Inf"}} {cumulative}')
+            lines.append(f"{prefix}_{n}_sum {total}")
+            lines.append(f"{prefix}_{n}_count {cumulative}")
+
+        return "\n".join(lines) + "\n"
+
+class MetricsLog:
+
+    # buffered, append-only metrics file. .jsonl files get one object per record,
+    # anything else is written as long-format csv (timestamp,kind,samples,name,value)
+    def __init__(self, path: str, flush_records: int = 64, flush_sec: float = 10.0):
+        self.path          = path
+        self.jsonl         = path.endswith(".jsonl")
+        self.flush_records = flush_records
+        self.flush_sec     = flush_sec
+
+        self._buffer     = []
+        self._records    = 0
+        self._last_flush = time.time()
+        self._lock       = threading.Lock()
+
+        if not self.jsonl and not os.path.exists(path):
+            with open(path, "w") as f:
+                f.write("timestamp,kind,samples,name,value\n")
+
+    def record(self, kind: str, seen: int, **fields):
+        timestamp = datetime.now().isoformat()
+
+        if self.jsonl:
+            lines = [json.dumps({"timestamp": timestamp, "kind": kind, "samples": seen, **fields}) + "\n"]
+        else:
+            lines = [f"{timestamp},{kind},{seen},{n},{v}\n" for n, v in fields.items()]
+
+        with self._lock:
+            self._buffer.extend(lines)
+            self._records += 1
+
+            if self._records >= self.flush_records or time.time() - self._last_flush >= self.flush_sec:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._buffer:
+            with open(self.path, "a") as f:
+                f.writelines(self._buffer)
+
+        self._buffer.clear()
+        self._records    = 0
+        self._last_flush = time.time()
+
+class MetricsServer:
+
+    # tiny local scrape endpoint: /metrics (prometheus text) and /metrics.json
+    def __init__(self, metrics: Metrics, port: int, host: str = "127.0.0.1"):
+        registry = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body  = registry.prometheus().encode()
+                    ctype = "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body  = json.dumps(registry.merged()).encode()
+                    ctype = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # keep the training output clean
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target = self.server.serve_forever, name = "metrics-http", daemon = True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,111 @@
+#
+# Kreveta chess engine by ZlomenyMesic
+# started 4-3-2025
+#
+
+# a fake uci engine for benchmarking the data pipeline without stockfish.
+# every search just waits for the configured time and answers with a random
+# legal move and a synthetic score (material balance plus noise, both
+# deterministic for a given position). run it in place of a real engine:
+#
+#   python mockengine.py --delay 2 --per-depth 0.5
+
+import sys
+import time
+import random
+import argparse
+
+import chess
+import chess.polyglot
+
+VALUES = {chess.PAWN: 100, chess.KNIGHT: 300, chess.BISHOP: 310, chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 0}
+
+def material(board: chess.Board) -> int:
+    score = 0
+    for piece in board.piece_map().values():
+        score += VALUES[piece.piece_type] if piece.color == board.turn else -VALUES[piece.piece_type]
+    return score
+
+def parse_position(tokens):
+    if tokens and tokens[0] == "startpos":
+        board, rest = chess.Board(), tokens[1:]
+    elif tokens and tokens[0] == "fen":
+        end   = tokens.index("moves") if "moves" in tokens else len(tokens)
+        board = chess.Board(" ".join(tokens[1:end]))
+        rest  = tokens[end:]
+    else:
+        return chess.Board()
+
+    if rest and rest[0] == "moves":
+        for uci in rest[1:]:
+            board.push_uci(uci)
+    return board
+
+# depth limit of a go command, a fixed default for everything else
+def go_depth(tokens, default: int = 8) -> int:
+    if "depth" in tokens:
+        return int(tokens[tokens.index("depth") + 1])
+    return default
+
+def main():
+    parser = argparse.ArgumentParser(description = "fake uci engine with synthetic scores")
+    parser.add_argument("--delay",     type = float, default = 0.0, help = "milliseconds per search")
+    parser.add_argument("--per-depth", type = float, default = 0.0, help = "additional milliseconds per depth")
+    parser.add_argument("--noise",     type = float, default = 30.0, help = "score noise (centipawns, std dev)")
+    args = parser.parse_args()
+
+    delay = args.delay
+    board = chess.Board()
+    out   = sys.stdout
+
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+        cmd = tokens[0]
+
+        if cmd == "uci":
+            out.write("id name MockEngine\nid author Kreveta\n")
+            out.write("option name Hash type spin default 16 min 1 max 65536\n")
+            out.write("option name Threads type spin default 1 min 1 max 1\n")
+            out.write("option name Delay type spin default 0 min 0 max 100000\n")
+            out.write("uciok\n")
+
+        elif cmd == "isready":
+            out.write("readyok\n")
+
+        elif cmd == "setoption" and len(tokens) >= 5 and tokens[2].lower() == "delay":
+            delay = float(tokens[4])
+
+        elif cmd == "position":
+            board = parse_position(tokens[1:])
+
+        elif cmd == "go":
+            depth = go_depth(tokens)
+            wait  = (delay + args.per_depth * depth) / 1000.0
+            start = time.perf_counter()
+
+            rng   = random.Random(chess.polyglot.zobrist_hash(board))
+            moves = list(board.legal_moves)
+            score = material(board) + int(rng.gauss(0, args.noise))
+
+            if wait > 0:
+                time.sleep(max(0.0, wait - (time.perf_counter() - start)))
+
+            elapsed = int((time.perf_counter() - start) * 1000)
+            if moves:
+                move = rng.choice(moves).uci()
+                out.write(f"info depth {depth} seldepth {depth} nodes {depth * 1000} time {elapsed} score cp {score} pv {move}\n")
+                out.write(f"bestmove {move}\n")
+            else:
+                out.write(f"info depth 0 score {'mate 0' if board.is_check() else 'cp 0'}\n")
+                out.write("bestmove 0000\n")
+
+        elif cmd == "quit":
+            break
+
+        # ucinewgame, stop, ponderhit, ... need no answer - a search is never running
+        out.flush()
+
+if __name__ == "__main__":
+    main()
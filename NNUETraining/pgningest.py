@@ -0,0 +1,192 @@
+#
+# Kreveta chess engine by ZlomenyMesic
+# started 4-3-2025
+#
+
+# turns (possibly huge) pgn files into training data. the files are cut into
+# byte ranges and every range is parsed by its own process - a game belongs to
+# the range its [Event tag starts in, so the ranges split at game boundaries
+# and only a single game is ever held in memory. sampled positions are written
+# as they come, either as text (fen;cp, or just the fen when the game carries no
+# [%eval] comments - those lines are meant for labeller.py) or as a game file
+
+import io
+import os
+import glob
+import time
+import random
+import argparse
+import multiprocessing as mp
+
+import numpy as np
+import chess
+import chess.pgn
+
+import filters
+import gameformat
+from dataclean import byte_ranges
+
+CHUNK_BYTES = 64 * 2**20
+EVENT_TAG   = b"[Event "
+
+# raw text of every game that starts inside [start, end)
+def read_games(path: str, start: int, end: int):
+    with open(path, "rb") as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+
+        lines = None
+        while True:
+            pos  = f.tell()
+            line = f.readline()
+
+            if not line or line.startswith(EVENT_TAG):
+                if lines:
+                    yield b"".join(lines).decode("utf-8", errors = "replace")
+                if not line or pos >= end:
+                    return
+                lines = [line]
+
+            elif lines is not None:
+                lines.append(line)
+
+def elo(headers, tag: str) -> int:
+    try:
+        return int(headers.get(tag, 0))
+    except ValueError:
+        return 0
+
+# the positions of one game that pass the sampling rules,
+# as (ply, fen, cp or None) with cp relative to the side to move
+def sample_game(game, opts: dict, rng: random.Random):
+    board      = game.board()
+    candidates = []
+
+    for ply, node in enumerate(game.mainline(), 1):
+        board.push(node.move)
+
+        if ply < opts["skip_plies"] or board.is_game_over():
+            continue
+
+        pov = node.eval()
+        cp  = None
+        if pov is not None:
+            cp = float(np.clip(pov.pov(board.turn).score(mate_score = 1800), -1800, 1800))
+        elif opts["require_eval"]:
+            continue
+
+        if opts["quiet"] and filters.classify(board) is not None:
+            continue
+
+        candidates.append((ply, board.fen(), cp))
+
+    if opts["per_game"] and len(candidates) > opts["per_game"]:
+        candidates = sorted(rng.sample(candidates, opts["per_game"]))
+
+    return candidates
+
+def ingest_range(job):
+    range_id, path, start, end, opts = job
+
+    rng   = random.Random(opts["seed"] * 100003 + range_id)
+    stats = {"games": 0, "skipped": 0, "errors": 0, "positions": 0, "labelled": 0}
+
+    name = os.path.join(opts["out"], f"pgn_{range_id:05d}")
+    if opts["format"] == "krg":
+        out = gameformat.GameWriter(name + gameformat.EXTENSION, compress = opts["compress"])
+    else:
+        out = open(name + ".txt", "w")
+
+    try:
+        for text in read_games(path, start, end):
+            game = chess.pgn.read_game(io.StringIO(text))
+            if game is None or game.errors:
+                stats["errors"] += 1
+                continue
+
+            headers = game.headers
+            if min(elo(headers, "WhiteElo"), elo(headers, "BlackElo")) < opts["min_elo"] \
+                or headers.get("Variant", "Standard") != "Standard":
+                stats["skipped"] += 1
+                continue
+
+            stats["games"] += 1
+            sampled = sample_game(game, opts, rng)
+
+            stats["positions"] += len(sampled)
+            stats["labelled"]  += sum(cp is not None for _, _, cp in sampled)
+
+            if opts["format"] == "krg":
+                # the whole game is stored, only the sampled plies carry a score
+                scores = {ply: cp for ply, _, cp in sampled if cp is not None}
+                out.begin(game.board())
+                for ply, move in enumerate(game.mainline_moves(), 1):
+                    out.add(move, scores.get(ply))
+                out.end(headers.get("Result"))
+            else:
+                out.writelines(f"{fen};{cp:g}\n" if cp is not None else f"{fen}\n" for _, fen, cp in sampled)
+    finally:
+        out.close()
+
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description = "sample training positions from pgn files")
+    parser.add_argument("inputs", nargs = "+", help = "pgn files or glob patterns")
+    parser.add_argument("--out",          required = True, help = "output directory")
+    parser.add_argument("--format",       choices = ("txt", "krg"), default = "txt")
+    parser.add_argument("--compress",     action = "store_true", help = "zstd-compress krg output")
+    parser.add_argument("--workers",      type = int,   default = os.cpu_count())
+    parser.add_argument("--chunk-mb",     type = float, default = CHUNK_BYTES / 2**20)
+    parser.add_argument("--skip-plies",   type = int,   default = 16, help = "don't sample the first plies of a game")
+    parser.add_argument("--per-game",     type = int,   default = 8,  help = "positions sampled per game, 0 = all")
+    parser.add_argument("--min-elo",      type = int,   default = 0,  help = "both players must be rated at least this")
+    parser.add_argument("--require-eval", action = "store_true", help = "only sample positions with an [%%eval] comment")
+    parser.add_argument("--quiet",        action = "store_true", help = "only sample quiet positions")
+    parser.add_argument("--seed",         type = int,   default = 1)
+    args = parser.parse_args()
+
+    paths = sorted({p for pattern in args.inputs for p in glob.glob(pattern)})
+    if not paths:
+        parser.error("no input files")
+
+    os.makedirs(args.out, exist_ok = True)
+
+    opts = {
+        "out":          args.out,
+        "format":       args.format,
+        "compress":     args.compress,
+        "skip_plies":   args.skip_plies,
+        "per_game":     args.per_game,
+        "min_elo":      args.min_elo,
+        # a game file can only store labelled positions
+        "require_eval": args.require_eval or args.format == "krg",
+        "quiet":        args.quiet,
+        "seed":         args.seed
+    }
+
+    ranges = byte_ranges(paths, max(1, int(args.chunk_mb * 2**20)))
+    total  = sum(os.path.getsize(p) for p in paths)
+    print(f"{len(paths)} files, {total / 2**20:.1f} MiB, {len(ranges)} ranges, {args.workers} workers")
+
+    stats = {}
+    start = time.perf_counter()
+
+    with mp.get_context("spawn").Pool(args.workers) as pool:
+        jobs = [(*r, opts) for r in ranges]
+        for i, s in enumerate(pool.imap_unordered(ingest_range, jobs), 1):
+            for k, v in s.items():
+                stats[k] = stats.get(k, 0) + v
+
+            elapsed = time.perf_counter() - start
+            print(f"ranges {i}/{len(ranges)}, games: {stats['games']}, positions: {stats['positions']}, "
+                + f"games/s: {stats['games'] / elapsed:.0f}, positions/s: {stats['positions'] / elapsed:.0f}")
+
+    elapsed = time.perf_counter() - start
+    print(f"\n{stats['games']} games ({stats['skipped']} skipped, {stats['errors']} unparsable) in {elapsed:.1f}s, "
+        + f"{total / 2**20 / elapsed:.1f} MiB/s")
+    print(f"{stats['positions']} positions sampled, {stats['labelled']} with a score")
+
+if __name__ == "__main__":
+    main()
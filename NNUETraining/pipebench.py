@@ -0,0 +1,160 @@
+#
+# Kreveta chess engine by ZlomenyMesic
+# started 4-3-2025
+#
+
+# benchmarks the self-play pipeline with the fake engine from mockengine.py in
+# place of stockfish. the workers time their engine calls, so the time spent
+# in the (mock) engine is subtracted, which leaves the upper bound of what the
+# rest of the pipeline - move bookkeeping, filtering, featurization, queueing
+# and training - could sustain with an infinitely fast engine
+
+import os
+import sys
+import time
+import queue
+import argparse
+import multiprocessing as mp
+
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
+
+import numpy as np
+import tensorflow as tf
+
+import train
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def hist_sum(snapshot: dict, name: str) -> float:
+    h = snapshot["histograms"].get(name)
+    return h[2] if h is not None else 0.0
+
+def generate(workers: int, seconds: float, engine_cmd, keep: int):
+    ctx         = mp.get_context("spawn")
+    samples     = ctx.Queue(maxsize = train.SAMPLES_QUEUE_MAX)
+    stats_queue = ctx.Queue()
+    stop_event  = ctx.Event()
+
+    procs = [ctx.Process(target = train.engine_worker, args = (i, samples, stop_event, stats_queue, None, engine_cmd), daemon = True)
+             for i in range(workers)]
+    for p in procs:
+        p.start()
+
+    kept      = []
+    snapshots = {}
+    received  = 0
+    start     = None
+
+    # the clock starts with the first sample, process and engine start-up are excluded
+    while start is None or time.perf_counter() - start < seconds:
+        try:
+            sample = samples.get(timeout = 1.0)
+        except queue.Empty:
+            continue
+
+        if start is None:
+            start = time.perf_counter()
+
+        received += 1
+        if len(kept) < keep:
+            kept.append(sample)
+
+    elapsed = time.perf_counter() - start
+    stop_event.set()
+
+    # keep draining, so that no worker blocks on a full queue while stopping
+    while any(p.is_alive() for p in procs):
+        try:
+            samples.get(timeout = 0.1)
+        except queue.Empty:
+            pass
+        while not stats_queue.empty():
+            worker_id, snap = stats_queue.get()
+            snapshots[worker_id] = snap
+
+    while not stats_queue.empty():
+        worker_id, snap = stats_queue.get()
+        snapshots[worker_id] = snap
+
+    return received / elapsed, snapshots, kept
+
+def train_speed(kept, batches: int):
+    model = train.build_model()
+    rng   = np.random.default_rng(1)
+
+    assembly = step = 0.0
+    for i in range(batches + 1):
+        idx     = rng.integers(0, len(kept), train.BATCH_SIZE)
+        x_batch = [kept[j][0] for j in idx]
+        y_batch = [kept[j][1] for j in idx]
+
+        t0 = time.perf_counter()
+        active  = [pair[0] for pair in x_batch]
+        passive = [pair[1] for pair in x_batch]
+
+        x_active  = tf.ragged.constant(active,  dtype = tf.int32)
+        x_passive = tf.ragged.constant(passive, dtype = tf.int32)
+        x_pcnts   = np.array([len(a) + 2 for a in active], dtype = np.int32)
+        y_np      = np.array(y_batch, dtype = np.float32).reshape(-1, 1)
+
+        t1 = time.perf_counter()
+        model.train_on_batch([x_active, x_passive, x_pcnts], y_np)
+        t2 = time.perf_counter()
+
+        # the first batch traces the graph
+        if i > 0:
+            assembly += t1 - t0
+            step     += t2 - t1
+
+    n = batches * train.BATCH_SIZE
+    return assembly / n, step / n
+
+def main():
+    parser = argparse.ArgumentParser(description = "self-play pipeline benchmark with a mock engine")
+    parser.add_argument("--workers",    type = int,   default = 2)
+    parser.add_argument("--seconds",    type = float, default = 30.0)
+    parser.add_argument("--delay",      type = float, default = 0.0, help = "mock engine milliseconds per search")
+    parser.add_argument("--batches",    type = int,   default = 10,  help = "training batches to time, 0 skips training")
+    args = parser.parse_args()
+
+    engine_cmd = [sys.executable, os.path.join(SCRIPT_DIR, "mockengine.py"), "--delay", str(args.delay)]
+
+    print(f"generating with {args.workers} workers for {args.seconds:.0f}s (mock engine, {args.delay} ms per search)...")
+    rate, snapshots, kept = generate(args.workers, args.seconds, engine_cmd, train.BATCH_SIZE * 4)
+
+    total = {"samples": 0, "uptime": 0.0, "engine": 0.0, "featurize": 0.0, "filter": 0.0, "put": 0.0}
+    bound = 0.0
+
+    for snap in snapshots.values():
+        samples = snap["counters"].get("samples", 0)
+        uptime  = snap["gauges"].get("uptime_seconds", 0.0)
+        engine  = hist_sum(snap, "play_seconds") + hist_sum(snap, "analyse_seconds")
+
+        total["samples"]   += samples
+        total["uptime"]    += uptime
+        total["engine"]    += engine
+        total["featurize"] += hist_sum(snap, "featurize_seconds")
+        total["filter"]    += hist_sum(snap, "filter_seconds")
+        total["put"]       += hist_sum(snap, "put_seconds")
+
+        # every worker runs on its own core, so the bounds add up
+        if uptime > engine and samples:
+            bound += samples / (uptime - engine)
+
+    per_sample = {k: 1e6 * v / max(1, total["samples"]) for k, v in total.items() if k not in ("samples",)}
+    other      = per_sample["uptime"] - per_sample["engine"] - per_sample["featurize"] - per_sample["filter"] - per_sample["put"]
+
+    print(f"\ngeneration:  {rate:.0f} samples/s measured, {100 * total['engine'] / max(1e-9, total['uptime']):.1f}% of worker time in the engine")
+    print(f"  per sample: engine {per_sample['engine']:.0f} us, featurize {per_sample['featurize']:.0f} us, "
+        + f"filter {per_sample['filter']:.0f} us, queue put {per_sample['put']:.0f} us, other {other:.0f} us")
+    print(f"  upper bound without the engine: {bound:.0f} samples/s ({bound / max(1, len(snapshots)):.0f} per worker)")
+
+    if args.batches > 0 and kept:
+        assembly, step = train_speed(kept, args.batches)
+        trainer        = 1.0 / (assembly + step)
+
+        print(f"\ntraining:    {trainer:.0f} samples/s (assembly {assembly * 1e6:.1f} us, step {step * 1e6:.1f} us per sample)")
+        print(f"\npipeline upper bound: {min(bound, trainer):.0f} samples/s, limited by {'generation' if bound < trainer else 'training'}")
+
+if __name__ == "__main__":
+    main()
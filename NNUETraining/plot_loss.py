@@ -3,25 +3,201 @@
 # started 4-3-2025
 #
 
-import pandas as pd
+import os
+import json
+import argparse
+
 import matplotlib.pyplot as plt
 
-LOGFILE = "log.csv"
-
-df = pd.read_csv(LOGFILE)
-
-plt.figure(figsize=(10,5))
-plt.plot(df["samples"], df["loss"])
-plt.xlabel("samples seen")
-plt.ylabel("loss")
-plt.title("Training Loss Curve")
-plt.grid(True)
-plt.savefig("loss_curve.png", dpi=200)
-
-plt.figure(figsize=(10,5))
-plt.plot(df["samples"], df["mae"])
-plt.xlabel("samples seen")
-plt.ylabel("MAE")
-plt.title("Mean Absolute Error Curve")
-plt.grid(True)
-plt.savefig("mae_curve.png", dpi=200)
\ No newline at end of file
+LOGFILE     = "metrics.jsonl"
+MAX_BUCKETS = 1000
+REFRESH_SEC = 5.0
+CHUNK_BYTES = 8 << 20
+
+# (panel, record kind, field, label)
+SERIES = [
+    ("loss",       "train",   "loss",                      "train"),
+    ("loss",       "holdout", "loss",                      "holdout"),
+    ("mae",        "train",   "mae",                       "train"),
+    ("mae",        "holdout", "mae",                       "holdout"),
+    ("throughput", "train",   "samples_per_sec",           "trained samples/s"),
+    ("throughput", "train",   "workers_positions_per_sec", "generated positions/s"),
+    ("lr",         "train",   "lr",                        "learning rate"),
+]
+
+PANELS = {
+    "loss":       ("loss",           "Training Loss Curve"),
+    "mae":        ("MAE",            "Mean Absolute Error Curve"),
+    "throughput": ("per second",     "Throughput"),
+    "lr":         ("learning rate",  "Learning Rate"),
+}
+
+class LogTail:
+
+    # reads only the bytes appended since the previous call, in chunks of at
+    # most CHUNK_BYTES so that a long log never has to fit into memory. a
+    # trailing line without a newline is kept back until it has been completed
+    def __init__(self, path: str):
+        self.path   = path
+        self.offset = 0
+        self.rest   = b""
+        self.jsonl  = path.endswith(".jsonl")
+
+    def read(self):
+        if not os.path.exists(self.path):
+            return
+
+        # the file was truncated or replaced, start over
+        if os.path.getsize(self.path) < self.offset:
+            self.offset = 0
+            self.rest   = b""
+
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+
+            while True:
+                data = f.read(CHUNK_BYTES)
+                if not data:
+                    break
+                self.offset = f.tell()
+
+                lines     = (self.rest + data).split(b"\n")
+                self.rest = lines.pop()
+                yield from self.parse(lines)
+
+    def parse(self, lines):
+        for line in lines:
+            if not line.strip():
+                continue
+
+            try:
+                if self.jsonl:
+                    rec = json.loads(line)
+                    yield rec["kind"], rec["samples"], rec
+                else:
+                    # long-format csv: timestamp,kind,samples,name,value
+                    _, kind, seen, name, value = line.decode().split(",")
+                    yield kind, int(seen), {name: float(value)}
+            except (ValueError, KeyError):
+                continue
+
+class MinMaxDecimator:
+
+    # fixed-size summary of an arbitrarily long series. every bucket covers
+    # 'width' consecutive points and keeps only the minimum and the maximum,
+    # so spikes survive. when the buckets run out, neighbours are merged
+    # and the width doubles - the memory and plotting cost stay constant
+    def __init__(self, max_buckets: int = MAX_BUCKETS):
+        self.max_buckets = max_buckets - max_buckets % 2
+        self.width       = 1
+        self.buckets     = []  # [x_lo, y_lo, x_hi, y_hi, count]
+
+    def add(self, x, y):
+        if self.buckets and self.buckets[-1][4] < self.width:
+            b = self.buckets[-1]
+            if y < b[1]:
+                b[0], b[1] = x, y
+            if y > b[3]:
+                b[2], b[3] = x, y
+            b[4] += 1
+            return
+
+        if len(self.buckets) >= self.max_buckets:
+            self.compact()
+        self.buckets.append([x, y, x, y, 1])
+
+    def compact(self):
+        merged = []
+        for a, b in zip(self.buckets[0::2], self.buckets[1::2]):
+            lo = a[:2] if a[1] <= b[1] else b[:2]
+            hi = a[2:4] if a[3] >= b[3] else b[2:4]
+            merged.append([*lo, *hi, a[4] + b[4]])
+
+        self.buckets = merged
+        self.width  *= 2
+
+    def points(self):
+        xs, ys = [], []
+        for x_lo, y_lo, x_hi, y_hi, _ in self.buckets:
+            # keep the two extremes in x order
+            if x_lo <= x_hi:
+                xs += [x_lo, x_hi]
+                ys += [y_lo, y_hi]
+            else:
+                xs += [x_hi, x_lo]
+                ys += [y_hi, y_lo]
+        return xs, ys
+
+class Dashboard:
+    def __init__(self, path: str, max_buckets: int):
+        self.tail   = LogTail(path)
+        self.series = {(kind, field): MinMaxDecimator(max_buckets) for _, kind, field, _ in SERIES}
+
+        self.fig, axes = plt.subplots(2, 2, figsize = (14, 8))
+        self.axes      = dict(zip(PANELS, axes.ravel()))
+        self.lines     = {}
+
+        for panel, (ylabel, title) in PANELS.items():
+            ax = self.axes[panel]
+            ax.set_xlabel("samples seen")
+            ax.set_ylabel(ylabel)
+            ax.set_title(title)
+            ax.grid(True)
+
+        for panel, kind, field, label in SERIES:
+            (line,) = self.axes[panel].plot([], [], label = label, linewidth = 0.8)
+            self.lines[(kind, field)] = line
+
+        for ax in self.axes.values():
+            ax.legend(loc = "upper right")
+
+        self.fig.tight_layout()
+
+    def update(self):
+        for kind, seen, rec in self.tail.read():
+            for field, value in rec.items():
+                dec = self.series.get((kind, field))
+                if dec is not None and isinstance(value, (int, float)):
+                    dec.add(seen, value)
+
+        for key, line in self.lines.items():
+            line.set_data(*self.series[key].points())
+
+        for ax in self.axes.values():
+            ax.relim()
+            ax.autoscale_view()
+
+    def save(self):
+        self.fig.savefig("training_curves.png", dpi = 200)
+
+        # the individual curves, as the previous version of this script produced
+        for panel, name in (("loss", "loss_curve.png"), ("mae", "mae_curve.png")):
+            extent = self.axes[panel].get_tightbbox(self.fig.canvas.get_renderer())
+            self.fig.savefig(name, dpi = 200, bbox_inches = extent.transformed(self.fig.dpi_scale_trans.inverted()))
+
+def main():
+    parser = argparse.ArgumentParser(description = "plot the training metrics stream")
+    parser.add_argument("log", nargs = "?", default = LOGFILE)
+    parser.add_argument("--once",    action = "store_true",  help = "render PNGs once and exit")
+    parser.add_argument("--buckets", type = int,   default = MAX_BUCKETS, help = "points kept per series")
+    parser.add_argument("--refresh", type = float, default = REFRESH_SEC, help = "seconds between updates")
+    args = parser.parse_args()
+
+    dash = Dashboard(args.log, args.buckets)
+    dash.update()
+
+    if args.once:
+        dash.save()
+        return
+
+    # live view - only the newly appended part of the log is parsed on each refresh
+    plt.ion()
+    plt.show()
+
+    while plt.fignum_exists(dash.fig.number):
+        plt.pause(args.refresh)
+        dash.update()
+        dash.fig.canvas.draw_idle()
+
+if __name__ == "__main__":
+    main()
@@ -4,29 +4,44 @@
 #
 
 import os
-import struct
+import json
+
+import numpy as np
+
+import features
 
 NN_NAME = "nnue-128-16-16-v4-lc0_v3.bin"
 
 SCRIPT_DIR   = os.path.dirname(os.path.abspath(__file__))
 WEIGHTS_PATH = os.path.join(SCRIPT_DIR, "weights\\nnue_weights.bin")
+SHAPES_PATH  = os.path.join(SCRIPT_DIR, "weights\\nnue_shapes.json")
+LAYOUT_PATH  = os.path.join(SCRIPT_DIR, "weights\\nnue_features.json")
 OUTPUT_PATH  = os.path.join(SCRIPT_DIR, f"archive\\{NN_NAME}")
 
 SCALE = 1024
 
-with open(WEIGHTS_PATH, "rb") as f:
-    data = f.read()
+flat = np.fromfile(WEIGHTS_PATH, dtype = np.float32)
 
-floats = struct.iter_unpack("f", data)
+with open(SHAPES_PATH, "r") as f:
+    shapes = json.load(f)
 
-with open(OUTPUT_PATH, "wb") as f:
-    for (x,) in floats:
-        # quantize with the scale
-        q = round(x * SCALE)
+# split the flat array back into the individual tensors
+weights = []
+idx     = 0
+for shape in shapes:
+    size = int(np.prod(shape))
+    weights.append(flat[idx:idx + size].reshape(shape))
+    idx += size
 
-        # clamp to int16 range
-        q = max(-32768, min(32767, int(q)))
+# the engine always uses the full 64 x 640 layout. a compacted embedding gets
+# its unreachable rows re-inserted (as zeros), king buckets are expanded back
+# to individual squares and a factor table is folded in and dropped
+weights = features.export_weights(weights, features.load_layout(LAYOUT_PATH))
 
-        f.write(struct.pack("h", q))
+with open(OUTPUT_PATH, "wb") as f:
+    for w in weights:
+        # quantize with the scale and clamp to int16 range
+        q = np.clip(np.round(w.ravel() * SCALE), -32768, 32767).astype(np.int16)
+        q.tofile(f)
 
 print("quantization complete :)")
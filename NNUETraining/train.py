@@ -9,6 +9,8 @@ import time
 from datetime import datetime
 import signal
 import random
+import queue
+import threading
 import multiprocessing as mp
 from multiprocessing import Queue
 
@@ -19,6 +21,14 @@ import keras
 import chess
 import chess.engine
 import chess.polyglot
+import chess.syzygy
+
+import features
+import filters
+import gameformat
+from features import FEATURE_COUNT, board_features
+from metrics import Metrics, MetricsLog, MetricsServer
+from ingest import IngestServer
 
 # only log warnings and errors
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
@@ -31,16 +41,43 @@ MODEL_DIR = os.path.join(SCRIPT_DIR, "nnue_model.keras")
 
 WEIGHTS_PATH = os.path.join(SCRIPT_DIR, "weights\\nnue_weights.bin")
 SHAPES_PATH  = os.path.join(SCRIPT_DIR, "weights\\nnue_shapes.json")
+LAYOUT_PATH  = os.path.join(SCRIPT_DIR, "weights\\nnue_features.json")
 CONFIG_PATH  = os.path.join(SCRIPT_DIR, "config.json")
 
+# fixed holdout set (fen;cp lines, cp relative to the side to move) and
+# its pre-featurized cache, which is rebuilt whenever the text changes
+HOLDOUT_PATH  = os.path.join(SCRIPT_DIR, "holdout.txt")
+HOLDOUT_CACHE = os.path.join(SCRIPT_DIR, "holdout.npz")
+
+# structured metrics stream (.jsonl or long-format .csv) and an optional
+# local http scrape endpoint (set METRICS_PORT to a port number to enable)
+METRICS_PATH  = "metrics.jsonl"
+METRICS_PORT  = None
+
+# remote generators (python ingest.py client ...) push their samples to this
+# port. the token is shared with the clients through KREVETA_INGEST_TOKEN on
+# both sides, set INGEST_PORT to enable. the server only listens on localhost
+# unless INGEST_HOST is set explicitly (e.g. "0.0.0.0" for other machines) -
+# the token travels in plaintext, so only expose it on a trusted network or
+# through a tunnel
+INGEST_HOST  = "127.0.0.1"
+INGEST_PORT  = None
+INGEST_TOKEN = os.environ.get("KREVETA_INGEST_TOKEN", "")
+
+# when set, every worker also records its games into this directory in
+# the compact game format (see gameformat.py), optionally zstd-compressed
+GAMES_DIR      = None
+GAMES_COMPRESS = False
+
+# the supervisor starts NUM_WORKERS generators and then scales between
+# MIN_WORKERS and MAX_WORKERS, depending on how full the samples queue is
 NUM_WORKERS    = 10
+MIN_WORKERS    = 2
+MAX_WORKERS    = 16
 ENGINE_CMD     = "C:\\Users\\michn\\Downloads\\Stockfish.exe"
 GOOD_BOOK_PATH = "C:\\Users\\michn\\Downloads\\polyglot\\rodent.bin"
 BAD_BOOK_PATH  = "C:\\Users\\michn\\Downloads\\polyglot\\Human.bin"
 
-# total features (shared by accumulators)
-FEATURE_COUNT     = 40960
-
 EMBED_DIM         = 256
 H1_NEURONS        = 16
 H2_NEURONS        = 16
@@ -50,6 +87,37 @@ SAMPLES_QUEUE_MAX = 10000
 SAVE_EVERY_SEC    = 200
 MAX_PLIES         = 200
 
+# evaluate the holdout set every this many trained samples
+HOLDOUT_EVERY     = 262144
+HOLDOUT_BATCH     = 8192
+
+# how often the trainer writes a metrics record, and how
+# often the workers send their counters to the trainer
+METRICS_EVERY_SEC        = 10
+WORKER_METRICS_EVERY_SEC = 5
+STATS_QUEUE_MAX          = 1000
+
+# worker supervision. a queue that stays emptier than QUEUE_LOW_FILL means the
+# trainer is starving (add a worker), fuller than QUEUE_HIGH_FILL means samples
+# are produced faster than consumed (retire one). the fill level is smoothed
+# and the pool changes by at most one worker every SCALE_EVERY_SEC
+SUPERVISE_EVERY_SEC  = 1.0
+SCALE_EVERY_SEC      = 30
+QUEUE_LOW_FILL       = 0.25
+QUEUE_HIGH_FILL      = 0.90
+
+# dead workers are restarted after RESTART_BACKOFF_SEC, doubled for every
+# consecutive crash up to RESTART_BACKOFF_MAX. a worker that has been running
+# for WORKER_STABLE_SEC resets the backoff
+RESTART_BACKOFF_SEC  = 2.0
+RESTART_BACKOFF_MAX  = 120.0
+WORKER_STABLE_SEC    = 60.0
+
+# attempts to (re)start an engine inside a worker, and the number
+# of engine errors after which a game is abandoned
+ENGINE_START_RETRIES = 3
+MAX_GAME_ERRORS      = 2
+
 BUCKET_TABLE = tf.constant([
     0, 0, 0, 0, 0,
     0, 0, 1, 1,
@@ -66,7 +134,30 @@ CONFIG = {
     "book_moves":       16,
     "mirror_enabled":   False,
     "min_depth":        1,
-    "max_depth":        1
+    "max_depth":        1,
+
+    # adjudication - stop a game once the score history says it is decided.
+    # win: |cp| >= score (same side) for this many consecutive labelled plies
+    "adjudicate_win_score":    1000,
+    "adjudicate_win_plies":    8,
+
+    # draw: |cp| <= score for this many consecutive plies, after min_ply
+    "adjudicate_draw_score":   10,
+    "adjudicate_draw_plies":   20,
+    "adjudicate_draw_min_ply": 80,
+
+    # tablebase-style: stop at this many pieces (kings included), 0 disables.
+    # with a syzygy path, only positions the tablebase can resolve are adjudicated
+    "adjudicate_tb_pieces":    0,
+    "syzygy_path":             "",
+
+    # quiet-position filter - positions in check or with a capture whose SEE
+    # reaches the threshold aren't labelled. keep_freq is the fraction of them
+    # that gets labelled anyway, so tactical positions don't vanish entirely
+    "filter_in_check":         True,
+    "filter_captures":         True,
+    "filter_see_threshold":    1,
+    "filter_keep_freq":        0.0
 }
 
 def load_config():
@@ -79,90 +170,10 @@ def load_config():
     except Exception:
         print("loading config failed")
 
-def feature_index(king_square: int, piece_type: int, is_black: bool, piece_square: int) -> int:
-
-    # map piece_type 1..5 into 0..4
-    piece_type_idx = piece_type - 1
-    color_bit      = 1 if is_black else 0
-
-    king_offset  = king_square * 640
-    piece_offset = (piece_type_idx * 2 + color_bit) * 64 + piece_square
-
-    f = king_offset + piece_offset
-    
-    return int(f)
-
-def board_features(board: chess.Board):
-    w_indices = []
-    b_indices = []
-    m_w_indices = []
-    m_b_indices = []
-
-    w_king_sq = board.king(chess.WHITE)
-    b_king_sq = board.king(chess.BLACK)
-
-    # if a king is missing (shouldn't happen in legal positions), we still produce empty lists.
-    if w_king_sq is None or b_king_sq is None:
-        return []
-    
-    m_w_king_sq = w_king_sq ^ 7
-    m_b_king_sq = b_king_sq ^ 7
-
-    for sq in chess.SQUARES:
-        piece = board.piece_at(sq)
-
-        # empty square
-        if piece is None:
-            continue
-
-        # kings are excluded
-        if piece.piece_type == chess.KING:
-            continue
-
-        # piece_color True if black, False if white
-        is_black = piece.color == chess.BLACK
-
-        m_sq = sq ^ 7
-
-        # index into white accumulator (white king as reference)
-        idx_w = feature_index(
-            king_square  = w_king_sq,
-            piece_type   = piece.piece_type,
-            is_black     = is_black,
-            piece_square = sq
-        )
-        # index into black accumulator (black king as reference)
-        idx_b = feature_index(
-            king_square  = b_king_sq ^ 56,
-            piece_type   = piece.piece_type,
-            is_black     = not is_black,
-            piece_square = sq ^ 56
-        )
-
-        m_idx_w = feature_index(
-            king_square  = m_w_king_sq,
-            piece_type   = piece.piece_type,
-            is_black     = is_black,
-            piece_square = m_sq
-        )
-        m_idx_b = feature_index(
-            king_square  = m_b_king_sq ^ 56,
-            piece_type   = piece.piece_type,
-            is_black     = not is_black,
-            piece_square = m_sq ^ 56
-        )
-
-        w_indices.append(idx_w)
-        b_indices.append(idx_b)
-        m_w_indices.append(m_idx_w)
-        m_b_indices.append(m_idx_b)
-
-    return w_indices, b_indices, m_w_indices, m_b_indices
-
 def ClippedReLU(x):
     return keras.activations.relu(x, max_value = 1.0)
 
-def build_model() -> keras.Model:
+def build_model(feature_count: int = FEATURE_COUNT, factorize: bool = features.FACTORIZE) -> keras.Model:
     # two ragged int inputs (variable-length lists of feature indices)
     inp_active  = layers.Input(shape = (None,), ragged = True, dtype = 'int32', name = 'Input_Active')
     inp_passive = layers.Input(shape = (None,), ragged = True, dtype = 'int32', name = 'Input_Passive')
@@ -170,7 +181,7 @@ def build_model() -> keras.Model:
 
     # separate embedding tables (no shared weights)
     emb_shared = layers.Embedding(
-        input_dim  = FEATURE_COUNT,
+        input_dim  = feature_count,
         output_dim = EMBED_DIM,
         name       = 'Embedding_Shared'
     )
@@ -191,6 +202,14 @@ def build_model() -> keras.Model:
         name         = 'Accumulator_Passive'
     )(emb_passive)
 
+    # factorized training - the shared piece-square rows of all active features
+    # are added to the accumulators as well (folded into the main table on export)
+    if factorize:
+        factor_active, factor_passive = features.factor_accumulators(inp_active, inp_passive, EMBED_DIM)
+
+        summed_active  = layers.Add(name = 'Accumulator_Active_Factorized')([summed_active, factor_active])
+        summed_passive = layers.Add(name = 'Accumulator_Passive_Factorized')([summed_passive, factor_passive])
+
     # concatenate the two accumulators
     concat = layers.Concatenate(name = 'Accumulator_Concat')([summed_active, summed_passive])
 
@@ -247,7 +266,7 @@ def build_model() -> keras.Model:
     )
     return model
 
-def save_weights_binary(model, weights_path = WEIGHTS_PATH, shapes_path = SHAPES_PATH):
+def save_weights_binary(model, weights_path = WEIGHTS_PATH, shapes_path = SHAPES_PATH, layout_path = LAYOUT_PATH):
     weights = model.get_weights()
     shapes = [list(w.shape) for w in weights]
 
@@ -257,12 +276,14 @@ def save_weights_binary(model, weights_path = WEIGHTS_PATH, shapes_path = SHAPES
     # write the flat array
     flat.tofile(weights_path)
 
-    # write shapes
+    # write shapes, and the feature layout the embedding was trained with
     with open(shapes_path, "w") as f:
         json.dump(shapes, f)
+    features.save_layout(layout_path, features.factor_slot(model))
+
     return shapes, flat.size
 
-def load_weights_binary(model, weights_path = WEIGHTS_PATH, shapes_path = SHAPES_PATH):
+def load_weights_binary(model, weights_path = WEIGHTS_PATH, shapes_path = SHAPES_PATH, layout_path = LAYOUT_PATH):
     if not os.path.exists(weights_path) or not os.path.exists(shapes_path):
         return False
 
@@ -296,6 +317,9 @@ def load_weights_binary(model, weights_path = WEIGHTS_PATH, shapes_path = SHAPES
         weights.append(w)
         idx += size
 
+    # the weights may have been saved with a different feature layout
+    weights = features.import_weights(weights, features.load_layout(layout_path), features.factor_slot(model))
+
     try:
         model.set_weights(weights)
     except Exception as e:
@@ -304,15 +328,244 @@ def load_weights_binary(model, weights_path = WEIGHTS_PATH, shapes_path = SHAPES
 
     return True
 
-def engine_worker(worker_id: int, samples_queue: Queue, stop_event: mp.Event):
-    print(f"[worker {worker_id}] starting self-play; cmd = {ENGINE_CMD}")
+def load_holdout(text_path = HOLDOUT_PATH, cache_path = HOLDOUT_CACHE):
+    if not os.path.exists(text_path):
+        return None
+
+    # the cache is only valid if it is newer than the text file and was
+    # featurized with the current feature layout - the whole descriptor is
+    # compared, two layouts can have the same feature count
+    lay = json.dumps({**{k: features.layout()[k] for k in features.LEGACY_LAYOUT}, "feature_count": FEATURE_COUNT},
+                     sort_keys = True)
+
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(text_path):
+        with np.load(cache_path) as data:
+            if "layout" in data.files and str(data["layout"]) == lay:
+                return {k: data[k] for k in data.files}
+
+    active  = []
+    passive = []
+    targets = []
+
+    with open(text_path, "r", encoding = "utf-8") as f:
+        for line in f:
+            try:
+                fen, cp = line.strip().split(";")
+                board   = chess.Board(fen)
+                w, b, _, _ = board_features(board)
+            except Exception:
+                continue
+
+            cp = np.clip(float(cp), -1800, 1800)
+
+            if board.turn == chess.WHITE:
+                active.append(w)
+                passive.append(b)
+            else:
+                active.append(b)
+                passive.append(w)
+
+            targets.append(1.0 / (1.0 + np.exp(-cp / 400.0)))
+
+    if not targets:
+        return None
+
+    # store the ragged index lists flattened, together with their row lengths
+    holdout = {
+        "active":      np.array([i for a in active  for i in a], dtype = np.int32),
+        "active_len":  np.array([len(a) for a in active],        dtype = np.int32),
+        "passive":     np.array([i for p in passive for i in p], dtype = np.int32),
+        "passive_len": np.array([len(p) for p in passive],       dtype = np.int32),
+        "target":      np.array(targets,                         dtype = np.float32),
+
+        "feature_count": np.int32(FEATURE_COUNT),
+        "layout":        np.array(lay)
+    }
+
+    np.savez(cache_path, **holdout)
+    return holdout
+
+class HoldoutValidator(threading.Thread):
+
+    # evaluates weight snapshots on the holdout set in the background. the model
+    # is a separate copy, so the trainer only pays for model.get_weights()
+    def __init__(self, holdout, metrics_log: MetricsLog):
+        super().__init__(name = "holdout", daemon = True)
+
+        self.model       = build_model()
+        self.metrics_log = metrics_log
+        self.pending     = queue.Queue(maxsize = 1)
+        self.batches     = []
+
+        # split the holdout set into ready-made ragged batches once
+        a_off = np.concatenate([[0], np.cumsum(holdout["active_len"])])
+        p_off = np.concatenate([[0], np.cumsum(holdout["passive_len"])])
+        count = len(holdout["target"])
+
+        for start in range(0, count, HOLDOUT_BATCH):
+            end = min(count, start + HOLDOUT_BATCH)
+
+            x_active = tf.RaggedTensor.from_row_lengths(
+                holdout["active"][a_off[start]:a_off[end]], holdout["active_len"][start:end]
+            )
+            x_passive = tf.RaggedTensor.from_row_lengths(
+                holdout["passive"][p_off[start]:p_off[end]], holdout["passive_len"][start:end]
+            )
+            x_pcnts = holdout["active_len"][start:end] + 2
+
+            self.batches.append(([x_active, x_passive, x_pcnts], holdout["target"][start:end]))
+
+    # hand over a new snapshot. never blocks - if the previous snapshot
+    # hasn't been picked up yet, it is replaced by the newer one
+    def submit(self, weights, seen: int):
+        try:
+            self.pending.get_nowait()
+        except queue.Empty:
+            pass
+
+        try:
+            self.pending.put_nowait((weights, seen))
+        except queue.Full:
+            pass
+
+    def stop(self):
+        self.submit(None, -1)
+
+    def evaluate(self):
+        loss_sum = 0.0
+        mae_sum  = 0.0
+        count    = 0
+
+        for x, y in self.batches:
+            pred = self.model.predict_on_batch(x).reshape(-1)
+            pred = np.clip(pred, 1e-7, 1.0 - 1e-7)
+
+            loss_sum += float(-np.sum(y * np.log(pred) + (1.0 - y) * np.log(1.0 - pred)))
+            mae_sum  += float(np.sum(np.abs(y - pred)))
+            count    += len(y)
+
+        return loss_sum / count, mae_sum / count
+
+    def run(self):
+        while True:
+            weights, seen = self.pending.get()
+
+            if weights is None:
+                break
+
+            try:
+                start = time.perf_counter()
+                self.model.set_weights(weights)
+                loss, mae = self.evaluate()
+            except Exception as e:
+                print("holdout evaluation failed:", e)
+                continue
+
+            print(f"[{datetime.now().isoformat()}] holdout @ {seen}: loss: {loss:.6f} mae: {mae:.6f}")
+
+            self.metrics_log.record("holdout", seen,
+                loss    = round(loss, 6),
+                mae     = round(mae, 6),
+                seconds = round(time.perf_counter() - start, 3)
+            )
+
+class Adjudicator:
+
+    # tracks the score history of one self-play game and decides when the game
+    # is settled, so the worker doesn't keep labelling near-identical positions
+    def __init__(self, config: dict, tablebase = None):
+        self.win_score  = config["adjudicate_win_score"]
+        self.win_plies  = config["adjudicate_win_plies"]
+        self.draw_score = config["adjudicate_draw_score"]
+        self.draw_plies = config["adjudicate_draw_plies"]
+        self.draw_min   = config["adjudicate_draw_min_ply"]
+        self.tb_pieces  = config["adjudicate_tb_pieces"]
+        self.tablebase  = tablebase
+
+        self.win_streak  = 0
+        self.win_sign    = 0
+        self.draw_streak = 0
+
+    # cp is white-relative. returns "win", "draw", "tb" or None
+    def update(self, board: chess.Board, cp: float, ply: int):
+        sign = 1 if cp > 0 else -1
+
+        if abs(cp) >= self.win_score:
+            self.win_streak = self.win_streak + 1 if sign == self.win_sign else 1
+            self.win_sign   = sign
+        else:
+            self.win_streak = 0
 
+        self.draw_streak = self.draw_streak + 1 if abs(cp) <= self.draw_score else 0
+
+        if self.win_plies > 0 and self.win_streak >= self.win_plies:
+            return "win"
+
+        if self.draw_plies > 0 and ply >= self.draw_min and self.draw_streak >= self.draw_plies:
+            return "draw"
+
+        if self.tb_pieces > 0 and chess.popcount(board.occupied) <= self.tb_pieces:
+            if self.tablebase is None:
+                return "tb"
+
+            try:
+                self.tablebase.probe_wdl(board)
+                return "tb"
+            except (KeyError, chess.syzygy.MissingTableError):
+                pass
+
+        return None
+
+# starts the engine, retrying with a growing delay. None if it keeps failing
+def start_engine(worker_id: int, stop_event: mp.Event, engine_cmd = ENGINE_CMD):
+    for attempt in range(ENGINE_START_RETRIES):
+        try:
+            return chess.engine.SimpleEngine.popen_uci(engine_cmd)
+        except Exception as e:
+            print(f"[worker {worker_id}] failed to start engine: {e}")
+
+        if stop_event.wait(RESTART_BACKOFF_SEC * 2 ** attempt):
+            break
+
+    return None
+
+# a crashed or hung engine is replaced rather than giving up the worker
+def restart_engine(worker_id: int, engine, stop_event: mp.Event, engine_cmd = ENGINE_CMD):
     try:
-        engine = chess.engine.SimpleEngine.popen_uci(ENGINE_CMD)
-    except Exception as e:
-        print(f"[worker {worker_id}] failed to start engine: {e}")
+        engine.quit()
+    except Exception:
+        pass
+
+    return start_engine(worker_id, stop_event, engine_cmd)
+
+# retire_event asks a single worker to stop after its current game (used by the supervisor when scaling down).
+# engine_cmd is anything popen_uci accepts, e.g. [sys.executable, "mockengine.py"] for benchmarks
+def engine_worker(worker_id: int, samples_queue: Queue, stop_event: mp.Event, stats_queue: Queue = None,
+                  retire_event: mp.Event = None, engine_cmd = None):
+    engine_cmd = engine_cmd or ENGINE_CMD
+    print(f"[worker {worker_id}] starting self-play; cmd = {engine_cmd}")
+
+    # local metrics, periodically shipped to the trainer as a snapshot
+    metrics    = Metrics()
+    n_games    = metrics.counter("games")
+    n_plies    = metrics.counter("plies")
+    n_labelled = metrics.counter("positions")
+    n_samples  = metrics.counter("samples")
+    n_full     = metrics.counter("queue_full")
+    n_errors   = metrics.counter("engine_errors")
+    n_restarts = metrics.counter("engine_restarts")
+    anal_time  = metrics.histogram("analyse_seconds")
+    n_skipped  = metrics.counter("adjudicated_plies")
+    n_saved    = metrics.counter("analyse_seconds_saved")
+    last_stats = time.time()
+
+    # without an engine the process just ends, the supervisor restarts it later
+    engine = start_engine(worker_id, stop_event, engine_cmd)
+    if engine is None:
         return
-    
+
+    started = time.time()
+
     try:
         good_book = chess.polyglot.open_reader(GOOD_BOOK_PATH)
         bad_book  = chess.polyglot.open_reader(BAD_BOOK_PATH)
@@ -320,21 +573,49 @@ def engine_worker(worker_id: int, samples_queue: Queue, stop_event: mp.Event):
         good_book = None
         bad_book  = None
 
+    tablebase = None
+    if CONFIG["syzygy_path"]:
+        try:
+            tablebase = chess.syzygy.open_tablebase(CONFIG["syzygy_path"])
+        except Exception as e:
+            print(f"[worker {worker_id}] failed to open tablebase: {e}")
+
+    writer = None
+    if GAMES_DIR is not None:
+        os.makedirs(GAMES_DIR, exist_ok = True)
+        path   = os.path.join(GAMES_DIR, f"selfplay_{worker_id}_{int(time.time())}{gameformat.EXTENSION}")
+        writer = gameformat.GameWriter(path, compress = GAMES_COMPRESS)
+
     rng = random.Random(time.time() + worker_id)
 
-    while not stop_event.is_set():
+    while not stop_event.is_set() and not (retire_event is not None and retire_event.is_set()):
         load_config()
 
-        board = chess.Board()
+        # the tracker owns the board and keeps its features updated move by move
+        tracker = features.FeatureTracker()
+        board   = tracker.board
         plies = 0
         random_move_freq = rng.random() * CONFIG["random_move_freq"]
+        adjudicator      = Adjudicator(CONFIG, tablebase)
+        verdict          = None
+        scores           = {}
+        game_errors      = 0
+        n_games.inc()
 
         while plies < MAX_PLIES and not stop_event.is_set():
+            if stats_queue is not None and time.time() - last_stats > WORKER_METRICS_EVERY_SEC:
+                metrics.gauge("uptime_seconds").set(time.time() - started)
+                try:
+                    stats_queue.put_nowait((worker_id, metrics.snapshot()))
+                except Exception:
+                    pass
+                last_stats = time.time()
+
             # random move chance
             if rng.random() < random_move_freq:
                 legal_moves = list(board.legal_moves)
                 move        = rng.choice(legal_moves)
-                board.push(move)
+                tracker.push(move)
 
             # random polyglot book move
             elif plies < CONFIG["book_moves"]:
@@ -343,7 +624,7 @@ def engine_worker(worker_id: int, samples_queue: Queue, stop_event: mp.Event):
                     entries = list(book.find_all(board))
                     if entries:
                         entry = random.choice(entries)
-                        board.push(entry.move)
+                        tracker.push(entry.move)
                 except Exception:
                     pass
 
@@ -351,30 +632,70 @@ def engine_worker(worker_id: int, samples_queue: Queue, stop_event: mp.Event):
             else:
                 try:
                     move_depth = rng.randint(1, 8)
-                    result     = engine.play(board, chess.engine.Limit(depth = move_depth))
+
+                    with metrics.timer("play_seconds"):
+                        result = engine.play(board, chess.engine.Limit(depth = move_depth))
 
                     if result.move is None:
                         break
 
-                    board.push(result.move)
+                    tracker.push(result.move)
                 except Exception as e:
                     print(f"[worker {worker_id}] play() error: {e}")
-                    break
+                    n_errors.inc()
+                    game_errors += 1
+
+                    engine = restart_engine(worker_id, engine, stop_event, engine_cmd)
+                    n_restarts.inc()
+                    if engine is None or game_errors >= MAX_GAME_ERRORS:
+                        break
+
+                    # the position is unchanged, try the same ply again
+                    continue
 
             plies += 1
+            n_plies.inc()
+
             if board.is_game_over():
                 break
 
+            # filtering is far cheaper than the analyse call it saves
+            bucket = filters.ply_bucket(plies)
+            metrics.counter(f"filter_seen_{bucket}").inc()
+
+            with metrics.timer("filter_seconds"):
+                reason = filters.classify(board, CONFIG["filter_in_check"], CONFIG["filter_captures"], CONFIG["filter_see_threshold"])
+
+            if reason is not None:
+                metrics.counter(f"filter_{reason}").inc()
+
+                if rng.random() >= CONFIG["filter_keep_freq"]:
+                    metrics.counter(f"filter_skipped_{bucket}").inc()
+                    continue
+
             try:
+                start = time.perf_counter()
                 info  = engine.analyse(board, chess.engine.Limit(
                     #depth = rng.randint(CONFIG["min_depth"], CONFIG["max_depth"])
                     depth = 1
                 ))
                 score = info.get("score")
+                anal_time.observe(time.perf_counter() - start)
 
             except Exception as e:
                 print(f"[worker {worker_id}] analyse() error: {e}")
-                break
+                n_errors.inc()
+                game_errors += 1
+
+                engine = restart_engine(worker_id, engine, stop_event, engine_cmd)
+                n_restarts.inc()
+                if engine is None or game_errors >= MAX_GAME_ERRORS:
+                    break
+
+                # this ply just stays unlabelled
+                continue
+
+            n_labelled.inc()
 
             if not score:
                 continue
@@ -387,94 +708,318 @@ def engine_worker(worker_id: int, samples_queue: Queue, stop_event: mp.Event):
             else:
                 cp = np.clip(sc.score(), -1800, 1800)
 
+            verdict = adjudicator.update(board, cp, plies)
+
             # if black is the active side, the score must be inverted
             if board.turn == chess.BLACK:
                 cp = -cp
 
             # map cp to [0,1]
             target = 1.0 / (1.0 + np.exp(-cp / 400.0))
+            scores[len(board.move_stack) - 1] = cp
 
-            # generate feature indices for both the real
-            # board and the vertically mirrored version
-            w_indices, b_indices, m_w_indices, m_b_indices = board_features(board)
-
-            w_np = np.array(w_indices, dtype = np.int32)
-            b_np = np.array(b_indices, dtype = np.int32)
-            m_w_np = np.array(m_w_indices, dtype = np.int32)
-            m_b_np = np.array(m_b_indices, dtype = np.int32)
+            # feature indices for both the real board and the vertically
+            # mirrored version, already updated incrementally by the tracker
+            with metrics.timer("featurize_seconds"):
+                w_indices, b_indices, m_w_indices, m_b_indices = tracker.features()
 
-            try:
-                if (board.turn == chess.WHITE):
-                    samples_queue.put(((w_np, b_np), float(target)), timeout = 1.0)
+                w_np = np.array(w_indices, dtype = np.int32)
+                b_np = np.array(b_indices, dtype = np.int32)
+                m_w_np = np.array(m_w_indices, dtype = np.int32)
+                m_b_np = np.array(m_b_indices, dtype = np.int32)
 
-                    if CONFIG["mirror_enabled"]:
-                        samples_queue.put(((m_w_np, m_b_np), float(target)), timeout = 1.0)
+            # the side to move is always the active accumulator
+            if board.turn == chess.WHITE:
+                own, opp, m_own, m_opp = w_np, b_np, m_w_np, m_b_np
+            else:
+                own, opp, m_own, m_opp = b_np, w_np, m_b_np, m_w_np
 
-                        samples_queue.put(((b_np, w_np), float(1.0 - target)), timeout = 1.0)
-                        samples_queue.put(((m_b_np, m_w_np), float(1.0 - target)), timeout = 1.0)
+            samples = [((own, opp), float(target))]
 
-                else:
-                    samples_queue.put(((b_np, w_np), float(target)), timeout = 1.0)
+            if CONFIG["mirror_enabled"]:
+                samples.append(((m_own, m_opp), float(target)))
 
-                    if CONFIG["mirror_enabled"]:
-                        samples_queue.put(((m_b_np, m_w_np), float(target)), timeout = 1.0)
+                samples.append(((opp, own), float(1.0 - target)))
+                samples.append(((m_opp, m_own), float(1.0 - target)))
 
-                        samples_queue.put(((w_np, b_np), float(1.0 - target)), timeout = 1.0)
-                        samples_queue.put(((m_w_np, m_b_np), float(1.0 - target)), timeout = 1.0)
+            try:
+                with metrics.timer("put_seconds"):
+                    for sample in samples:
+                        samples_queue.put(sample, timeout = 1.0)
+                        n_samples.inc()
 
             except Exception:
+                n_full.inc()
                 time.sleep(0.05)
 
+            # the game is decided. the remaining plies (up to MAX_PLIES, so an upper
+            # bound) would each have cost an analyse call of roughly the mean duration
+            if verdict is not None:
+                skipped = MAX_PLIES - plies
+                labels  = sum(anal_time.counts)
+
+                metrics.counter(f"adjudicated_{verdict}").inc()
+                n_skipped.inc(skipped)
+                n_saved.inc(skipped * anal_time.sum / max(1, labels))
+                break
+
+        if writer is not None:
+            if board.is_game_over():
+                result = board.result()
+            elif verdict == "win":
+                result = "1-0" if adjudicator.win_sign > 0 else "0-1"
+            elif verdict == "draw":
+                result = "1/2-1/2"
+            else:
+                result = None
+
+            writer.begin()
+            for i, move in enumerate(board.move_stack):
+                writer.add(move, scores.get(i))
+            writer.end(result)
+
         time.sleep(0.01)
 
+        # the engine couldn't be restarted, leave it to the supervisor
+        if engine is None:
+            break
+
+    if writer is not None:
+        writer.close()
+
+    # final counters, so nothing since the last periodic snapshot is lost
+    if stats_queue is not None:
+        metrics.gauge("uptime_seconds").set(time.time() - started)
+        try:
+            stats_queue.put((worker_id, metrics.snapshot()), timeout = 1.0)
+        except Exception:
+            pass
+
     try:
         engine.quit()
     except Exception:
         pass
     print(f"[worker {worker_id}] stopping.")
 
-def trainer_loop(model, samples_queue: Queue, stop_event: mp.Event):
-    last_save = time.time()
-    x_batch   = []  # list of tuples (active, passive)
-    y_batch   = []
-    seen      = 0
+def drain_stats(metrics: Metrics, stats_queue: Queue):
+    # absorb all worker snapshots that have arrived so far. a None snapshot is
+    # the supervisor's note that the worker is gone, queued behind its last one
+    while True:
+        try:
+            worker_id, snapshot = stats_queue.get_nowait()
+        except Exception:
+            return
+
+        if snapshot is None:
+            metrics.retire(f"worker_{worker_id}")
+        else:
+            metrics.absorb(f"worker_{worker_id}", snapshot)
+
+class WorkerSupervisor(threading.Thread):
+
+    # owns the generator processes: restarts the ones that die (with exponential
+    # backoff) and scales their number by the fill level of the samples queue.
+    # every process gets a fresh id. a worker that has exited is retired in the
+    # trainer's metrics - its final counters stay in the summed worker metrics,
+    # so they never go backwards, but its own entries are dropped
+    def __init__(self, mp_ctx, samples_queue: Queue, stop_event: mp.Event, stats_queue: Queue, metrics: Metrics):
+        super().__init__(name = "supervisor", daemon = True)
+
+        self.mp_ctx        = mp_ctx
+        self.samples_queue = samples_queue
+        self.stop_event    = stop_event
+        self.stats_queue   = stats_queue
+        self.metrics       = metrics
+
+        self.target     = max(MIN_WORKERS, min(MAX_WORKERS, NUM_WORKERS))
+        self.workers    = []   # [process, retire event, start time, id]
+        self.exited     = []   # ids still to be retired in the trainer's metrics
+        self.next_id    = 0
+        self.failures   = 0
+        self.next_start = 0.0
+        self.last_scale = time.time()
+        self.fill       = None
+
+        self.g_active = metrics.gauge("workers_active")
+        self.g_target = metrics.gauge("workers_target")
+        self.g_fill   = metrics.gauge("queue_fill")
+
+    def spawn(self):
+        retire = self.mp_ctx.Event()
+        p = self.mp_ctx.Process(
+            target = engine_worker,
+            args   = (self.next_id, self.samples_queue, self.stop_event, self.stats_queue, retire),
+            daemon = True
+        )
+        p.start()
+
+        self.workers.append([p, retire, time.time(), self.next_id])
+        self.next_id += 1
+
+    def reap(self):
+        now = time.time()
+
+        for w in list(self.workers):
+            p, retire, started, worker_id = w
+            if p.is_alive():
+                continue
+
+            self.workers.remove(w)
+            self.exited.append(worker_id)
+
+            if retire.is_set() or self.stop_event.is_set():
+                continue
+
+            # crashed - back off, unless it had been running fine for a while
+            self.failures = 0 if now - started > WORKER_STABLE_SEC else self.failures + 1
+            delay = min(RESTART_BACKOFF_MAX, RESTART_BACKOFF_SEC * 2 ** (self.failures - 1)) if self.failures else 0.0
+
+            self.next_start = max(self.next_start, now + delay)
+            self.metrics.counter("worker_restarts").inc()
+            print(f"[supervisor] worker died (exit code {p.exitcode}), restarting in {delay:.0f}s")
+
+    # through the stats queue, so that the note arrives after the worker's final
+    # snapshot (it was flushed before the process exited). a full queue is
+    # retried on the next round
+    def retire_exited(self):
+        while self.exited:
+            try:
+                self.stats_queue.put_nowait((self.exited[0], None))
+            except Exception:
+                return
+            self.exited.pop(0)
+
+    def scale(self):
+        try:
+            fill = self.samples_queue.qsize() / SAMPLES_QUEUE_MAX
+        except NotImplementedError:
+            return
+
+        self.fill = fill if self.fill is None else 0.9 * self.fill + 0.1 * fill
+        self.g_fill.set(round(self.fill, 4))
+
+        if time.time() - self.last_scale < SCALE_EVERY_SEC:
+            return
+
+        if self.fill < QUEUE_LOW_FILL and self.target < MAX_WORKERS:
+            self.target += 1
+            self.metrics.counter("workers_scaled_up").inc()
+        elif self.fill > QUEUE_HIGH_FILL and self.target > MIN_WORKERS:
+            self.target -= 1
+            self.metrics.counter("workers_scaled_down").inc()
+        else:
+            return
+
+        self.last_scale = time.time()
+        print(f"[supervisor] queue fill {self.fill:.2f}, scaling to {self.target} workers")
+
+    def run(self):
+        while not self.stop_event.wait(SUPERVISE_EVERY_SEC):
+            self.reap()
+            self.retire_exited()
+            self.scale()
+
+            active = [w for w in self.workers if not w[1].is_set()]
+
+            if len(active) < self.target and time.time() >= self.next_start:
+                self.spawn()
+
+            # the newest worker finishes its game and leaves
+            elif len(active) > self.target:
+                active[-1][1].set()
+
+            self.g_active.set(len(active))
+            self.g_target.set(self.target)
+
+    def start(self):
+        for _ in range(self.target):
+            self.spawn()
+        super().start()
+        return self
+
+    def join_workers(self, timeout: float = 2.0):
+        for p, _, _, _ in self.workers:
+            p.join(timeout = timeout)
+
+def trainer_loop(model, samples_queue: Queue, stop_event: mp.Event, metrics: Metrics, metrics_log: MetricsLog,
+                 validator: HoldoutValidator = None, stats_queue: Queue = None):
+    last_save    = time.time()
+    last_report  = time.time()
+    x_batch      = []  # list of tuples (active, passive)
+    y_batch      = []
+    seen         = 0
+    last_holdout = 0
+    loss = mae   = 0.0
+
+    n_samples  = metrics.counter("samples")
+    n_batches  = metrics.counter("batches")
+    n_timeouts = metrics.counter("queue_timeouts")
+    wait_time  = metrics.histogram("queue_wait_seconds")
+    q_depth    = metrics.gauge("queue_depth")
 
     try:
         while not stop_event.is_set():
             try:
-                x, y = samples_queue.get(timeout = 1.0)
+                start = time.perf_counter()
+                x, y  = samples_queue.get(timeout = 1.0)
+                wait_time.observe(time.perf_counter() - start)
             except Exception:
-                pass
+                n_timeouts.inc()
             else:
                 x_batch.append(x)
                 y_batch.append(y)
 
             if len(x_batch) >= BATCH_SIZE:
                 # build ragged tensors separately for both accumulators
-                active  = [pair[0] for pair in x_batch]
-                passive = [pair[1] for pair in x_batch]
+                with metrics.timer("assembly_seconds"):
+                    active  = [pair[0] for pair in x_batch]
+                    passive = [pair[1] for pair in x_batch]
 
-                x_active  = tf.ragged.constant(active,  dtype = tf.int32)
-                x_passive = tf.ragged.constant(passive, dtype = tf.int32)
-                x_pcnts   = np.array([len(a) + 2 for a in active], dtype = np.int32)
+                    x_active  = tf.ragged.constant(active,  dtype = tf.int32)
+                    x_passive = tf.ragged.constant(passive, dtype = tf.int32)
+                    x_pcnts   = np.array([len(a) + 2 for a in active], dtype = np.int32)
 
-                y_np = np.array(y_batch, dtype = np.float32).reshape(-1, 1)
+                    y_np = np.array(y_batch, dtype = np.float32).reshape(-1, 1)
 
-                loss, mae = model.train_on_batch(
-                    [x_active, x_passive, x_pcnts], y_np
-                )
+                with metrics.timer("step_seconds"):
+                    loss, mae = model.train_on_batch(
+                        [x_active, x_passive, x_pcnts], y_np
+                    )
 
                 seen += len(x_batch)
+                n_samples.inc(len(x_batch))
+                n_batches.inc()
                 x_batch.clear()
                 y_batch.clear()
 
-                timestamp = datetime.now().isoformat()
-                print(f"[{timestamp}] samples: {seen} loss: {loss:.6f} mae: {mae:.6f} lr: {model.optimizer.learning_rate:.8f}")
+                # hand a weight snapshot to the background holdout evaluation
+                if validator is not None and seen - last_holdout >= HOLDOUT_EVERY:
+                    validator.submit(model.get_weights(), seen)
+                    last_holdout = seen
+
+            # periodic metrics record, one line instead of one per batch
+            if time.time() - last_report > METRICS_EVERY_SEC:
+                if stats_queue is not None:
+                    drain_stats(metrics, stats_queue)
+
+                try:
+                    q_depth.set(samples_queue.qsize())
+                except NotImplementedError:
+                    pass
+
+                lr = float(model.optimizer.learning_rate)
+                metrics.gauge("loss").set(round(float(loss), 6))
+                metrics.gauge("mae").set(round(float(mae), 6))
+                metrics.gauge("lr").set(lr)
+
+                report = metrics.report()
+                report.update(filters.filtered_fractions(report))
+                metrics_log.record("train", seen, **report)
 
-                # CSV log (logs are limited to avoid spam)
-                if (seen % 32768 == 0):
-                    with open('log.csv', "a") as f:
-                        f.write(f"{seen},{loss:.6f},{mae:.6f},{timestamp}\n")
+                print(f"[{datetime.now().isoformat()}] samples: {seen} loss: {loss:.6f} mae: {mae:.6f} lr: {lr:.8f} "
+                    + f"samples/s: {report.get('samples_per_sec', 0):.0f} queue: {q_depth.value} "
+                    + f"workers: {report.get('workers_active', 0)} adjudication saved: {report.get('workers_analyse_seconds_saved', 0):.0f}s")
+                last_report = time.time()
 
             # periodic save by wall-clock
             if time.time() - last_save > SAVE_EVERY_SEC:
@@ -497,6 +1042,10 @@ def trainer_loop(model, samples_queue: Queue, stop_event: mp.Event):
             print(f"[{datetime.now().isoformat()}] final save weights ({count} floats) -> {WEIGHTS_PATH}, shapes -> {SHAPES_PATH}")
         except Exception as e:
             print("final save failed:", e)
+
+        if validator is not None:
+            validator.stop()
+        metrics_log.flush()
         stop_event.set()
 
 def main():
@@ -513,25 +1062,36 @@ def main():
         except Exception as e:
             print("\nerror while loading weights: ", e)
 
-    # create the CSV log file if it doesn't exist
-    if not os.path.exists('log.csv'):
-        with open('log.csv', "w") as f:
-            f.write("samples,loss,mae,timestamp\n")
+    # metrics stream and the optional scrape endpoint
+    metrics     = Metrics()
+    metrics_log = MetricsLog(METRICS_PATH)
+    server      = None
+
+    if METRICS_PORT is not None:
+        server = MetricsServer(metrics, METRICS_PORT).start()
+        print(f"\nserving metrics on http://127.0.0.1:{METRICS_PORT}/metrics\n")
+
+    # optional holdout set, evaluated in the background
+    validator = None
+    holdout   = load_holdout()
+
+    if holdout is not None:
+        print(f"\nloaded holdout set ({len(holdout['target'])} positions).\n")
+        validator = HoldoutValidator(holdout, metrics_log)
+        validator.start()
 
     # set up multiprocessing
     mp_ctx        = mp.get_context("spawn")
     samples_queue = mp_ctx.Queue(maxsize = SAMPLES_QUEUE_MAX)
+    stats_queue   = mp_ctx.Queue(maxsize = STATS_QUEUE_MAX)
     stop_event    = mp_ctx.Event()
 
-    workers = []
-    for i in range(NUM_WORKERS):
-        p = mp_ctx.Process(
-            target = engine_worker,
-            args   = (i, samples_queue, stop_event),
-            daemon = True
-        )
-        p.start()
-        workers.append(p)
+    supervisor = WorkerSupervisor(mp_ctx, samples_queue, stop_event, stats_queue, metrics).start()
+
+    ingest = None
+    if INGEST_PORT is not None:
+        ingest = IngestServer(samples_queue, stop_event, INGEST_TOKEN, metrics, INGEST_HOST, INGEST_PORT).start()
+        print(f"\naccepting remote samples on {INGEST_HOST}:{INGEST_PORT}\n")
 
     def handle_sigint(signum, frame):
         print("stopping...")
@@ -539,12 +1099,18 @@ def main():
     signal.signal(signal.SIGINT, handle_sigint)
 
     try:
-        trainer_loop(model, samples_queue, stop_event)
+        trainer_loop(model, samples_queue, stop_event, metrics, metrics_log, validator, stats_queue)
     finally:
         print("waiting for workers...")
         stop_event.set()
-        for p in workers:
-            p.join(timeout = 2.0)
+        supervisor.join()
+        supervisor.join_workers()
+
+        if ingest is not None:
+            ingest.stop()
+
+        if server is not None:
+            server.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -7,14 +7,19 @@ import keras
 from keras import layers, models, optimizers, losses
 import chess
 
+# feature indexing is shared with train.py, so both produce the engine layout
+import features
+import gameformat
+from features import FEATURE_COUNT, board_features
+
 # -------------------------
 # SETTINGS
 # -------------------------
 DATA_DIR      = "C:\\Users\\michn\\Desktop\\positions"        # folder with your 12 text files
 WEIGHTS_PATH  = "weights\\nnue_weights.bin"
 SHAPES_PATH   = "weights\\nnue_shapes.json"
+LAYOUT_PATH   = "weights\\nnue_features.json"
 
-FEATURE_COUNT = 40960
 EMBED_DIM     = 128
 H1_NEURONS    = 16
 H2_NEURONS    = 32
@@ -34,67 +39,6 @@ BUCKET_TABLE = tf.constant([
     6, 7, 7, 7
 ], dtype = tf.int32)
 
-# -------------------------
-# FEATURE INDEXING (UNCHANGED)
-# -------------------------
-
-def feature_index(king_square: int, piece_type: int, is_black: bool, piece_square: int) -> int:
-
-    piece_type_idx = piece_type - 1
-    color_bit      = 1 if is_black else 0
-
-    king_offset  = king_square * 640
-    piece_offset = (piece_type_idx * 2 + color_bit) * 64 + piece_square
-
-    return int(king_offset + piece_offset)
-
-
-def board_features(board: chess.Board):
-    w_indices = []
-    b_indices = []
-
-    w_king_sq = board.king(chess.WHITE)
-    b_king_sq = board.king(chess.BLACK)
-
-    # if a king is missing (shouldn't happen in legal positions), we still produce empty lists.
-    if w_king_sq is None or b_king_sq is None:
-        return []
-
-    for sq in chess.SQUARES:
-        piece = board.piece_at(sq)
-
-        # empty square
-        if piece is None:
-            continue
-
-        # kings are excluded
-        if piece.piece_type == chess.KING:
-            continue
-
-        # piece_color True if black, False if white
-        is_black = piece.color == chess.BLACK
-
-        # index into white accumulator (white king as reference)
-        idx_w = feature_index(
-            king_square  = w_king_sq,
-            piece_type   = piece.piece_type,
-            is_black     = is_black,
-            piece_square = sq
-        )
-        # index into black accumulator (black king as reference)
-        idx_b = feature_index(
-            king_square  = b_king_sq ^ 56 ^ 7,
-            piece_type   = piece.piece_type,
-            is_black     = not is_black,
-            piece_square = sq ^ 56 ^ 7
-        )
-
-        w_indices.append(idx_w)
-        b_indices.append(idx_b)
-
-    return w_indices, b_indices
-
-
 # -------------------------
 # MODEL (UNCHANGED)
 # -------------------------
@@ -102,7 +46,7 @@ def board_features(board: chess.Board):
 def ClippedReLU(x):
     return keras.activations.relu(x, max_value=1.0)
 
-def build_model() -> keras.Model:
+def build_model(factorize: bool = features.FACTORIZE) -> keras.Model:
     # two ragged int inputs (variable-length lists of feature indices)
     inp_active  = layers.Input(shape = (None,), ragged = True, dtype = 'int32', name = 'Input_Active')
     inp_passive = layers.Input(shape = (None,), ragged = True, dtype = 'int32', name = 'Input_Passive')
@@ -131,6 +75,14 @@ def build_model() -> keras.Model:
         name         = 'Accumulator_Passive'
     )(emb_passive)
 
+    # factorized training - the shared piece-square rows of all active features
+    # are added to the accumulators as well (folded into the main table on export)
+    if factorize:
+        factor_active, factor_passive = features.factor_accumulators(inp_active, inp_passive, EMBED_DIM)
+
+        summed_active  = layers.Add(name = 'Accumulator_Active_Factorized')([summed_active, factor_active])
+        summed_passive = layers.Add(name = 'Accumulator_Passive_Factorized')([summed_passive, factor_passive])
+
     # concatenate the two accumulators
     concat = layers.Concatenate(name = 'Accumulator_Concat')([summed_active, summed_passive])
 
@@ -193,13 +145,36 @@ def score_to_target(cp: float) -> float:
 # LOAD DATA
 # -------------------------
 
+def make_sample(board, cp, w, b):
+    if board.turn == chess.WHITE:
+        active, passive = w, b
+    else:
+        active, passive = b, w
+
+    pcnt = len(active) + 2
+    target = score_to_target(cp)
+
+    if pcnt > 32:
+        return None
+
+    return np.array(active, np.int32), np.array(passive, np.int32), np.int32(pcnt), np.float32(target)
+
 def data_generator():
 
-    files = sorted(glob.glob(os.path.join(DATA_DIR, "*.txt")))
+    # fen;cp text files and compact game files (gameformat.py) can be mixed
+    files = sorted(glob.glob(os.path.join(DATA_DIR, "*.txt")) + glob.glob(os.path.join(DATA_DIR, f"*{gameformat.EXTENSION}")))
 
     for file in files:
         print("Reading:", file)
 
+        # games are replayed, with the features updated incrementally
+        if file.endswith(gameformat.EXTENSION):
+            for board, cp, (w, b, _, _) in gameformat.iter_positions(file):
+                sample = make_sample(board, cp, w, b)
+                if sample is not None:
+                    yield sample
+            continue
+
         with open(file, "r", encoding="utf-8") as f:
             for line in f:
                 try:
@@ -207,20 +182,11 @@ def data_generator():
                     cp = float(cp)
                     board = chess.Board(fen)
 
-                    w, b = board_features(board)
-
-                    if board.turn == chess.WHITE:
-                        active, passive = w, b
-                    else:
-                        active, passive = b, w
+                    w, b, _, _ = board_features(board)
 
-                    pcnt = len(active) + 2
-                    target = score_to_target(cp)
-
-                    if pcnt > 32:
-                        continue
-
-                    yield np.array(active, np.int32), np.array(passive, np.int32), np.int32(pcnt), np.float32(target)
+                    sample = make_sample(board, cp, w, b)
+                    if sample is not None:
+                        yield sample
 
                 except:
                     continue
@@ -237,6 +203,8 @@ def save_pure_weights(model):
     with open(SHAPES_PATH, "w") as f:
         json.dump([list(s) for s in shapes], f)
 
+    features.save_layout(LAYOUT_PATH, features.factor_slot(model))
+
     print(f"\n✅ Saved pure weights to {WEIGHTS_PATH}")
     print(f"✅ Saved shapes to {SHAPES_PATH}")
 
@@ -259,6 +227,9 @@ def load_pure_weights(model):
         weights.append(w)
         idx += size
 
+    # the weights may have been saved with a different feature layout
+    weights = features.import_weights(weights, features.load_layout(LAYOUT_PATH), features.factor_slot(model))
+
     model.set_weights(weights)
 
     print(f"\n✅ Loaded pure weights from {WEIGHTS_PATH}")
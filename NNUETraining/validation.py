@@ -12,6 +12,9 @@ import tensorflow as tf
 from keras import layers, models, losses, activations, metrics
 import chess
 
+import features
+from features import FEATURE_COUNT, board_features
+
 # only log warnings and errors
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
 
@@ -19,8 +22,8 @@ os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
 SCRIPT_DIR   = os.path.dirname(os.path.abspath(__file__))
 WEIGHTS_PATH = os.path.join(SCRIPT_DIR, "weights\\nnue_weights.bin")
 SHAPES_PATH  = os.path.join(SCRIPT_DIR, "weights\\nnue_shapes.json")
+LAYOUT_PATH  = os.path.join(SCRIPT_DIR, "weights\\nnue_features.json")
 
-FEATURE_COUNT     = 40960
 EMBED_DIM         = 256
 H1_NEURONS        = 16
 H2_NEURONS        = 16
@@ -36,64 +39,6 @@ BUCKET_TABLE = tf.constant([
     6, 7, 7, 7
 ], dtype = tf.int32)
 
-def feature_index(king_square: int, piece_type: int, is_black: bool, piece_square: int) -> int:
-
-    # map piece_type 1..5 into 0..4
-    piece_type_idx = piece_type - 1
-    color_bit      = 1 if is_black else 0
-
-    king_offset  = king_square * 640
-    piece_offset = (piece_type_idx * 2 + color_bit) * 64 + piece_square
-
-    f = king_offset + piece_offset
-    
-    return int(f)
-
-def board_features(board: chess.Board):
-    w_indices = []
-    b_indices = []
-
-    w_king_sq = board.king(chess.WHITE)
-    b_king_sq = board.king(chess.BLACK)
-
-    # if a king is missing (shouldn't happen in legal positions), we still produce empty lists.
-    if w_king_sq is None or b_king_sq is None:
-        return []
-
-    for sq in chess.SQUARES:
-        piece = board.piece_at(sq)
-
-        # empty square
-        if piece is None:
-            continue
-
-        # kings are excluded
-        if piece.piece_type == chess.KING:
-            continue
-
-        # piece_color True if black, False if white
-        is_black = piece.color == chess.BLACK
-
-        # index into white accumulator (white king as reference)
-        idx_w = feature_index(
-            king_square  = w_king_sq,
-            piece_type   = piece.piece_type,
-            is_black     = is_black,
-            piece_square = sq
-        )
-        # index into black accumulator (black king as reference)
-        idx_b = feature_index(
-            king_square  = b_king_sq ^ 56,
-            piece_type   = piece.piece_type,
-            is_black     = not is_black,
-            piece_square = sq ^ 56
-        )
-
-        w_indices.append(idx_w)
-        b_indices.append(idx_b)
-
-    return w_indices, b_indices
-
 def ClippedReLU(x):
     return activations.relu(x, max_value = 1.0)
 
@@ -206,6 +151,9 @@ def load_weights_binary(model, weights_path = WEIGHTS_PATH, shapes_path = SHAPES
         weights.append(w)
         idx += size
 
+    # convert to the current layout, with any factor table folded in
+    weights = features.import_weights(weights, features.load_layout(LAYOUT_PATH))
+
     try:
         model.set_weights(weights)
     except Exception as e:
@@ -240,7 +188,7 @@ test_positions = {
 
 # evaluate all positions
 for name, board in test_positions.items():
-    w_indices, b_indices = board_features(board)
+    w_indices, b_indices, _, _ = board_features(board)
     
     xw    = tf.ragged.constant([w_indices], dtype = tf.int32)
     xb    = tf.ragged.constant([b_indices], dtype = tf.int32)